@@ -0,0 +1,349 @@
+import json
+import os
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# --------------------
+# Config (override with environment variables)
+# --------------------
+ASTERIX_HOST = os.environ.get("ASTERIX_HOST", "localhost")
+ASTERIX_PORT = int(os.environ.get("ASTERIX_PORT", "19002"))
+CONNECT_TIMEOUT = float(os.environ.get("ASTERIX_CONNECT_TIMEOUT", "10"))   # seconds
+READ_TIMEOUT = float(os.environ.get("ASTERIX_READ_TIMEOUT", "3600"))       # seconds; index builds are slow
+RETRIES = int(os.environ.get("ASTERIX_RETRIES", "3"))
+BACKOFF = 0.5            # seconds; doubled after each failed attempt
+POOL_SIZE = 64           # keep-alive connections (>= the largest client concurrency)
+POLL_INTERVAL = 0.005    # seconds before re-polling async jobs; doubled while none completes
+MAX_POLL_INTERVAL = 1.0  # seconds
+
+HEADERS = {"Content-Type": "application/x-www-form-urlencoded"}
+
+# HTTP statuses worth retrying: the server or a proxy was temporarily unavailable
+TRANSIENT_STATUSES = {502, 503, 504}
+
+# Async job statuses that mean "not finished yet"
+PENDING_STATUSES = {"queued", "running"}
+
+
+def parse_time_to_seconds(time_str):
+    """
+    Parse time string from AsterixDB metrics to seconds.
+    Supports formats: "2.871s", "115.961ms", "1.5m", "500ns", "500µs"
+    """
+    time_str = time_str.strip()
+
+    if time_str.endswith('ns'):
+        # nanoseconds
+        return float(time_str.rstrip('ns')) / 1_000_000_000
+    elif time_str.endswith('µs') or time_str.endswith('us'):
+        # microseconds
+        value = time_str.rstrip('µs').rstrip('us')
+        return float(value) / 1_000_000
+    elif time_str.endswith('ms'):
+        # milliseconds
+        return float(time_str.rstrip('ms')) / 1_000
+    elif time_str.endswith('s'):
+        # seconds
+        return float(time_str.rstrip('s'))
+    elif time_str.endswith('m'):
+        # minutes
+        return float(time_str.rstrip('m')) * 60
+    elif time_str.endswith('h'):
+        # hours
+        return float(time_str.rstrip('h')) * 3600
+    else:
+        # default to seconds if no unit
+        return float(time_str)
+
+
+def result_ids(rows):
+    """Extract record ids from `SELECT row.idx` results ({"idx": ..} or {"row.idx": ..})."""
+    ids = []
+    for row in rows:
+        if "idx" in row:
+            ids.append(row["idx"])
+        elif "row.idx" in row:
+            ids.append(row["row.idx"])
+        else:
+            raise ValueError(f"Unexpected row format: {row}")
+    return ids
+
+
+class AsterixQueryError(Exception):
+    """An async job finished with a status other than "success"."""
+
+
+class QueryResponse:
+    """Parsed query service response plus the client-observed round-trip time."""
+
+    def __init__(self, js, text, client_time):
+        self.json = js
+        self.text = text
+        self.client_time = client_time
+
+    @property
+    def results(self):
+        return self.json.get("results", [])
+
+    @property
+    def metrics(self):
+        return self.json.get("metrics", {})
+
+    def metric_values(self):
+        """Every reported metric as a number: times ("2.8ms") in seconds, counts unchanged."""
+        values = {}
+        for name, value in self.metrics.items():
+            if isinstance(value, str):
+                try:
+                    value = parse_time_to_seconds(value)
+                except ValueError:
+                    continue
+            values[name] = value
+        return values
+
+    def timings(self):
+        """
+        Server "execution"/"elapsed"/"compile"/"queue_wait" and client
+        round-trip "client" times in seconds (0 for times the server does not
+        report), plus the server's "result_count", "result_size" (bytes) and
+        "processed_objects" counts (None if not reported).
+        """
+        metrics = self.metrics
+        return {
+            "execution": parse_time_to_seconds(metrics.get("executionTime", "0s")),
+            "elapsed": parse_time_to_seconds(metrics.get("elapsedTime", "0s")),
+            "compile": parse_time_to_seconds(metrics.get("compileTime", "0s")),
+            "queue_wait": parse_time_to_seconds(metrics.get("queueWaitTime", "0s")),
+            "client": self.client_time,
+            "result_count": metrics.get("resultCount"),
+            "result_size": metrics.get("resultSize"),
+            "processed_objects": metrics.get("processedObjects"),
+        }
+
+
+class AsterixClient:
+    """
+    Client for the AsterixDB query service.
+
+    Uses one pooled keep-alive session so benchmark queries do not pay TCP
+    connection setup, and retries transient 5xx responses and connection
+    errors of idempotent requests (GETs, and statements marked idempotent)
+    with exponential backoff. Other statements (loads, upserts, DDL) are
+    retried only when the connection could not be opened, since the server
+    may already have applied them. Safe to share between threads.
+    """
+
+    def __init__(self, host=ASTERIX_HOST, port=ASTERIX_PORT, connect_timeout=CONNECT_TIMEOUT,
+                 read_timeout=READ_TIMEOUT, retries=RETRIES, backoff=BACKOFF, pool_size=POOL_SIZE):
+        self.base_url = f"http://{host}:{port}"
+        self.url = f"{self.base_url}/query/service"
+        self.timeout = (connect_timeout, read_timeout)
+        self.retries = retries
+        self.backoff = backoff
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers.update(HEADERS)
+
+    def post(self, data, idempotent=False):
+        """POST form data to the query service (see request for retries)."""
+        return self.request("POST", self.url, idempotent=idempotent, data=data)
+
+    def request(self, method, url, idempotent=True, **kwargs):
+        """
+        Send one HTTP request. Idempotent requests are retried after transient
+        5xx responses and connection errors; others only after connect
+        timeouts, when nothing reached the server.
+        """
+        delay = self.backoff
+        for attempt in range(self.retries + 1):
+            try:
+                resp = self.session.request(method, url, timeout=self.timeout, **kwargs)
+            except requests.ConnectionError as e:
+                if attempt == self.retries or not (idempotent or isinstance(e, requests.ConnectTimeout)):
+                    raise
+            else:
+                if resp.status_code not in TRANSIENT_STATUSES or attempt == self.retries or not idempotent:
+                    return resp
+            time.sleep(delay)
+            delay *= 2
+
+    def execute(self, statement, client_context_id="ann_eval", pretty=False, args=None, idempotent=False,
+                **params):
+        """
+        Run a statement and return a QueryResponse.
+
+        args maps named statement parameters (without the "$") to values that
+        are sent JSON-encoded, e.g. args={"k": 10} binds $k in the statement.
+        Pass idempotent=True for read-only queries so transient failures are
+        retried. Extra keyword arguments are sent as query service parameters.
+        Raises requests.HTTPError for error responses (after retries).
+        """
+        data = {
+            "statement": statement,
+            "pretty": "true" if pretty else "false",
+            "client_context_id": client_context_id,
+        }
+        data.update(params)
+        for name, value in (args or {}).items():
+            data[f"${name}"] = json.dumps(value)
+
+        start = time.perf_counter()
+        resp = self.post(data, idempotent)
+        client_time = time.perf_counter() - start
+        resp.raise_for_status()
+
+        return QueryResponse(resp.json(), resp.text, client_time)
+
+    def query_ids(self, statement, client_context_id="ann_eval", args=None, submit_async=False):
+        """
+        Run a `SELECT row.idx` query and return (ids, timings). With
+        submit_async the query is submitted with mode=async and polled until
+        it finishes, so long queries cannot hit the read timeout.
+        """
+        if submit_async:
+            response = self.submit(statement, client_context_id, args=args, idempotent=True).wait()
+        else:
+            response = self.execute(statement, client_context_id, args=args, idempotent=True)
+        return result_ids(response.results), response.timings()
+
+    def submit(self, statement, client_context_id="ann_eval", args=None, idempotent=False, **params):
+        """
+        Submit a statement with mode=async and return an AsyncJob for its
+        handle (idempotent as for execute). Raises requests.HTTPError if the
+        submission is rejected.
+        """
+        data = {
+            "statement": statement,
+            "pretty": "false",
+            "client_context_id": client_context_id,
+            "mode": "async",
+        }
+        data.update(params)
+        for name, value in (args or {}).items():
+            data[f"${name}"] = json.dumps(value)
+
+        submitted = time.perf_counter()
+        resp = self.post(data, idempotent)
+        resp.raise_for_status()
+        return AsyncJob(self, resp.json(), submitted)
+
+    def server_version(self):
+        """Build properties reported by /admin/version (version, git commit), or None if unavailable."""
+        try:
+            resp = self.request("GET", f"{self.base_url}/admin/version")
+            resp.raise_for_status()
+            return resp.json()
+        except (requests.RequestException, ValueError):
+            return None
+
+    def absolute_url(self, handle):
+        """Handles may be full URLs or server-relative paths."""
+        return handle if handle.startswith("http") else f"{self.base_url}{handle}"
+
+    def run_async(self, jobs, max_outstanding, poll_interval=POLL_INTERVAL):
+        """
+        Submit (key, statement, client_context_id, args) read-only jobs with
+        at most max_outstanding running at once, and yield (key,
+        QueryResponse) as they complete. All polling happens on the calling
+        thread.
+        """
+        jobs = iter(jobs)
+        outstanding = []
+        exhausted = False
+        delay = poll_interval
+        while True:
+            while not exhausted and len(outstanding) < max_outstanding:
+                job = next(jobs, None)
+                if job is None:
+                    exhausted = True
+                    break
+                key, statement, client_context_id, args = job
+                outstanding.append((key, self.submit(statement, client_context_id, args=args, idempotent=True)))
+            if not outstanding:
+                return
+
+            running = []
+            for key, job in outstanding:
+                response = job.poll()
+                if response is None:
+                    running.append((key, job))
+                else:
+                    yield key, response
+            if len(running) == len(outstanding):
+                time.sleep(delay)
+                delay = min(delay * 2, MAX_POLL_INTERVAL)
+            else:
+                delay = poll_interval
+            outstanding = running
+
+
+class AsyncJob:
+    """
+    A query submitted with mode=async. The client time of its response runs
+    from submission until a poll found it finished, so it is rounded up to
+    the polling interval.
+    """
+
+    def __init__(self, client, js, submitted):
+        self.client = client
+        self.submitted = submitted
+        self.status = js.get("status", "running")
+        self.handle = js.get("handle")
+        self.response = None
+        if self.status not in PENDING_STATUSES and self.status != "success":
+            raise AsterixQueryError(f"Async job {self.status}: {js.get('errors')}")
+        if "results" in js:
+            # Finished before the submission returned
+            self.response = QueryResponse(js, json.dumps(js), time.perf_counter() - submitted)
+
+    def poll(self):
+        """Check the job once; returns its QueryResponse when finished, else None."""
+        if self.response is not None:
+            return self.response
+
+        status = self.client.request("GET", self.client.absolute_url(self.handle))
+        status.raise_for_status()
+        js = status.json()
+        self.status = js.get("status")
+        if self.status in PENDING_STATUSES:
+            return None
+        if self.status != "success":
+            raise AsterixQueryError(f"Async job {self.status}: {js.get('errors')}")
+
+        result = self.client.request("GET", self.client.absolute_url(js["handle"]))
+        result.raise_for_status()
+        client_time = time.perf_counter() - self.submitted
+        body = result.json()
+        if not isinstance(body, dict):
+            # The result endpoint may return the bare results array
+            body = {"results": body}
+        if "metrics" not in body and "metrics" in js:
+            body["metrics"] = js["metrics"]
+        self.response = QueryResponse(body, result.text, client_time)
+        return self.response
+
+    def wait(self, poll_interval=POLL_INTERVAL):
+        """Poll until the job finishes and return its QueryResponse."""
+        delay = poll_interval
+        while True:
+            response = self.poll()
+            if response is not None:
+                return response
+            time.sleep(delay)
+            delay = min(delay * 2, MAX_POLL_INTERVAL)
+
+
+_default_client = None
+
+
+def get_client():
+    """Process-wide client built from the module configuration."""
+    global _default_client
+    if _default_client is None:
+        _default_client = AsterixClient()
+    return _default_client
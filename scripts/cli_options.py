@@ -0,0 +1,28 @@
+def parse_options(argv):
+    """
+    Split "--key=value" options from positional arguments.
+    Returns (positional_args, options_dict).
+    """
+    positional = []
+    options = {}
+    for arg in argv:
+        if arg.startswith("--"):
+            key, _, value = arg[2:].partition("=")
+            options[key] = value
+        else:
+            positional.append(arg)
+    return positional, options
+
+
+def parse_force(options, steps):
+    """
+    Pipeline steps named by --force[=step,...] (["all"] without a value, []
+    without the option). Raises ValueError on unknown steps.
+    """
+    if "force" not in options:
+        return []
+    force = [step for step in options["force"].split(",") if step] or ["all"]
+    unknown = [step for step in force if step not in tuple(steps) + ("all",)]
+    if unknown:
+        raise ValueError(f"unknown step(s) for --force: {', '.join(unknown)} (steps: {', '.join(steps)})")
+    return force
@@ -0,0 +1,282 @@
+import csv
+import json
+import os
+import sys
+
+import numpy as np
+
+from cli_options import parse_options
+from results_store import RESULTS_DB, connect, load_measurements
+
+BOOTSTRAP_SAMPLES = 2000
+BOOTSTRAP_BLOCK = 200  # resamples drawn at a time (bounds memory for large query sets)
+CONFIDENCE = 0.95
+SEED = 42
+
+# Regression thresholds: recall is an absolute drop (0.01 = one point of
+# Recall@K), the others are relative changes in percent
+THRESHOLDS = {
+    "max-recall-drop": 0.01,
+    "max-latency-increase": 10.0,
+    "max-qps-drop": 10.0,
+    "max-build-increase": 20.0,
+}
+
+# name, statistic, per-query sample, threshold option, "higher" or "lower" is better, absolute delta
+METRICS = [
+    ("recall", "mean", "recall", "max-recall-drop", "higher", True),
+    ("p50 client", "p50", "client", "max-latency-increase", "lower", False),
+    ("p99 client", "p99", "client", "max-latency-increase", "lower", False),
+    ("p50 server", "p50", "server", "max-latency-increase", "lower", False),
+    ("p99 server", "p99", "server", "max-latency-increase", "lower", False),
+    ("qps", "qps", "client", "max-qps-drop", "higher", False),
+]
+
+
+# --------------------
+# Result sets: {point key: {"recall"/"server"/"client": per-query arrays, "qps", "build_s"}}
+# --------------------
+def point_samples(recall, server, client, qps=None, build_s=None):
+    return {
+        "recall": np.asarray(recall, dtype=np.float64),
+        "server": np.asarray(server, dtype=np.float64),
+        "client": np.asarray(client, dtype=np.float64),
+        "qps": qps,
+        "build_s": build_s,
+    }
+
+
+def load_matrix_run(db_path, run_id):
+    """Points of a run_matrix.py run, keyed by (dataset, size, num_clusters, K, concurrency)."""
+    if not os.path.exists(db_path):
+        raise ValueError(f"results database not found: {db_path}")
+    conn = connect(db_path)
+    try:
+        measurements = load_measurements(conn, run_id)
+    finally:
+        conn.close()
+    if not measurements:
+        raise ValueError(f"no measurements for run {run_id} in {db_path}")
+    points = {}
+    for m in measurements:
+        key = (m["dataset"], m["num_records"] or "full", f"clusters={m['num_clusters']}", f"K={m['k']}",
+               f"clients={m['concurrency']}")
+        queries = m["queries"]
+        points[key] = point_samples([q[1] for q in queries], [q[2] for q in queries], [q[3] for q in queries],
+                                    m["qps"], m["index_build_s"])
+    return points
+
+
+def read_query_records(path):
+    """Per-query records written by run_query_compare.py (JSONL or CSV)."""
+    with open(path, "r", newline="") as f:
+        if path.endswith(".csv"):
+            return [{key: (float(value) if value not in ("", None) else None) if key != "probes" else value or None
+                     for key, value in row.items()} for row in csv.DictReader(f)]
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def load_summary_run(summary_path):
+    """
+    Points of a run_query_compare.py run, from its summary JSON and the
+    per-query records it names, keyed by (K, concurrency, probes).
+    """
+    with open(summary_path, "r") as f:
+        summary = json.load(f)
+    queries_path = (summary.get("files") or {}).get("queries")
+    if not queries_path:
+        raise ValueError(f"{summary_path} has no per-query records (mode {summary.get('mode')})")
+    if not os.path.isabs(queries_path) and not os.path.exists(queries_path):
+        queries_path = os.path.join(os.path.dirname(summary_path), os.path.basename(queries_path))
+
+    # Throughput of each point, where the mode measured it
+    qps = {}
+    for row in summary["results"] if isinstance(summary.get("results"), list) else []:
+        if "qps" in row:
+            probes = row.get("probes")
+            probes = None if probes in (None, "default") else str(probes)
+            qps[(int(row.get("k", summary["run"]["top_k"])), int(row["concurrency"]), probes)] = row["qps"]
+
+    # Passes over the query set that count in the run's statistics (--passes/--cache)
+    results = summary.get("results")
+    passes = {p["pass"] for p in results.get("passes", []) if p["included"]} if isinstance(results, dict) else set()
+
+    groups = {}
+    for r in read_query_records(queries_path):
+        if passes and r.get("pass") is not None and int(r["pass"]) not in passes:
+            continue
+        probes = r.get("probes")
+        key = (int(r["k"]), int(r["concurrency"]), None if probes in (None, "default") else str(probes))
+        groups.setdefault(key, []).append(r)
+
+    points = {}
+    for key, records in groups.items():
+        k, concurrency, probes = key
+        label = (f"K={k}", f"clients={concurrency}") + ((f"probes={probes}",) if probes is not None else ())
+        points[label] = point_samples([r["recall"] for r in records], [r["ann_execution_s"] for r in records],
+                                      [r["ann_client_s"] for r in records], qps.get(key))
+    return points
+
+
+def load_result_set(spec, db_path):
+    """A run_query_compare.py summary JSON path, or a run_matrix.py run id in the results database."""
+    if spec.endswith(".json"):
+        return load_summary_run(spec)
+    return load_matrix_run(db_path, spec)
+
+
+# --------------------
+# Bootstrap
+# --------------------
+def statistic(values, stat, axis=None):
+    if stat == "mean":
+        return np.mean(values, axis=axis)
+    return np.percentile(values, float(stat[1:]), axis=axis)
+
+
+def bootstrap(values, stat, rng, samples=BOOTSTRAP_SAMPLES):
+    """The statistic over `samples` resamples (with replacement) of the per-query values."""
+    out = []
+    for first in range(0, samples, BOOTSTRAP_BLOCK):
+        n = min(BOOTSTRAP_BLOCK, samples - first)
+        idx = rng.integers(0, len(values), size=(n, len(values)))
+        out.append(statistic(values[idx], stat, axis=1))
+    return np.concatenate(out)
+
+
+def metric_values(point, stat, sample, rng, samples):
+    """
+    (point estimate, bootstrap replicates) of a metric. QPS is not a
+    per-query value: closed-loop throughput is clients / mean latency, so its
+    replicates scale the measured QPS by the resampled mean client latency.
+    """
+    values = point[sample]
+    if stat == "qps":
+        if point["qps"] is None or not len(values):
+            return None, None
+        mean = values.mean()
+        return point["qps"], point["qps"] * mean / bootstrap(values, "mean", rng, samples)
+    if not len(values):
+        return None, None
+    return float(statistic(values, stat)), bootstrap(values, stat, rng, samples)
+
+
+def compare_metric(base, cand, stat, sample, absolute, rng, samples, confidence):
+    """Delta (absolute, or percent of the baseline) and its bootstrap confidence interval."""
+    b, b_reps = metric_values(base, stat, sample, rng, samples)
+    c, c_reps = metric_values(cand, stat, sample, rng, samples)
+    if b is None or c is None:
+        return None
+    if absolute:
+        delta, reps = c - b, c_reps - b_reps
+    else:
+        if b == 0:
+            return None
+        delta, reps = 100.0 * (c - b) / b, 100.0 * (c_reps - b_reps) / b_reps
+    tail = 100.0 * (1 - confidence) / 2
+    low, high = np.percentile(reps, [tail, 100.0 - tail])
+    return b, c, delta, float(low), float(high)
+
+
+def verdict(delta, low, high, better, threshold):
+    """
+    "REGRESSION" when the change is worse than the threshold and the
+    confidence interval excludes zero (with no interval: the threshold
+    alone), "improved" when significantly better, else "ok".
+    """
+    worse = -delta if better == "higher" else delta
+    significant = low is None or low > 0 or high < 0
+    if worse > threshold and significant:
+        return "REGRESSION"
+    if worse < 0 and significant and low is not None:
+        return "improved"
+    return "ok"
+
+
+def compare(base_points, cand_points, thresholds, samples=BOOTSTRAP_SAMPLES, confidence=CONFIDENCE, seed=SEED):
+    """Rows (point, metric, baseline, candidate, delta, ci_low, ci_high, unit, verdict) for the common points."""
+    rng = np.random.default_rng(seed)
+    rows = []
+    builds = set()
+    for key in [k for k in base_points if k in cand_points]:
+        base, cand = base_points[key], cand_points[key]
+        for name, stat, sample, threshold_key, better, absolute in METRICS:
+            result = compare_metric(base, cand, stat, sample, absolute, rng, samples, confidence)
+            if result is None:
+                continue
+            b, c, delta, low, high = result
+            rows.append((key, name, b, c, delta, low, high, "" if absolute else "%",
+                         verdict(delta, low, high, better, thresholds[threshold_key])))
+        # One index serves every K/clients point of a matrix run: compare its build once
+        if base["build_s"] and cand["build_s"] and key[:3] not in builds:
+            builds.add(key[:3])
+            delta = 100.0 * (cand["build_s"] - base["build_s"]) / base["build_s"]
+            rows.append((key, "index build", base["build_s"], cand["build_s"], delta, None, None, "%",
+                         verdict(delta, None, None, "lower", thresholds["max-build-increase"])))
+    return rows
+
+
+def format_value(value):
+    return f"{value:.6g}" if value is not None else "-"
+
+
+def main(argv=None):
+    args, options = parse_options(sys.argv[1:] if argv is None else argv)
+    if len(args) != 2:
+        print("Usage: python compare_runs.py <baseline> <candidate> [--db=PATH] [--bootstrap=N] [--confidence=C]")
+        print("         [--max-recall-drop=A] [--max-latency-increase=PCT] [--max-qps-drop=PCT] "
+              "[--max-build-increase=PCT]")
+        print("  <baseline>/<candidate>: a run_query_compare.py *_summary.json or a run_matrix.py run id")
+        print("Example: python compare_runs.py 20260101_120000_host 20260102_120000_host")
+        print("Example: python compare_runs.py output/a_results_20260101_120000_summary.json "
+              "output/a_results_20260102_120000_summary.json --max-latency-increase=5")
+        sys.exit(1)
+
+    db_path = options.get("db", RESULTS_DB)
+    thresholds = {key: float(options.get(key, default)) for key, default in THRESHOLDS.items()}
+    samples = int(options.get("bootstrap", BOOTSTRAP_SAMPLES))
+    confidence = float(options.get("confidence", CONFIDENCE))
+
+    try:
+        base_points = load_result_set(args[0], db_path)
+        cand_points = load_result_set(args[1], db_path)
+    except (OSError, ValueError, KeyError) as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+
+    common = [k for k in base_points if k in cand_points]
+    if not common:
+        print("Error: the two result sets have no point (dataset/size/index/K/clients) in common")
+        sys.exit(1)
+    skipped = len(base_points) + len(cand_points) - 2 * len(common)
+    rows = compare(base_points, cand_points, thresholds, samples, confidence)
+
+    print("==============================================")
+    print(f"Baseline:   {args[0]}")
+    print(f"Candidate:  {args[1]}")
+    print(f"Points:     {len(common)} in common" + (f" ({skipped} only in one set, skipped)" if skipped else ""))
+    print(f"Bootstrap:  {samples} resamples, {confidence:.0%} confidence intervals")
+    print("==============================================")
+    print(f"{'Metric':<12} {'Baseline':>12} {'Candidate':>12} {'Delta':>10} {'CI':>22}  Verdict")
+    current = None
+    for key, name, b, c, delta, low, high, unit, status in rows:
+        if key != current:
+            print(f"\n[{' '.join(str(part) for part in key)}]")
+            current = key
+        ci = f"[{low:+.4g}, {high:+.4g}]{unit}" if low is not None else "-"
+        print(f"{name:<12} {format_value(b):>12} {format_value(c):>12} {delta:>+9.4g}{unit or ' '} {ci:>22}  {status}")
+
+    regressions = [row for row in rows if row[-1] == "REGRESSION"]
+    print("\n==============================================")
+    if regressions:
+        print(f"{len(regressions)} REGRESSION(S):")
+        for key, name, b, c, delta, low, high, unit, status in regressions:
+            print(f"  [{' '.join(str(part) for part in key)}] {name}: {delta:+.4g}{unit}")
+        print("==============================================")
+        sys.exit(1)
+    print("No regressions beyond the thresholds")
+    print("==============================================")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,28 @@
+import csv
 import os
 import sys
 import requests
 import re
+from datetime import datetime
 
-ASTERIX_URL = "http://localhost:19002/query/service"
-HEADERS = {"Content-Type": "application/x-www-form-urlencoded"}
+from asterix_client import get_client
+from cli_options import parse_options
+from dataset_manifest import manifest_dimension
+from ground_truth import get_ground_truth, strip_padding
+from latency_stats import LatencySeries
+from run_query_compare import TOP_K, build_ann_query, calculate_recall, load_test_vectors, run_closed_loop
+from vector_metric import serving_metric, similarity_name
+
+TRAIN_LIST = 10000  # default "train_list" for CREATE VECTOR INDEX
+INDEX_NAME = "ix1"  # index built without a sweep (the one the other scripts query)
+SWEEP_QUERIES = 100  # test vectors measured against each swept index
+
+BUILD_FIELDS = [
+    "dataset", "asterix_dataset", "index_name", "dimension", "similarity", "num_clusters", "train_list",
+    "client_time_s", "server_elapsed_s", "server_execution_s",
+    "first_query_client_s", "first_query_elapsed_s", "first_query_execution_s",
+    "queries", "recall", "qps", "mean_server_s", "p50_client_s", "p99_client_s",
+]
 
 
 def extract_dimension(dataset_name: str) -> int:
@@ -21,66 +39,263 @@ def extract_dimension(dataset_name: str) -> int:
     raise ValueError(f"Cannot infer dimension from dataset name: {dataset_name}")
 
 
-def main():
-    if len(sys.argv) < 3 or len(sys.argv) > 4:
-        print("Usage: python create_index.py <dataset_name> <num_k> [num_records]")
-        print("Example: python create_index.py fashion-mnist-784-euclidean 256")
-        print("Example: python create_index.py fashion-mnist-784-euclidean 256 20000")
-        sys.exit(1)
+def parse_int_list(value):
+    """ "64,128,256" -> [64, 128, 256] """
+    return [int(v) for v in value.split(",") if v.strip()]
 
-    dataset_name = sys.argv[1]                     # e.g. fashion-mnist-784-euclidean
-    num_k = int(sys.argv[2])                       # number of leaf centroids
-    num_records = sys.argv[3] if len(sys.argv) == 4 else None
-    
-    # Adjust dataset name for subdataset
-    if num_records:
-        ds_name_astx = f"{dataset_name}_{num_records}".replace("-", "_")
-    else:
-        ds_name_astx = dataset_name.replace("-", "_")  # Asterix-safe name
 
-    # Automatically extract dimension
-    dimension = extract_dimension(dataset_name)
+def post_statement(statement, client_context_id):
+    """Send a statement to AsterixDB; exits on HTTP errors. Returns a QueryResponse."""
+    try:
+        return get_client().execute(statement, client_context_id, pretty=True)
+    except requests.HTTPError as e:
+        print("HTTP error from AsterixDB:", e)
+        print("Response text:")
+        print(e.response.text)
+        sys.exit(1)
 
-    index_name = "ix1"
 
+def drop_index(ds_name_astx, index_name, dataset_name):
     statement = f"""
     USE VectorTest;
 
     DROP INDEX {ds_name_astx}.{index_name} IF EXISTS;
+    """
+    post_statement(statement, f"drop_idx_{dataset_name}_{index_name}")
+
+
+def first_query_timings(ds_name_astx, dataset_name, similarity="Euclidean"):
+    """
+    Time one ANN query (the first test vector) right after an index build,
+    before anything has warmed the index pages. Returns the query timings,
+    or None if there are no test vectors or the query fails.
+    """
+    base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    tests_path = os.path.join(base_dir, "tests", f"{dataset_name}_test.jsonl")
+    if not os.path.exists(tests_path):
+        return None
+    statement, query_args = build_ann_query(load_test_vectors(tests_path, limit=1)[0], TOP_K, ds_name_astx,
+                                            similarity=similarity)
+    try:
+        return get_client().execute(statement, f"first_query_{ds_name_astx}", args=query_args,
+                                    idempotent=True).timings()
+    except requests.RequestException as e:
+        print(f"First query after the build failed: {e}")
+        return None
+
+
+def build_index(ds_name_astx, index_name, dimension, num_k, train_list, dataset_name, similarity="Euclidean",
+                first_query=True):
+    """
+    (Re)create a vector index and time the CREATE statement on its own, then
+    time the first ANN query against the new index separately (unless
+    first_query is False, e.g. while other vector indexes exist).
+    Returns a result row with client wall time and the server-reported times.
+    """
+    drop_index(ds_name_astx, index_name, dataset_name)
+
+    statement = f"""
+    USE VectorTest;
 
     CREATE VECTOR INDEX {index_name} ON {ds_name_astx}(embedding VECTOR) WITH {{
         "dimension": {dimension},
-        "train_list": 10000,
+        "train_list": {train_list},
         "description": " ",
         "num_clusters": {num_k},
-        "similarity": "Euclidean"
+        "similarity": "{similarity}"
     }};
     """
 
-    data = {
-        "statement": statement,
-        "pretty": "true",
-        "client_context_id": f"create_idx_{dataset_name}"
+    response = post_statement(statement, f"create_idx_{dataset_name}_{index_name}")
+    timings = response.timings()
+    first = first_query_timings(ds_name_astx, dataset_name, similarity) if first_query else None
+
+    return {
+        "dataset": dataset_name,
+        "asterix_dataset": ds_name_astx,
+        "index_name": index_name,
+        "dimension": dimension,
+        "similarity": similarity,
+        "num_clusters": num_k,
+        "train_list": train_list,
+        "client_time_s": round(timings["client"], 6),
+        "server_elapsed_s": round(timings["elapsed"], 6),
+        "server_execution_s": round(timings["execution"], 6),
+        "first_query_client_s": round(first["client"], 6) if first else None,
+        "first_query_elapsed_s": round(first["elapsed"], 6) if first else None,
+        "first_query_execution_s": round(first["execution"], 6) if first else None,
+    }, response.text
+
+
+def sweep_queries(dataset_name, num_records, num_queries):
+    """
+    (query vectors, exact neighbor ids) to measure each swept index with, from
+    the local ground truth (cached, or computed with NumPy) so no exact scans
+    run on the server. ([], None) when there are no test vectors.
+    """
+    base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    tests_path = os.path.join(base_dir, "tests", f"{dataset_name}_test.jsonl")
+    if num_queries <= 0 or not os.path.exists(tests_path):
+        return [], None
+    test_vecs = load_test_vectors(tests_path, limit=num_queries)
+    try:
+        exact = get_ground_truth(dataset_name, len(test_vecs), num_records, k=TOP_K)
+    except FileNotFoundError as e:
+        print(f"No ground truth for the sweep measurements: {e}")
+        return [], None
+    return test_vecs, [strip_padding(row) for row in exact]
+
+
+def measure_index(ds_name_astx, test_vecs, exact_ids, similarity="Euclidean"):
+    """Recall@TOP_K, single-client QPS and latency of the only vector index on the dataset."""
+    results, wall_time = run_closed_loop(test_vecs, ds_name_astx, 1, similarity=similarity)
+    server = LatencySeries("server")
+    client = LatencySeries("client")
+    for r in results:
+        server.add(r[1])
+        client.add(r[2])
+    client_stats = client.summary()
+    return {
+        "queries": len(results),
+        "recall": round(sum(calculate_recall(r[0], exact) for r, exact in zip(results, exact_ids)) / len(results), 6),
+        "qps": round(len(results) / wall_time, 3) if wall_time > 0 else None,
+        "mean_server_s": round(server.summary()["mean"], 6),
+        "p50_client_s": round(client_stats["p50"], 6),
+        "p99_client_s": round(client_stats["p99"], 6),
     }
 
+
+def write_build_table(rows, output_path):
+    """Write index build results as CSV (one row per index)."""
+    with open(output_path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=BUILD_FIELDS)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def main(argv=None):
+    args, options = parse_options(sys.argv[1:] if argv is None else argv)
+    if len(args) < 2 or len(args) > 3:
+        print("Usage: python create_index.py <dataset_name> <num_k> [num_records] [--train-list=N]")
+        print("         [--sweep-clusters=K1,K2,...] [--sweep-train-list=T1,T2,...] [--sweep-queries=N] "
+              "[--keep-indexes]")
+        print("Example: python create_index.py fashion-mnist-784-euclidean 256")
+        print("Example: python create_index.py fashion-mnist-784-euclidean 256 20000")
+        print("Example: python create_index.py fashion-mnist-784-euclidean 256 20000 "
+              "--sweep-clusters=64,128,256,512 --sweep-train-list=5000,10000")
+        sys.exit(1)
+
+    dataset_name = args[0]                         # e.g. fashion-mnist-784-euclidean
+    num_k = int(args[1])                           # number of leaf centroids
+    num_records = args[2] if len(args) == 3 else None
+    train_list = int(options.get("train-list", TRAIN_LIST))
+    
+    # Adjust dataset name for subdataset
+    if num_records:
+        ds_name_astx = f"{dataset_name}_{num_records}".replace("-", "_")
+    else:
+        ds_name_astx = dataset_name.replace("-", "_")  # Asterix-safe name
+
+    # Dimension from the dataset manifest, else guessed from the name; metric
+    dimension = manifest_dimension(dataset_name) or extract_dimension(dataset_name)
+    try:
+        similarity = similarity_name(serving_metric(dataset_name))
+    except ValueError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+
+    sweep = "sweep-clusters" in options or "sweep-train-list" in options
+    if sweep:
+        run_sweep(dataset_name, ds_name_astx, num_records, dimension, similarity, num_k, train_list,
+                  parse_int_list(options.get("sweep-clusters", str(num_k))),
+                  parse_int_list(options.get("sweep-train-list", str(train_list))),
+                  int(options.get("sweep-queries", SWEEP_QUERIES)), keep_indexes="keep-indexes" in options)
+        return
+
+    index_name = INDEX_NAME
+
     print("Creating vector index:")
     print(f"  Dataset:        {ds_name_astx}")
     print(f"  Auto-dimension: {dimension}")
+    print(f"  Similarity:     {similarity}")
     print(f"  num_k:          {num_k}")
+    print(f"  train_list:     {train_list}")
     print()
 
-    resp = requests.post(ASTERIX_URL, headers=HEADERS, data=data)
-
-    try:
-        resp.raise_for_status()
-    except requests.HTTPError as e:
-        print("HTTP error from AsterixDB:", e)
-        print("Response text:")
-        print(resp.text)
-        sys.exit(1)
+    row, text = build_index(ds_name_astx, index_name, dimension, num_k, train_list, dataset_name, similarity)
 
     print("AsterixDB response:")
-    print(resp.text)
+    print(text)
+    print(f"Build time (client wall):          {row['client_time_s']:.3f}s")
+    print(f"Build time (server elapsedTime):   {row['server_elapsed_s']:.3f}s")
+    print(f"Build time (server executionTime): {row['server_execution_s']:.3f}s")
+    if row["first_query_client_s"] is not None:
+        print(f"First ANN query after the build:   {row['first_query_client_s']:.6f}s client | "
+              f"{row['first_query_elapsed_s']:.6f}s server elapsedTime")
+    return row
+
+
+def run_sweep(dataset_name, ds_name_astx, num_records, dimension, similarity, num_k, train_list, cluster_values,
+              train_list_values, num_queries=SWEEP_QUERIES, keep_indexes=False):
+    """
+    Build one index per (num_clusters, train_list) combination, each under its
+    own name (ix_c<num_clusters>_t<train_list>), measure recall and latency
+    of num_queries test vectors against it, and write build cost and query
+    results to output/<dataset>[_<N>]_index_builds_<timestamp>.csv.
+    Afterwards the regular index is rebuilt with num_k and train_list, so
+    later runs do not query a dataset without an index.
+    """
+    base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    output_dir = os.path.join(base_dir, "output")
+    os.makedirs(output_dir, exist_ok=True)
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    prefix = f"{dataset_name}_{num_records}" if num_records else dataset_name
+    output_path = os.path.join(output_dir, f"{prefix}_index_builds_{timestamp}.csv")
+
+    combos = [(k, t) for k in cluster_values for t in train_list_values]
+    print(f"Index build sweep on {ds_name_astx}: {len(combos)} configurations")
+    print(f"  num_clusters: {cluster_values}")
+    print(f"  train_list:   {train_list_values}")
+
+    # ann_distance cannot pick between several vector indexes on the same
+    # field, so the regular index goes first and each swept index is dropped
+    # once measured unless asked otherwise
+    print(f"  Dropping {INDEX_NAME} for the sweep")
+    drop_index(ds_name_astx, INDEX_NAME, dataset_name)
+    test_vecs, exact_ids = ([], None) if keep_indexes else sweep_queries(dataset_name, num_records, num_queries)
+    if test_vecs:
+        print(f"  Measuring {len(test_vecs)} queries per index (Recall@{TOP_K}, single client)")
+    elif keep_indexes:
+        print("  --keep-indexes: recall and latency are not measured (queries cannot target one of several indexes)")
+    print()
+
+    rows = []
+    for sweep_k, sweep_train_list in combos:
+        index_name = f"ix_c{sweep_k}_t{sweep_train_list}"
+        row, _ = build_index(ds_name_astx, index_name, dimension, sweep_k, sweep_train_list, dataset_name, similarity,
+                             first_query=not keep_indexes)
+        if test_vecs:
+            row.update(measure_index(ds_name_astx, test_vecs, exact_ids, similarity))
+        rows.append(row)
+        first = f" | first query {row['first_query_client_s']:.6f}s" if row["first_query_client_s"] is not None else ""
+        measured = (f" | Recall@{TOP_K} {row['recall']:.4f} | QPS {row['qps']:.2f} | "
+                    f"p99 client {row['p99_client_s']:.6f}s") if test_vecs else ""
+        print(f"{index_name:>20}: client {row['client_time_s']:.3f}s | "
+              f"server elapsed {row['server_elapsed_s']:.3f}s | "
+              f"server execution {row['server_execution_s']:.3f}s{first}{measured}")
+        if not keep_indexes:
+            drop_index(ds_name_astx, index_name, dataset_name)
+
+        write_build_table(rows, output_path)
+
+    print(f"\nBuild table saved to: {output_path}")
+    if keep_indexes:
+        print(f"{INDEX_NAME} was not rebuilt next to the swept indexes; drop them and rerun "
+              f"create_index.py {dataset_name} {num_k}{f' {num_records}' if num_records else ''} before querying")
+        return
+    print(f"Rebuilding {INDEX_NAME} (num_clusters={num_k}, train_list={train_list})")
+    row, _ = build_index(ds_name_astx, INDEX_NAME, dimension, num_k, train_list, dataset_name, similarity)
+    print(f"{INDEX_NAME:>20}: client {row['client_time_s']:.3f}s | server elapsed {row['server_elapsed_s']:.3f}s")
 
 
 if __name__ == "__main__":
@@ -1,63 +1,352 @@
+import hashlib
+import heapq
 import os
 import sys
 import json
 
+import numpy as np
 
-def create_subdataset(input_path, output_path, num_records):
+from cli_options import parse_options
+from dataset_files import train_jsonl_paths
+from dataset_manifest import file_entry, record_subset, subset_entry, train_sha256s
+from line_index import copy_lines, line_offsets, read_lines
+
+SAMPLE_MODES = ("head", "uniform", "reservoir", "kmeans")
+DEFAULT_SEED = 42
+KMEANS_CLUSTERS = 100
+KMEANS_ITERATIONS = 20
+KMEANS_PILOT_PER_CLUSTER = 50  # pilot rows per cluster used to fit the centroids
+ASSIGN_BLOCK_SIZE = 50000      # train rows assigned to clusters at once
+KEY_BATCH_SIZE = 65536         # random sampling keys drawn at a time
+
+
+def iter_lines(input_paths):
+    """Raw train lines (bytes) of one or more files, read in order."""
+    for path in input_paths:
+        with open(path, "rb") as infile:
+            for line in infile:
+                yield line
+
+
+def iter_keyed_lines(input_paths, rng):
+    """(position, random key, line) for every train line; keys are drawn in batches."""
+    keys = []
+    for pos, line in enumerate(iter_lines(input_paths)):
+        if not keys:
+            keys = rng.random(KEY_BATCH_SIZE).tolist()[::-1]
+        yield pos, keys.pop(), line
+
+
+def input_offsets(input_paths):
+    """
+    Line offset index of every input file (see line_index.py) and the global
+    position of each file's first line.
+    """
+    offsets = [line_offsets(path) for path in input_paths]
+    firsts = np.cumsum([0] + [len(o) - 1 for o in offsets])
+    return offsets, firsts.tolist()
+
+
+def split_positions(positions, offsets, firsts):
+    """Sorted global line positions -> per-file local positions."""
+    positions = np.asarray(positions, dtype=np.int64)
+    return [positions[(positions >= first) & (positions < first + len(offs) - 1)] - first
+            for offs, first in zip(offsets, firsts)]
+
+
+def sample_spec(mode, seed=DEFAULT_SEED, clusters=KMEANS_CLUSTERS):
+    """How a subset was drawn, as recorded under "sample" in the manifest."""
+    if mode == "head":
+        return {"mode": "head"}
+    spec = {"mode": mode, "seed": seed}
+    if mode == "kmeans":
+        spec["clusters"] = clusters
+    return spec
+
+
+def head_selection(sizes):
+    """First N rows for every size."""
+    return {n: np.arange(n, dtype=np.int64) for n in sizes}
+
+
+def uniform_selection(total, sizes, rng):
+    """
+    Uniform sample without replacement. The positions are drawn in random
+    order once, and each size takes a prefix of them, so smaller subsets are
+    contained in larger ones.
+    """
+    order = rng.choice(total, size=min(max(sizes), total), replace=False)
+    return {n: np.sort(order[:n]) for n in sizes}
+
+
+def reservoir_sample(input_paths, sizes, rng):
+    """
+    Uniform sample of a stream of unknown length in one pass. Every line gets
+    a random key and the max(sizes) lines with the smallest keys are kept;
+    a size-N subset is the N smallest keys, so subsets are nested.
+    Returns ({N: [line, ...] in file order}, total_lines).
+    """
+    capacity = max(sizes)
+    heap = []  # (-key, position, line): max-heap on key
+    total = 0
+    for pos, key, line in iter_keyed_lines(input_paths, rng):
+        if len(heap) < capacity:
+            heapq.heappush(heap, (-key, pos, line))
+        elif key < -heap[0][0]:
+            heapq.heapreplace(heap, (-key, pos, line))
+        total += 1
+
+    by_key = sorted(heap, reverse=True)  # smallest key first
+    samples = {}
+    for n in sizes:
+        samples[n] = [line for _, _, line in sorted(by_key[:n], key=lambda item: item[1])]
+    return samples, total
+
+
+def pilot_sample(input_paths, size, rng):
+    """
+    Uniform sample of `size` train vectors, read by seeking to the sampled
+    lines, plus the number of lines in the input.
+    """
+    offsets, firsts = input_offsets(input_paths)
+    total = firsts[-1]
+    positions = np.sort(rng.choice(total, size=min(size, total), replace=False))
+    lines = []
+    for path, offs, local in zip(input_paths, offsets, split_positions(positions, offsets, firsts)):
+        lines.extend(read_lines(path, local, offs))
+    vectors = np.asarray([json.loads(line)["embedding"] for line in lines], dtype=np.float32)
+    return vectors, total
+
+
+def nearest_centroid(vectors, centroids):
+    """Index of the closest centroid (squared L2) for every row."""
+    dists = (np.einsum("ij,ij->i", vectors, vectors)[:, None]
+             - 2.0 * vectors @ centroids.T
+             + np.einsum("ij,ij->i", centroids, centroids)[None, :])
+    return np.argmin(dists, axis=1)
+
+
+def fit_kmeans(vectors, clusters, rng, iterations=KMEANS_ITERATIONS):
+    """Plain Lloyd's k-means on the pilot sample; empty clusters are re-seeded."""
+    clusters = min(clusters, vectors.shape[0])
+    centroids = vectors[rng.choice(vectors.shape[0], size=clusters, replace=False)].copy()
+    for _ in range(iterations):
+        labels = nearest_centroid(vectors, centroids)
+        for c in range(clusters):
+            members = vectors[labels == c]
+            centroids[c] = members.mean(axis=0) if len(members) else vectors[rng.integers(vectors.shape[0])]
+    return centroids
+
+
+def assign_clusters(input_paths, centroids, normalize):
+    """Cluster label of every train row, streamed in blocks."""
+    from ground_truth import iter_jsonl_blocks, normalize_rows
+
+    labels = []
+    for _, block in iter_jsonl_blocks(input_paths, block_size=ASSIGN_BLOCK_SIZE):
+        if normalize:
+            block = normalize_rows(block)
+        labels.append(nearest_centroid(block, centroids))
+    return np.concatenate(labels)
+
+
+def stratified_selection(labels, sizes, rng):
+    """
+    Proportional allocation over the clusters: each cluster contributes
+    N * cluster_size / total rows (largest remainder rounding), drawn at
+    random from its members in an order shared by all sizes.
+    """
+    total = len(labels)
+    counts = np.bincount(labels)
+    members = [rng.permutation(np.flatnonzero(labels == c)) for c in range(len(counts))]
+
+    selections = {}
+    for size in sizes:
+        n = min(size, total)
+        exact = counts * (n / total)
+        quotas = np.floor(exact).astype(np.int64)
+        short = n - int(quotas.sum())
+        if short:
+            quotas[np.argsort(quotas - exact, kind="stable")[:short]] += 1
+        selections[size] = np.sort(np.concatenate([m[:q] for m, q in zip(members, quotas)]))
+    return selections
+
+
+def kmeans_selection(input_paths, sizes, rng, clusters, dataset_name=None):
+    """
+    k-means-stratified sample. Fits the centroids on a pilot sample read by
+    seeking, then reads the input once to assign every row to a cluster.
+    """
+    normalize = False
+    if dataset_name:
+        from vector_metric import dataset_metric
+        normalize = dataset_metric(dataset_name) == "angular"
+
+    pilot, total = pilot_sample(input_paths, clusters * KMEANS_PILOT_PER_CLUSTER, rng)
+    if normalize:
+        from ground_truth import normalize_rows
+        pilot = normalize_rows(pilot)
+    print(f"[subdataset] Fitting {clusters} clusters on {len(pilot)} pilot rows")
+    centroids = fit_kmeans(pilot, clusters, rng)
+    print(f"[subdataset] Assigning {total} rows to clusters")
+    labels = assign_clusters(input_paths, centroids, normalize)
+    return stratified_selection(labels, sizes, rng)
+
+
+def write_subsets(outputs, lines_by_size):
+    """Write each subset to a temp file and rename it into place."""
+    written = {}
+    for n, output_path in outputs.items():
+        digest = hashlib.sha256()
+        with open(output_path + ".tmp", "wb") as outfile:
+            for line in lines_by_size[n]:
+                outfile.write(line)
+                digest.update(line)
+        os.replace(output_path + ".tmp", output_path)
+        written[n] = (len(lines_by_size[n]), digest.hexdigest())
+    return written
+
+
+def write_selection(input_paths, outputs, selections):
+    """
+    Write the (sorted) selected lines of every output by seeking through the
+    line offset index and copying byte ranges, one per run of consecutive
+    lines; nothing is parsed. Returns {N: (rows, sha256)}.
     """
-    Create a subdataset by taking the first num_records from input_path.
-    
+    offsets, firsts = input_offsets(input_paths)
+    written = {}
+    for n, output_path in outputs.items():
+        digest = hashlib.sha256()
+        count = 0
+        with open(output_path + ".tmp", "wb") as outfile:
+            for path, offs, local in zip(input_paths, offsets, split_positions(selections[n], offsets, firsts)):
+                copy_lines(path, local, outfile, digest, offs)
+                count += len(local)
+        os.replace(output_path + ".tmp", output_path)
+        written[n] = (count, digest.hexdigest())
+    return written
+
+
+def create_subdatasets(input_path, outputs, mode="head", seed=DEFAULT_SEED, clusters=KMEANS_CLUSTERS,
+                       dataset_name=None):
+    """
+    Create several subdatasets at once. Selected lines are copied as byte
+    ranges using the train files' line offset index (built on first use);
+    only reservoir mode and the k-means cluster assignment read every line.
+    Records keep their original idx and are written in file order.
+
     Args:
-        input_path: Path to the original _train.jsonl file
-        output_path: Path to the output subdataset file
-        num_records: Number of records to extract
+        input_path: Path to the original _train.jsonl file, or a list of
+                    train shard paths read in order
+        outputs: {num_records: output path}
+        mode: "head" (first N rows), "uniform" (seeded uniform sample),
+              "reservoir" (seeded uniform sample in one streaming pass without
+              the index, holds the largest subset in memory) or "kmeans"
+              (stratified over k-means clusters)
+        dataset_name: record the new files (and how they were sampled) in
+                      the dataset manifest
+    Returns {num_records: rows written}.
     """
-    if not os.path.exists(input_path):
-        print(f"Error: Input file not found: {input_path}")
-        sys.exit(1)
-    
-    # Check if subdataset already exists
-    if os.path.exists(output_path):
-        print(f"[subdataset] Subdataset already exists: {output_path}")
-        print(f"[subdataset] Skipping creation")
-        return num_records
-    
-    print(f"[subdataset] Creating subdataset with {num_records} records")
-    print(f"[subdataset] Input:  {input_path}")
-    print(f"[subdataset] Output: {output_path}")
-    
-    count = 0
-    with open(input_path, "r") as infile, open(output_path, "w") as outfile:
-        for line in infile:
-            if count >= num_records:
-                break
-            outfile.write(line)
-            count += 1
-    
-    print(f"[subdataset] Created subdataset with {count} records")
-    
-    if count < num_records:
-        print(f"[subdataset] Warning: Only {count} records available, less than requested {num_records}")
-    
-    return count
-
-
-def main():
-    if len(sys.argv) != 3:
-        print("Usage: python create_subdataset.py <dataset_name> <num_records>")
+    if mode not in SAMPLE_MODES:
+        raise ValueError(f"Unknown sample mode: {mode} (supported: {', '.join(SAMPLE_MODES)})")
+
+    input_paths = [input_path] if isinstance(input_path, str) else list(input_path)
+    for path in input_paths:
+        if not os.path.exists(path):
+            print(f"Error: Input file not found: {path}")
+            sys.exit(1)
+
+    spec = sample_spec(mode, seed, clusters)
+    source = train_sha256s(dataset_name, input_paths) if dataset_name else None
+    counts = {}
+    pending = {}
+    for n, output_path in sorted(outputs.items()):
+        # Reuse an existing subdataset only if the manifest records it as drawn
+        # the same way from the current train file(s); otherwise regenerate
+        entry = subset_entry(dataset_name, n) if source else None
+        if entry and entry.get("sample") == spec and entry.get("source") == source and \
+                os.path.exists(output_path) and os.path.getsize(output_path) == entry["bytes"]:
+            print(f"[subdataset] Subdataset already exists: {output_path}")
+            print(f"[subdataset] Skipping creation")
+            counts[n] = entry["rows"]
+        else:
+            pending[n] = output_path
+    if not pending:
+        return counts
+
+    sizes = sorted(pending)
+    rng = np.random.default_rng(seed)
+    print(f"[subdataset] Creating subdatasets with {', '.join(str(n) for n in sizes)} records ({mode})")
+    print(f"[subdataset] Input:  {', '.join(input_paths)}")
+    for n in sizes:
+        print(f"[subdataset] Output: {pending[n]}")
+
+    if mode == "reservoir":
+        samples, total = reservoir_sample(input_paths, sizes, rng)
+        written = write_subsets(pending, samples)
+    else:
+        if mode == "head":
+            selections = head_selection(sizes)
+        elif mode == "uniform":
+            total = input_offsets(input_paths)[1][-1]
+            selections = uniform_selection(total, sizes, rng)
+        else:
+            selections = kmeans_selection(input_paths, sizes, rng, clusters, dataset_name)
+        written = write_selection(input_paths, pending, selections)
+
+    for n in sizes:
+        count, digest = written[n]
+        print(f"[subdataset] Created subdataset with {count} records")
+        if dataset_name:
+            entry = file_entry(pending[n], count, digest)
+            entry["sample"] = spec
+            entry["source"] = source
+            record_subset(dataset_name, n, entry)
+        if count < n:
+            print(f"[subdataset] Warning: Only {count} records available, less than requested {n}")
+        counts[n] = count
+
+    return counts
+
+
+def create_subdataset(input_path, output_path, num_records, dataset_name=None, mode="head",
+                      seed=DEFAULT_SEED, clusters=KMEANS_CLUSTERS):
+    """
+    Create one subdataset with num_records from input_path (see create_subdatasets).
+    """
+    return create_subdatasets(input_path, {num_records: output_path}, mode, seed, clusters,
+                              dataset_name)[num_records]
+
+
+def main(argv=None):
+    args, options = parse_options(sys.argv[1:] if argv is None else argv)
+    if len(args) != 2 or options.get("sample", "head") not in SAMPLE_MODES:
+        print("Usage: python create_subdataset.py <dataset_name> <num_records>[,<num_records>...] "
+              "[--sample=head|uniform|reservoir|kmeans] [--seed=N] [--clusters=N]")
         print("Example: python create_subdataset.py fashion-mnist-784-euclidean 20000")
+        print("Example: python create_subdataset.py fashion-mnist-784-euclidean 10000,20000 --sample=uniform")
+        print("Example: python create_subdataset.py glove-100-angular 100000 --sample=kmeans --clusters=256")
         sys.exit(1)
-    
-    dataset_name = sys.argv[1]
-    num_records = int(sys.argv[2])
-    
+
+    dataset_name = args[0]
+    sizes = sorted({int(n) for n in args[1].split(",")})
+    mode = options.get("sample", "head")
+    seed = int(options.get("seed", DEFAULT_SEED))
+    clusters = int(options.get("clusters", KMEANS_CLUSTERS))
+
     base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
     datasets_dir = os.path.join(base_dir, "datasets")
-    
-    input_path = os.path.join(datasets_dir, f"{dataset_name}_train.jsonl")
-    output_path = os.path.join(datasets_dir, f"{dataset_name}_train_{num_records}.jsonl")
-    
-    create_subdataset(input_path, output_path, num_records)
+
+    # Full train file, or the shards written by hdf5_to_jsonl.py --shards=N
+    input_path = train_jsonl_paths(dataset_name, datasets_dir=datasets_dir) or \
+        os.path.join(datasets_dir, f"{dataset_name}_train.jsonl")
+    outputs = {n: os.path.join(datasets_dir, f"{dataset_name}_train_{n}.jsonl") for n in sizes}
+
+    try:
+        create_subdatasets(input_path, outputs, mode, seed, clusters, dataset_name)
+    except ValueError as e:  # e.g. --sample=kmeans on a dataset with an unsupported metric
+        print(f"Error: {e}")
+        sys.exit(1)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,54 @@
+import os
+import re
+
+# Base project directory (scripts/dataset_files.py -> parent)
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DATASETS_DIR = os.path.join(BASE_DIR, "datasets")
+
+
+def shard_file_name(dataset_name, shard, num_shards):
+    """
+    File name of one train shard (shard is 0-based).
+    Example: fashion-mnist-784-euclidean_train_shard001of004.jsonl
+    """
+    return f"{dataset_name}_train_shard{shard + 1:03d}of{num_shards:03d}.jsonl"
+
+
+def shard_paths(dataset_name, datasets_dir=DATASETS_DIR):
+    """
+    Train shard files written by hdf5_to_jsonl.py --shards=N, in row order.
+    Returns [] unless a complete set of shards is present.
+    """
+    if not os.path.isdir(datasets_dir):
+        return []
+
+    pattern = re.compile(re.escape(dataset_name) + r"_train_shard(\d+)of(\d+)\.jsonl$")
+    found = {}
+    num_shards = None
+    for filename in os.listdir(datasets_dir):
+        m = pattern.match(filename)
+        if m:
+            found[int(m.group(1))] = os.path.join(datasets_dir, filename)
+            num_shards = int(m.group(2))
+
+    if num_shards is None or sorted(found) != list(range(1, num_shards + 1)):
+        return []
+    return [found[i] for i in range(1, num_shards + 1)]
+
+
+def train_jsonl_paths(dataset_name, num_records=None, datasets_dir=DATASETS_DIR):
+    """
+    JSONL files holding the train vectors of a dataset/subdataset, in row order.
+    The single <dataset>_train[_<N>].jsonl file wins; full datasets fall back
+    to shards. Returns [] if nothing is found.
+    """
+    if num_records:
+        path = os.path.join(datasets_dir, f"{dataset_name}_train_{num_records}.jsonl")
+        return [path] if os.path.exists(path) else []
+
+    path = os.path.join(datasets_dir, f"{dataset_name}_train.jsonl")
+    if os.path.exists(path):
+        return [path]
+    return shard_paths(dataset_name, datasets_dir)
+
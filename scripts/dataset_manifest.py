@@ -0,0 +1,164 @@
+import hashlib
+import json
+import os
+import sys
+import threading
+from datetime import datetime
+
+from dataset_files import BASE_DIR, DATASETS_DIR
+
+HASH_BLOCK_SIZE = 1 << 20  # bytes read at a time when hashing files
+
+# Held around every load-modify-save of a manifest: pipeline.py converts the
+# test vectors while another thread records a subdataset in the same file
+MANIFEST_LOCK = threading.RLock()
+
+
+def manifest_path(dataset_name, datasets_dir=DATASETS_DIR):
+    """datasets/<dataset>_manifest.json, written by hdf5_to_jsonl.py"""
+    return os.path.join(datasets_dir, f"{dataset_name}_manifest.json")
+
+
+def load_manifest(dataset_name, datasets_dir=DATASETS_DIR):
+    """The dataset manifest as a dict, or None if the dataset has none."""
+    path = manifest_path(dataset_name, datasets_dir)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def save_manifest(manifest, datasets_dir=DATASETS_DIR):
+    """Write the manifest atomically (temp file + rename)."""
+    path = manifest_path(manifest["dataset"], datasets_dir)
+    with open(path + ".tmp", "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(path + ".tmp", path)
+    return path
+
+
+def file_sha256(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def file_entry(path, rows, sha256=None):
+    """
+    Manifest entry for one JSONL file. sha256 is computed from the file
+    unless the writer already has it.
+    """
+    return {
+        "path": os.path.relpath(path, BASE_DIR),
+        "rows": int(rows),
+        "bytes": os.path.getsize(path),
+        "sha256": sha256 or file_sha256(path),
+    }
+
+
+def new_manifest(dataset_name, source_path, dimension, metric, normalized, dtype):
+    return {
+        "dataset": dataset_name,
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "source": {"path": os.path.relpath(source_path, BASE_DIR), "bytes": os.path.getsize(source_path)},
+        "dimension": int(dimension),
+        "metric": metric,
+        "normalized": normalized,
+        "dtype": dtype,
+        "counts": {},
+        "files": {},
+        "subsets": {},
+    }
+
+
+def record_subset(dataset_name, num_records, entry, datasets_dir=DATASETS_DIR):
+    """Add a subdataset file to the manifest (no-op without a manifest)."""
+    with MANIFEST_LOCK:
+        manifest = load_manifest(dataset_name, datasets_dir)
+        if manifest is None:
+            return
+        manifest.setdefault("subsets", {})[str(num_records)] = entry
+        save_manifest(manifest, datasets_dir)
+
+
+def manifest_dimension(dataset_name):
+    """Vector dimension from the manifest, or None."""
+    manifest = load_manifest(dataset_name)
+    return manifest.get("dimension") if manifest else None
+
+
+def subset_entry(dataset_name, num_records):
+    """Manifest entry of a subdataset (path, rows, ..., sample), or None."""
+    manifest = load_manifest(dataset_name)
+    if manifest is None:
+        return None
+    return manifest.get("subsets", {}).get(str(num_records))
+
+
+def train_sha256s(dataset_name, input_paths):
+    """
+    sha256 of each train file in input_paths according to the manifest, or
+    None unless the manifest lists exactly these files, at their current size.
+    """
+    manifest = load_manifest(dataset_name)
+    entries = manifest.get("files", {}).get("train", []) if manifest else []
+    if [e["path"] for e in entries] != [os.path.relpath(path, BASE_DIR) for path in input_paths]:
+        return None
+    if any(os.path.getsize(path) != e["bytes"] for path, e in zip(input_paths, entries)):
+        return None
+    return [e["sha256"] for e in entries]
+
+
+def train_count(dataset_name, num_records=None):
+    """
+    Number of train records in the dataset (or subdataset) according to the
+    manifest, or None if it does not say.
+    """
+    if num_records:
+        entry = subset_entry(dataset_name, num_records)
+        return entry["rows"] if entry else None
+    manifest = load_manifest(dataset_name)
+    return manifest.get("counts", {}).get("train") if manifest else None
+
+
+def verify_manifest(manifest, check_hashes=True):
+    """Problems found comparing the manifest's files with the disk (empty if none)."""
+    entries = [e for files in manifest.get("files", {}).values() for e in files]
+    entries += list(manifest.get("subsets", {}).values())
+    problems = []
+    for entry in entries:
+        path = os.path.join(BASE_DIR, entry["path"])
+        if not os.path.exists(path):
+            problems.append(f"missing: {entry['path']}")
+        elif os.path.getsize(path) != entry["bytes"]:
+            problems.append(f"size changed: {entry['path']}")
+        elif check_hashes and file_sha256(path) != entry["sha256"]:
+            problems.append(f"checksum mismatch: {entry['path']}")
+    return problems
+
+
+def main():
+    if len(sys.argv) < 2 or len(sys.argv) > 3 or (len(sys.argv) == 3 and sys.argv[2] != "--verify"):
+        print("Usage: python dataset_manifest.py <dataset_name> [--verify]")
+        print("Example: python dataset_manifest.py glove-100-angular --verify")
+        sys.exit(1)
+
+    dataset_name = sys.argv[1]
+    manifest = load_manifest(dataset_name)
+    if manifest is None:
+        print(f"Error: no manifest at {manifest_path(dataset_name)} (run hdf5_to_jsonl.py first)")
+        sys.exit(1)
+
+    print(json.dumps(manifest, indent=2))
+    if len(sys.argv) == 3:
+        problems = verify_manifest(manifest)
+        for problem in problems:
+            print(f"[verify] {problem}")
+        print(f"[verify] {'OK' if not problems else f'{len(problems)} problem(s)'}")
+        sys.exit(1 if problems else 0)
+
+
+if __name__ == "__main__":
+    main()
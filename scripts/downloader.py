@@ -0,0 +1,318 @@
+import json
+import os
+import shutil
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+from urllib.request import url2pathname
+
+import requests
+from tqdm import tqdm
+
+from cli_options import parse_options
+from dataset_manifest import file_sha256
+
+# --------------------
+# Config (override with environment variables)
+# --------------------
+BASE_URL = os.environ.get("ANN_BASE_URL", "https://ann-benchmarks.com")  # or a local mirror / file:// URL
+WORKERS = int(os.environ.get("ANN_DOWNLOAD_WORKERS", "1"))  # parallel ranged segments
+RETRIES = int(os.environ.get("ANN_DOWNLOAD_RETRIES", "5"))
+CONNECT_TIMEOUT = 10   # seconds
+READ_TIMEOUT = 60      # seconds without data before a segment is retried
+BACKOFF = 1.0          # seconds; doubled after each failed attempt
+CHUNK_SIZE = 1 << 20   # bytes per read/write (the old downloader used 8 KB)
+MIN_SEGMENT_SIZE = 64 << 20     # never split a file into segments smaller than this
+PROGRESS_SAVE_BYTES = 64 << 20  # bytes downloaded between progress file updates
+
+
+class DownloadError(Exception):
+    """A download could not be completed or failed verification."""
+
+
+def dataset_url(dataset_name, base_url=BASE_URL):
+    return f"{base_url.rstrip('/')}/{dataset_name}.hdf5"
+
+
+def local_source(url):
+    """Filesystem path for file:// URLs and plain paths, None for HTTP(S)."""
+    parsed = urlparse(url)
+    if parsed.scheme == "file":
+        return url2pathname(parsed.path)
+    if parsed.scheme in ("http", "https"):
+        return None
+    return url
+
+
+def part_path(path):
+    """Temp file a download goes to until it is verified."""
+    return path + ".part"
+
+
+def progress_path(part):
+    """Segment bookkeeping of a parallel download into part."""
+    return part + ".json"
+
+
+def saved_progress(part, url, size):
+    """
+    Saved segment progress of an interrupted parallel download of url into
+    part, or None. Such a .part is preallocated to its full size, so only
+    this bookkeeping tells how much of it holds data.
+    """
+    progress_file = progress_path(part)
+    if not (os.path.exists(progress_file) and os.path.exists(part)):
+        return None
+    try:
+        with open(progress_file, "r") as f:
+            saved = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if saved.get("url") != url or saved.get("size") != size or not saved.get("bounds"):
+        return None
+    return saved
+
+
+def probe(session, url):
+    """(size or None, whether the server accepts byte ranges)."""
+    r = session.head(url, allow_redirects=True, timeout=CONNECT_TIMEOUT)
+    r.raise_for_status()
+    size = r.headers.get("Content-Length")
+    return (int(size) if size is not None else None), r.headers.get("Accept-Ranges") == "bytes"
+
+
+def fetch_range(session, url, f, start, end, bar, ranged=True, on_progress=None):
+    """
+    Write bytes [start, end) of url into f at the same offsets (end None:
+    to the end of the resource), retrying with backoff. With ranged, each
+    retry resumes from the last byte written; without (servers that ignore
+    Range), it starts over. Returns the offset reached.
+    """
+    first = start
+    delay = BACKOFF
+    for attempt in range(RETRIES + 1):
+        if not ranged and start != first:
+            bar.update(first - start)
+            start = first
+        if end is not None and start >= end:
+            return start
+        headers = {"Range": f"bytes={start}-{'' if end is None else end - 1}"} if ranged else {}
+        try:
+            with session.get(url, headers=headers, stream=True, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT)) as r:
+                r.raise_for_status()
+                if ranged and r.status_code != 206:
+                    raise DownloadError(f"Server ignored the byte range request for {url}")
+                f.seek(start)
+                for chunk in r.iter_content(chunk_size=CHUNK_SIZE):
+                    f.write(chunk)
+                    start += len(chunk)
+                    bar.update(len(chunk))
+                    if on_progress:
+                        on_progress(start)
+            if end is None or start >= end:
+                return start
+            raise requests.ConnectionError(f"connection closed at byte {start}")
+        except (requests.ConnectionError, requests.exceptions.ChunkedEncodingError, requests.Timeout,
+                requests.HTTPError) as e:
+            status = getattr(getattr(e, "response", None), "status_code", None)
+            if attempt == RETRIES or (status is not None and status < 500 and status != 429):
+                raise
+            print(f"\n[download] {e}; resuming at byte {start} in {delay:.1f}s")
+            time.sleep(delay)
+            delay *= 2
+    return start
+
+
+def download_stream(session, url, part, size, resumable):
+    """
+    Single-connection download, resuming a partial .part file if the server
+    allows it. The .part must not be a preallocated parallel download: its
+    size is taken as the number of bytes already written.
+    """
+    done = os.path.getsize(part) if resumable and os.path.exists(part) else 0
+    if size is not None and done > size:
+        done = 0
+    if done:
+        print(f"[download] Resuming at {done / (1 << 20):.1f} MB")
+    with open(part, "r+b" if done else "wb") as f, \
+            tqdm(total=size, initial=done, unit="B", unit_scale=True, unit_divisor=1024) as bar:
+        f.truncate(done)
+        fetch_range(session, url, f, done, size, bar, ranged=resumable)
+
+
+def download_segments(session, url, part, size, workers):
+    """
+    Parallel download of `workers` byte ranges into a preallocated .part
+    file. Progress of each segment is saved to <file>.part.json so an
+    interrupted download resumes every segment where it stopped.
+    """
+    progress_file = progress_path(part)
+    bounds = [(size * i // workers, size * (i + 1) // workers) for i in range(workers)]
+    done = [start for start, _ in bounds]
+    saved = saved_progress(part, url, size)
+    if saved and [tuple(b) for b in saved["bounds"]] == bounds:
+        done = saved["done"]
+        resumed = sum(d - start for d, (start, _) in zip(done, bounds))
+        print(f"[download] Resuming {workers} segments at {resumed / (1 << 20):.1f} MB")
+    else:
+        with open(part, "wb") as f:
+            f.truncate(size)
+
+    lock = threading.Lock()
+    unsaved = [0]
+
+    def save_progress():
+        with open(progress_file + ".tmp", "w") as f:
+            json.dump({"url": url, "size": size, "bounds": bounds, "done": done}, f)
+        os.replace(progress_file + ".tmp", progress_file)
+
+    def run(i):
+        def on_progress(offset):
+            with lock:
+                unsaved[0] += offset - done[i]
+                done[i] = offset
+                if unsaved[0] >= PROGRESS_SAVE_BYTES:
+                    unsaved[0] = 0
+                    save_progress()
+
+        with open(part, "r+b") as f:
+            fetch_range(session, url, f, done[i], bounds[i][1], bar, on_progress=on_progress)
+
+    initial = sum(d - s for d, (s, _) in zip(done, bounds))
+    with tqdm(total=size, initial=initial, unit="B", unit_scale=True, unit_divisor=1024) as bar:
+        try:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                for fut in [pool.submit(run, i) for i in range(workers)]:
+                    fut.result()
+        finally:
+            with lock:
+                save_progress()
+    os.remove(progress_file)
+
+
+def verify_download(part, size=None, sha256=None):
+    """Check the size, optional sha256 and HDF5 signature of a finished download."""
+    actual = os.path.getsize(part)
+    if size is not None and actual != size:
+        raise DownloadError(f"Size mismatch: expected {size} bytes, got {actual}")
+    if sha256:
+        print("[download] Verifying sha256...")
+        digest = file_sha256(part)
+        if digest != sha256.lower():
+            raise DownloadError(f"Checksum mismatch: expected {sha256}, got {digest}")
+
+    import h5py
+
+    if not h5py.is_hdf5(part):
+        raise DownloadError(f"Not an HDF5 file: {part}")
+
+
+def expected_sha256(session, url):
+    """sha256 published next to the file as <url>.sha256 (mirrors may provide it), or None."""
+    source = local_source(url + ".sha256")
+    try:
+        if source is not None:
+            if not os.path.exists(source):
+                return None
+            with open(source, "r") as f:
+                text = f.read()
+        else:
+            r = session.get(url + ".sha256", timeout=CONNECT_TIMEOUT)
+            if r.status_code != 200:
+                return None
+            text = r.text
+    except requests.RequestException:
+        return None
+    fields = text.split()
+    return fields[0] if fields else None
+
+
+def download_file(url, path, workers=WORKERS, sha256=None):
+    """
+    Download url to path. Data goes to <path>.part, which is resumed with
+    HTTP Range requests after an interruption and only renamed to path once
+    its size, sha256 (given, or published as <url>.sha256) and HDF5
+    signature check out. file:// URLs and plain paths are copied.
+    """
+    part = part_path(path)
+    session = requests.Session()
+    sha256 = sha256 or expected_sha256(session, url)
+
+    source = local_source(url)
+    if source is not None:
+        if not os.path.exists(source):
+            raise DownloadError(f"Not found in mirror: {source}")
+        size = os.path.getsize(source)
+        with open(source, "rb") as src, open(part, "wb") as dst:
+            shutil.copyfileobj(src, dst, CHUNK_SIZE)
+    else:
+        size, ranges = probe(session, url)
+        workers = min(workers, size // MIN_SEGMENT_SIZE) if size and ranges else 1
+        saved = saved_progress(part, url, size) if size and ranges else None
+        if saved:
+            # Resume an interrupted parallel download with its own segments, whatever --workers says now
+            workers = len(saved["bounds"])
+        elif os.path.exists(progress_path(part)):
+            # A preallocated .part that cannot be resumed: its size says nothing about progress
+            print("[download] Discarding a partial parallel download that cannot be resumed")
+            os.remove(progress_path(part))
+            if os.path.exists(part):
+                os.remove(part)
+        if workers > 1 or saved:
+            print(f"[download] {size / (1 << 20):.1f} MB in {workers} parallel segments")
+            download_segments(session, url, part, size, workers)
+        else:
+            download_stream(session, url, part, size, ranges)
+
+    try:
+        verify_download(part, size, sha256)
+    except DownloadError:
+        os.remove(part)  # a corrupt .part must not be resumed
+        raise
+    os.replace(part, path)
+    return path
+
+
+def download_hdf5(dataset_name, raw_dir, base_url=BASE_URL, workers=WORKERS, sha256=None):
+    """Download raw/<dataset>.hdf5 if it does not exist."""
+    os.makedirs(raw_dir, exist_ok=True)
+    hdf5_path = os.path.join(raw_dir, f"{dataset_name}.hdf5")
+
+    if os.path.exists(hdf5_path):
+        print(f"[download] Already exists: {hdf5_path}")
+        return hdf5_path
+
+    url = dataset_url(dataset_name, base_url)
+    print(f"[download] Downloading: {url}")
+    print(f"[download] -> {hdf5_path}")
+
+    download_file(url, hdf5_path, workers, sha256)
+
+    print("[download] Done.")
+    return hdf5_path
+
+
+def main():
+    args, options = parse_options(sys.argv[1:])
+    if len(args) != 1:
+        print("Usage: python downloader.py <dataset_name> [--base-url=URL] [--workers=N] [--sha256=HEX]")
+        print("Example: python downloader.py fashion-mnist-784-euclidean")
+        print("Example: python downloader.py deep-image-96-angular --workers=8")
+        print("Example: python downloader.py glove-100-angular --base-url=file:///data/ann-mirror")
+        sys.exit(1)
+
+    base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    try:
+        download_hdf5(args[0], os.path.join(base_dir, "raw"),
+                      base_url=options.get("base-url", BASE_URL),
+                      workers=int(options.get("workers", WORKERS)),
+                      sha256=options.get("sha256"))
+    except (DownloadError, requests.RequestException) as e:
+        print(f"[download] FAILED: {e}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,399 @@
+import hashlib
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+from dataset_files import train_jsonl_paths
+from dataset_manifest import subset_entry, train_count
+from line_index import line_count, line_offsets, read_records
+from vector_metric import canonical_metric, dataset_metric
+
+# Base project directory (scripts/ground_truth.py -> parent)
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+RAW_DIR = os.path.join(BASE_DIR, "raw")
+DATASETS_DIR = os.path.join(BASE_DIR, "datasets")
+TESTS_DIR = os.path.join(BASE_DIR, "tests")
+NEIGHBORS_DIR = os.path.join(BASE_DIR, "neighbors")
+
+TOP_K = 100              # number of exact neighbors kept per query
+TRAIN_BLOCK_SIZE = 50000  # train rows held in memory at once
+QUERY_BATCH_SIZE = 1000   # query rows per distance matrix
+METRIC = "euclidean"
+SAMPLE_HASH_BYTES = 1 << 20  # bytes hashed from each end of a source file
+
+
+def iter_jsonl_blocks(paths, block_size=TRAIN_BLOCK_SIZE, limit=None):
+    """
+    Stream train JSONL file(s) as (ids, vectors) blocks. Several paths
+    (e.g. shards) are read one after another; a block never spans two files.
+    Each block is one byte range located with the line offset index and
+    parsed with one decoder call.
+    ids is an int64 array of the record `idx` values, vectors is float32.
+    """
+    if isinstance(paths, str):
+        paths = [paths]
+    remaining = limit
+    for path in paths:
+        offsets = line_offsets(path)
+        num_lines = len(offsets) - 1
+        for start in range(0, num_lines, block_size):
+            if remaining is not None and remaining <= 0:
+                return
+            stop = min(start + block_size, num_lines)
+            if remaining is not None:
+                stop = min(stop, start + remaining)
+                remaining -= stop - start
+            records = read_records(path, start, stop, offsets)
+            yield (np.asarray([obj["idx"] for obj in records], dtype=np.int64),
+                   np.asarray([obj["embedding"] for obj in records], dtype=np.float32))
+
+
+def iter_hdf5_blocks(path, block_size=TRAIN_BLOCK_SIZE, limit=None):
+    """
+    Stream the 'train' table of an ann-benchmarks HDF5 file as (ids, vectors)
+    blocks. Row numbers are used as ids, matching hdf5_to_jsonl.py.
+    """
+    import h5py
+
+    with h5py.File(path, "r") as f:
+        train = f["train"]
+        total = train.shape[0] if limit is None else min(limit, train.shape[0])
+        for start in range(0, total, block_size):
+            end = min(start + block_size, total)
+            yield np.arange(start, end, dtype=np.int64), np.asarray(train[start:end], dtype=np.float32)
+
+
+def load_query_matrix(path, limit=None):
+    """Load query vectors from test.jsonl into a float32 matrix."""
+    return np.asarray([obj["embedding"] for obj in read_records(path, stop=limit)], dtype=np.float32)
+
+
+def merge_top_k(best_ids, best_dists, cand_ids, cand_dists, k):
+    """Merge the running top-k with a block of candidates (row-wise)."""
+    ids = np.concatenate([best_ids, cand_ids], axis=1)
+    dists = np.concatenate([best_dists, cand_dists], axis=1)
+    if dists.shape[1] > k:
+        part = np.argpartition(dists, k - 1, axis=1)[:, :k]
+        ids = np.take_along_axis(ids, part, axis=1)
+        dists = np.take_along_axis(dists, part, axis=1)
+    order = np.argsort(dists, axis=1, kind="stable")
+    return np.take_along_axis(ids, order, axis=1), np.take_along_axis(dists, order, axis=1)
+
+
+def normalize_rows(vectors):
+    """Scale rows to unit length (all-zero rows are left as they are)."""
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def compute_ground_truth(queries, train_blocks, k=TOP_K, query_batch_size=QUERY_BATCH_SIZE, metric=METRIC):
+    """
+    Exact top-k for every query over a stream of train blocks.
+
+    The train set is read once; each block is compared against the queries in
+    batches so that only a (query_batch_size x block_size) distance matrix is
+    held in memory. Euclidean uses ||q||^2 - 2 q.x + ||x||^2, angular uses
+    1 - q.x on unit-normalized vectors and dot uses -q.x.
+    Returns (neighbor_ids, distances), both shaped (num_queries, k);
+    Euclidean distances are squared and computed in float64, since the norm
+    expansion cancels badly in float32 and near-tie neighbors could swap.
+    """
+    metric = canonical_metric(metric)
+    if metric is None:
+        raise ValueError("No metric given for local ground truth")
+    if metric == "angular":
+        queries = normalize_rows(queries)
+    elif metric == "euclidean":
+        queries = queries.astype(np.float64)
+
+    num_queries = queries.shape[0]
+    best_ids = np.full((num_queries, 0), -1, dtype=np.int64)
+    best_dists = np.full((num_queries, 0), np.inf, dtype=queries.dtype)
+    query_norms = np.einsum("ij,ij->i", queries, queries)
+
+    for block_ids, block in train_blocks:
+        if metric == "angular":
+            block = normalize_rows(block)
+        elif metric == "euclidean":
+            block = block.astype(np.float64)
+        block_norms = np.einsum("ij,ij->i", block, block)
+        new_ids = []
+        new_dists = []
+        for start in range(0, num_queries, query_batch_size):
+            end = min(start + query_batch_size, num_queries)
+            products = queries[start:end] @ block.T
+            if metric == "euclidean":
+                dists = query_norms[start:end, None] - 2.0 * products + block_norms[None, :]
+                np.maximum(dists, 0.0, out=dists)
+            elif metric == "angular":
+                dists = 1.0 - products
+            else:
+                dists = -products
+
+            cand = dists.shape[1]
+            if cand > k:
+                part = np.argpartition(dists, k - 1, axis=1)[:, :k]
+                cand_ids = block_ids[part]
+                cand_dists = np.take_along_axis(dists, part, axis=1)
+            else:
+                cand_ids = np.broadcast_to(block_ids, dists.shape)
+                cand_dists = dists
+
+            ids, d = merge_top_k(best_ids[start:end], best_dists[start:end], cand_ids, cand_dists, k)
+            new_ids.append(ids)
+            new_dists.append(d)
+        best_ids = np.concatenate(new_ids, axis=0)
+        best_dists = np.concatenate(new_dists, axis=0)
+
+    return best_ids, best_dists
+
+
+def source_fingerprint(path, sample_bytes=SAMPLE_HASH_BYTES):
+    """
+    Identify a source file by its path relative to the project root, size,
+    mtime and a SHA-1 of its first and last sample_bytes (hashing multi-GB
+    train files in full would defeat the cache).
+    """
+    st = os.stat(path)
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        h.update(f.read(sample_bytes))
+        if st.st_size > sample_bytes:
+            f.seek(max(st.st_size - sample_bytes, sample_bytes))
+            h.update(f.read(sample_bytes))
+    return {
+        "path": os.path.relpath(path, BASE_DIR),
+        "size": st.st_size,
+        "mtime_ns": st.st_mtime_ns,
+        "sha1_sample": h.hexdigest(),
+    }
+
+
+def source_matches(fingerprint):
+    """Check a stored fingerprint against the file on disk."""
+    if not fingerprint.get("path"):
+        return False
+    path = os.path.join(BASE_DIR, fingerprint["path"])
+    if not os.path.exists(path):
+        return False
+    st = os.stat(path)
+    if st.st_size != fingerprint.get("size"):
+        return False
+    if st.st_mtime_ns == fingerprint.get("mtime_ns"):
+        return True
+    # Touched or copied but possibly unchanged: fall back to the content hash
+    return source_fingerprint(path)["sha1_sample"] == fingerprint.get("sha1_sample")
+
+
+def cache_path(dataset_name, num_records=None, metric=METRIC, k=TOP_K):
+    """
+    Location of the cached ground truth, e.g.
+        neighbors/fashion-mnist-784-euclidean_20000_euclidean_k100.npy
+    Full datasets use "full" in place of num_records.
+    """
+    size = num_records if num_records else "full"
+    return os.path.join(NEIGHBORS_DIR, f"{dataset_name}_{size}_{metric}_k{k}.npy")
+
+
+def meta_path(npy_path):
+    """Sidecar JSON describing where a cached ground truth came from."""
+    return npy_path[:-len(".npy")] + ".meta.json"
+
+
+def load_cached_ground_truth(dataset_name, num_queries, num_records=None, metric=METRIC, k=TOP_K):
+    """
+    Return the cached neighbor ids (memory-mapped, num_queries x k) or None
+    when there is no cache, it covers too few queries, or its source changed.
+    """
+    path = cache_path(dataset_name, num_records, metric, k)
+    mpath = meta_path(path)
+    if not os.path.exists(path) or not os.path.exists(mpath):
+        return None
+
+    with open(mpath, "r") as f:
+        meta = json.load(f)
+    sources = meta.get("sources", [])
+    if not sources or not all(source_matches(fp) for fp in sources):
+        print(f"[groundtruth] Source changed since {path} was written, ignoring cache")
+        return None
+
+    cached = np.load(path, mmap_mode="r")
+    if cached.shape[0] < num_queries:
+        print(f"[groundtruth] Cache covers {cached.shape[0]} queries, {num_queries} requested")
+        return None
+
+    print(f"[groundtruth] Using cached ground truth ({meta.get('producer')}): {path}")
+    return cached[:num_queries]
+
+
+def save_ground_truth(ids, dataset_name, num_records=None, metric=METRIC, k=TOP_K,
+                      source_paths=(), producer="local"):
+    """
+    Write neighbor ids (num_queries x k, -1 padded) and a sidecar with the
+    fingerprints of the train file(s) they were computed from.
+    """
+    if isinstance(source_paths, str):
+        source_paths = [source_paths]
+    os.makedirs(NEIGHBORS_DIR, exist_ok=True)
+    path = cache_path(dataset_name, num_records, metric, k)
+    ids = np.asarray(ids, dtype=np.int64)
+
+    # Write to temp names and rename so readers never see a partial cache
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        np.save(f, ids)
+    meta = {
+        "dataset": dataset_name,
+        "num_records": int(num_records) if num_records else None,
+        "metric": metric,
+        "k": k,
+        "num_queries": int(ids.shape[0]),
+        "producer": producer,
+        "sources": [source_fingerprint(p) for p in source_paths],
+    }
+    with open(meta_path(path) + ".tmp", "w") as f:
+        json.dump(meta, f, indent=2)
+    os.replace(tmp_path, path)
+    os.replace(meta_path(path) + ".tmp", meta_path(path))
+
+    print(f"[groundtruth] Saved ({producer}): {path}")
+    return path
+
+
+def pad_neighbor_lists(lists, k=TOP_K):
+    """Turn ragged neighbor id lists into a (len(lists) x k) array padded with -1."""
+    out = np.full((len(lists), k), -1, dtype=np.int64)
+    for i, ids in enumerate(lists):
+        ids = list(ids)[:k]
+        out[i, :len(ids)] = ids
+    return out
+
+
+def strip_padding(row):
+    """Neighbor id list for one query, without -1 padding."""
+    return [int(x) for x in row if x >= 0]
+
+
+def train_source(dataset_name, num_records=None):
+    """
+    Pick the train source for a dataset/subdataset.
+    Prefers the JSONL that was loaded into AsterixDB and falls back to the
+    first num_records rows of the raw HDF5 file (same rows create_subdataset.py
+    takes in its default head mode; sampled subsets have no HDF5 fallback).
+    Returns (kind, paths, limit); paths has several entries for train shards.
+    """
+    jsonl_paths = train_jsonl_paths(dataset_name, num_records, DATASETS_DIR)
+    if jsonl_paths:
+        return "jsonl", jsonl_paths, None
+
+    entry = subset_entry(dataset_name, num_records) if num_records else None
+    sampled = entry is not None and entry.get("sample", {}).get("mode", "head") != "head"
+    hdf5_path = os.path.join(RAW_DIR, f"{dataset_name}.hdf5")
+    if os.path.exists(hdf5_path) and not sampled:
+        return "hdf5", [hdf5_path], int(num_records) if num_records else None
+
+    raise FileNotFoundError(f"No train data found for {dataset_name} in {DATASETS_DIR} or {hdf5_path}")
+
+
+def train_rows(dataset_name, num_records=None):
+    """Number of records in the train source train_source() picks (manifest count when it has one)."""
+    kind, paths, limit = train_source(dataset_name, num_records)
+    if kind == "jsonl":
+        rows = train_count(dataset_name, num_records)
+        return rows if rows is not None else sum(line_count(path) for path in paths)
+
+    import h5py
+
+    with h5py.File(paths[0], "r") as f:
+        total = f["train"].shape[0]
+    return total if limit is None else min(limit, total)
+
+
+def hdf5_neighbors(dataset_name, num_queries, k):
+    """
+    Ground truth shipped in the raw HDF5 'neighbors' table. Only valid for
+    the full train set. Returns (ids, hdf5_path) or (None, None).
+    """
+    hdf5_path = os.path.join(RAW_DIR, f"{dataset_name}.hdf5")
+    if not os.path.exists(hdf5_path):
+        return None, None
+
+    import h5py
+
+    with h5py.File(hdf5_path, "r") as f:
+        if "neighbors" not in f:
+            return None, None
+        neighbors = f["neighbors"]
+        if neighbors.shape[0] < num_queries or neighbors.shape[1] < k:
+            return None, None
+        return np.asarray(neighbors[:num_queries, :k], dtype=np.int64), hdf5_path
+
+
+def get_ground_truth(dataset_name, num_queries, num_records=None, k=TOP_K, metric=None):
+    """
+    Return exact neighbor ids (num_queries x k) for the first num_queries test
+    vectors. Uses the cache when valid; otherwise takes the HDF5 'neighbors'
+    table (full dataset) or computes them locally, and caches the result.
+    metric defaults to the dataset's metric (see vector_metric.dataset_metric).
+    """
+    metric = metric or dataset_metric(dataset_name)
+    cached = load_cached_ground_truth(dataset_name, num_queries, num_records, metric, k)
+    if cached is not None:
+        return cached
+
+    if not num_records:
+        ids, hdf5_path = hdf5_neighbors(dataset_name, num_queries, k)
+        if ids is not None:
+            save_ground_truth(ids, dataset_name, num_records, metric, k,
+                              source_paths=hdf5_path, producer="hdf5")
+            return ids
+
+    tests_path = os.path.join(TESTS_DIR, f"{dataset_name}_test.jsonl")
+    if not os.path.exists(tests_path):
+        raise FileNotFoundError(f"Test file not found: {tests_path}")
+
+    kind, source, limit = train_source(dataset_name, num_records)
+    queries = load_query_matrix(tests_path, limit=num_queries)
+
+    print(f"[groundtruth] Computing exact {metric} top-{k} for {queries.shape[0]} queries")
+    print(f"[groundtruth] Train source ({kind}): {', '.join(source)}")
+
+    start = time.perf_counter()
+    if kind == "jsonl":
+        blocks = iter_jsonl_blocks(source, limit=limit)
+    else:
+        blocks = iter_hdf5_blocks(source[0], limit=limit)
+    ids, _ = compute_ground_truth(queries, blocks, k=k, metric=metric)
+    elapsed = time.perf_counter() - start
+    print(f"[groundtruth] Done in {elapsed:.3f}s")
+
+    ids = pad_neighbor_lists(ids, k) if ids.shape[1] < k else ids
+    save_ground_truth(ids, dataset_name, num_records, metric, k, source_paths=source, producer="local")
+    return ids
+
+
+def main():
+    if len(sys.argv) < 3 or len(sys.argv) > 4:
+        print("Usage: python ground_truth.py <dataset_name> <num_queries> [num_records]")
+        print("Example: python ground_truth.py fashion-mnist-784-euclidean 1000")
+        print("Example: python ground_truth.py fashion-mnist-784-euclidean 1000 20000")
+        sys.exit(1)
+
+    dataset_name = sys.argv[1]
+    num_queries = int(sys.argv[2])
+    num_records = sys.argv[3] if len(sys.argv) == 4 else None
+
+    try:
+        get_ground_truth(dataset_name, num_queries, num_records)
+    except (FileNotFoundError, ValueError) as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,26 @@
 import h5py
+import hashlib
 import json
 import numpy as np
 import sys
 import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from tqdm import tqdm
 
+from cli_options import parse_options
+from dataset_files import shard_file_name
+from dataset_manifest import (MANIFEST_LOCK, file_entry, load_manifest, manifest_path, new_manifest,
+                              save_manifest)
+from line_index import newline_ends, offsets_from_ends, save_line_offsets
+from vector_metric import DEFAULT_METRIC, metric_from_hdf5, metric_from_name
+
+try:
+    import orjson
+except ImportError:  # optional: much faster encoder when installed
+    orjson = None
+
 # Base project directory (scripts/convert_hdf5_to_json.py -> parent)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
@@ -13,42 +29,262 @@ DATASETS_DIR = os.path.join(BASE_DIR, "datasets")
 TESTS_DIR = os.path.join(BASE_DIR, "tests")
 NEIGHBORS_DIR = os.path.join(BASE_DIR, "neighbors")
 
+CHUNK_ROWS = 10000                 # rows read from HDF5 and encoded per task
+WORKERS = os.cpu_count() or 1      # encoder processes
+GROUPS = ("train", "test", "neighbors")  # HDF5 tables converted
+FLOAT32_DIGITS = 9                 # significant digits that round-trip any float32
+
 def ensure_dir(path):
     os.makedirs(path, exist_ok=True)
 
-def write_jsonl(output_path, array):
-    with open(output_path, "w") as f:
-        for i in tqdm(range(array.shape[0])):
-            obj = {
-                "idx": int(i),
-                "embedding": array[i].tolist()
-            }
-            f.write(json.dumps(obj) + "\n")
+def encode_rows(start, rows, key, precision=None, as_int=False, normalize=False):
+    """
+    Encode a chunk of rows as JSONL bytes. Row i gets idx start + i.
+    normalize scales every row to unit length first (all-zero rows stay zero).
+
+    precision:
+        None   -> shortest float32 round-trip text (orjson when available,
+                  otherwise %.9g)
+        N      -> N significant digits (%.Ng)
+        "full" -> the original json.dumps output (full double repr)
+    as_int writes every value as an integer.
+    """
+    if normalize:
+        norms = np.linalg.norm(rows, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        rows = (rows / norms).astype(np.float32)
+
+    if precision == "full" and not as_int:
+        lines = [
+            f'{{"idx": {start + i}, "{key}": {json.dumps(row)}}}\n'
+            for i, row in enumerate(rows.tolist())
+        ]
+        return "".join(lines).encode("utf-8")
+
+    if as_int:
+        rows = rows.astype(np.int64)
+
+    if orjson is not None and (as_int or precision is None):
+        return b"".join(
+            orjson.dumps({"idx": start + i, key: row}, option=orjson.OPT_SERIALIZE_NUMPY) + b"\n"
+            for i, row in enumerate(rows)
+        )
+
+    if as_int:
+        value_fmt = "%d"
+    else:
+        value_fmt = f"%.{FLOAT32_DIGITS if precision is None else precision}g"
+    # One format string per chunk: '{"idx":%d,"embedding":[%.9g,%.9g,...]}\n'
+    row_fmt = '{"idx":%d,"' + key + '":[' + ",".join([value_fmt] * rows.shape[1]) + ']}\n'
+    lines = [row_fmt % (start + i, *row) for i, row in enumerate(rows.tolist())]
+    return "".join(lines).encode("utf-8")
+
+def is_integer_valued(array, chunk_rows=CHUNK_ROWS):
+    """True if every value of an HDF5 dataset is integral (e.g. sift, fashion-mnist)."""
+    if np.issubdtype(array.dtype, np.integer):
+        return True
+    for _, rows in iter_chunks(array, chunk_rows):
+        if not np.array_equal(rows, np.rint(rows)):
+            return False
+    return True
+
+def iter_chunks(array, chunk_rows, first=0, last=None):
+    """
+    Read rows [first, last) of an HDF5 dataset in contiguous chunks:
+    yields (start, ndarray).
+    """
+    last = array.shape[0] if last is None else last
+    for start in range(first, last, chunk_rows):
+        yield start, np.ascontiguousarray(array[start:min(start + chunk_rows, last)])
+
+def write_jsonl(output_path, array, key="embedding", workers=WORKERS, chunk_rows=CHUNK_ROWS,
+                precision=None, detect_ints=True, row_range=None, as_int=None, normalize=False):
+    """
+    Convert an HDF5 dataset (or rows [first, last) of it, via row_range) to JSONL.
+
+    Values are written with `precision` (see encode_rows); integer-typed
+    datasets, and float datasets whose values are all integral when
+    detect_ints is set, are written as ints. Pass as_int to skip detection.
+    With normalize, rows are scaled to unit length (never written as ints).
+
+    Chunks are read in order by this process, encoded by a pool of
+    `workers` processes (at most 2 chunks per worker in flight) and written
+    back in order. Output goes to a temp file that is renamed on success,
+    so an interrupted run never leaves a truncated file behind. The line
+    offset index (see line_index.py) is collected while writing and saved
+    next to the output.
+    Returns (rows, bytes_written, seconds, legacy_bytes, sha256 of the output).
+    """
+    first, last = row_range if row_range else (0, array.shape[0])
+    total = last - first
+    tmp_path = output_path + ".tmp"
+    start_time = time.perf_counter()
+    bytes_written = 0
+    digest = hashlib.sha256()
+    line_ends = []
+    legacy_bytes = None  # full-precision size, extrapolated from the first chunk
+
+    if normalize:
+        as_int = False
+    elif as_int is None:
+        as_int = np.issubdtype(array.dtype, np.integer) or (detect_ints and is_integer_valued(array, chunk_rows))
+    if as_int:
+        print("  Integer-valued data: writing values as ints")
+
+    with open(tmp_path, "wb") as f, tqdm(total=total, unit="rows") as bar:
+        def write_chunk(num_rows, data):
+            nonlocal bytes_written
+            f.write(data)
+            digest.update(data)
+            line_ends.append(newline_ends(data, bytes_written))
+            bytes_written += len(data)
+            bar.update(num_rows)
+
+        def measure_legacy(rows):
+            nonlocal legacy_bytes
+            if legacy_bytes is None and len(rows):
+                sample = len(encode_rows(0, rows, key, precision="full"))
+                legacy_bytes = sample * total / len(rows)
+
+        if workers <= 1:
+            for start, rows in iter_chunks(array, chunk_rows, first, last):
+                measure_legacy(rows)
+                write_chunk(len(rows), encode_rows(start, rows, key, precision, as_int, normalize))
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                pending = deque()
+                for start, rows in iter_chunks(array, chunk_rows, first, last):
+                    measure_legacy(rows)
+                    pending.append((len(rows), pool.submit(encode_rows, start, rows, key, precision, as_int,
+                                                           normalize)))
+                    if len(pending) >= workers * 2:
+                        num_rows, fut = pending.popleft()
+                        write_chunk(num_rows, fut.result())
+                while pending:
+                    num_rows, fut = pending.popleft()
+                    write_chunk(num_rows, fut.result())
+
+    os.replace(tmp_path, output_path)
+    save_line_offsets(output_path, offsets_from_ends(line_ends, bytes_written))
+    elapsed = time.perf_counter() - start_time
+    report_throughput(total, bytes_written, elapsed)
+    if legacy_bytes:
+        report_savings(bytes_written, legacy_bytes)
+    return total, bytes_written, elapsed, legacy_bytes or bytes_written, digest.hexdigest()
 
-def write_neighbors(output_path, array):
+def write_shards(output_paths, array, workers=WORKERS, chunk_rows=CHUNK_ROWS,
+                 precision=None, detect_ints=True, normalize=False):
+    """
+    Split an HDF5 dataset into len(output_paths) contiguous JSONL shards.
+    idx values stay global, so the shards concatenate to the unsharded file.
+    Returns (rows, bytes_written, seconds, legacy_bytes) summed over shards,
+    plus the list of shard sha256 digests.
+    """
+    num_shards = len(output_paths)
+    total = array.shape[0]
+    as_int = not normalize and (np.issubdtype(array.dtype, np.integer)
+                                or (detect_ints and is_integer_valued(array, chunk_rows)))
+
+    totals = []
+    for shard, path in enumerate(output_paths):
+        first = total * shard // num_shards
+        last = total * (shard + 1) // num_shards
+        print(f"  Shard {shard + 1}/{num_shards}: rows [{first}, {last}) → {path}")
+        totals.append(write_jsonl(path, array, workers=workers, chunk_rows=chunk_rows, precision=precision,
+                                  row_range=(first, last), as_int=as_int, normalize=normalize))
+    return tuple(sum(t[i] for t in totals) for i in range(4)) + ([t[4] for t in totals],)
+
+def write_neighbors(output_path, array, workers=WORKERS, chunk_rows=CHUNK_ROWS):
     # neighbors is usually shape (queries, 1 or k)
-    with open(output_path, "w") as f:
-        for i in tqdm(range(array.shape[0])):
-            obj = {
-                "idx": int(i),
-                "neighbors": array[i].tolist()
-            }
-            f.write(json.dumps(obj) + "\n")
-
-def main():
-    if len(sys.argv) != 2:
-        print("Usage: python convert_hdf5_to_json.py <dataset_name>")
-        print("Example: python convert_hdf5_to_json.py glove-100-angular")
+    return write_jsonl(output_path, array, key="neighbors", workers=workers, chunk_rows=chunk_rows)
+
+def report_savings(num_bytes, legacy_bytes):
+    saved = legacy_bytes - num_bytes
+    mb = 1024 * 1024
+    print(f"  Full-precision size (est.): {legacy_bytes / mb:.1f} MB, "
+          f"written: {num_bytes / mb:.1f} MB, saved: {saved / mb:.1f} MB ({100.0 * saved / legacy_bytes:.1f}%)")
+
+def report_throughput(rows, num_bytes, seconds):
+    mb = num_bytes / (1024 * 1024)
+    seconds = max(seconds, 1e-9)
+    print(f"  {rows} rows, {mb:.1f} MB in {seconds:.2f}s "
+          f"({rows / seconds:,.0f} rows/s, {mb / seconds:.1f} MB/s)")
+
+def write_manifest(dataset_name, input_path, hdf5_file, metric, normalized, outputs, written):
+    """
+    Describe the converted dataset in datasets/<dataset>_manifest.json so
+    other scripts need not rescan the JSONL files or guess from the name.
+    Files skipped in this run are hashed from disk; groups not converted in
+    this run (see --groups) keep their previous entries.
+    """
+    vectors = hdf5_file["train"] if "train" in hdf5_file else hdf5_file["test"]
+    manifest = new_manifest(dataset_name, input_path, vectors.shape[1], metric, normalized, str(vectors.dtype))
+    for group, files in outputs.items():
+        manifest["counts"][group] = sum(rows for _, rows in files)
+        manifest["files"][group] = [file_entry(path, rows, written.get(path)) for path, rows in files]
+    if "neighbors" in hdf5_file:
+        manifest["neighbors_k"] = int(hdf5_file["neighbors"].shape[1])
+
+    with MANIFEST_LOCK:
+        previous = load_manifest(dataset_name)
+        if previous and previous.get("source") == manifest["source"]:
+            for group, files in previous.get("files", {}).items():
+                if group not in outputs:
+                    manifest["files"][group] = files
+                    manifest["counts"][group] = previous["counts"][group]
+
+        # Subdatasets stay valid while the train file(s) they were cut from are unchanged
+        if previous and previous.get("files", {}).get("train") == manifest["files"].get("train"):
+            manifest["subsets"] = previous.get("subsets", {})
+
+        save_manifest(manifest)
+    print(f"Manifest: {manifest_path(dataset_name)}")
+
+def main(argv=None):
+    args, options = parse_options(sys.argv[1:] if argv is None else argv)
+    if len(args) != 1:
+        print("Usage: python hdf5_to_jsonl.py <dataset_name> [--workers=N] [--chunk-rows=N] "
+              "[--precision=N|full] [--ints=auto|off] [--shards=N] [--normalize] [--groups=train,test,neighbors]")
+        print("Example: python hdf5_to_jsonl.py glove-100-angular")
+        print("Example: python hdf5_to_jsonl.py deep-image-96-angular --workers=16")
+        print("Example: python hdf5_to_jsonl.py glove-100-angular --precision=6")
+        print("Example: python hdf5_to_jsonl.py deep-image-96-angular --shards=8")
+        print("Example: python hdf5_to_jsonl.py glove-100-angular --normalize")
         sys.exit(1)
 
-    dataset_name = sys.argv[1]
+    dataset_name = args[0]
+    workers = int(options.get("workers", WORKERS))
+    chunk_rows = int(options.get("chunk-rows", CHUNK_ROWS))
+    precision = options.get("precision")
+    if precision is not None and precision != "full":
+        precision = int(precision)
+    detect_ints = options.get("ints", "auto") != "off"
+    num_shards = int(options.get("shards", 1))
+    groups = [g for g in options.get("groups", ",".join(GROUPS)).split(",") if g]
+    if any(g not in GROUPS for g in groups):
+        print(f"Error: --groups takes a comma-separated subset of {','.join(GROUPS)}")
+        sys.exit(1)
     input_path = os.path.join(RAW_DIR, dataset_name + ".hdf5")
 
     if not os.path.exists(input_path):
         print(f"Error: raw dataset not found: {input_path}")
         sys.exit(1)
 
+    try:
+        metric = metric_from_hdf5(input_path) or metric_from_name(dataset_name) or DEFAULT_METRIC
+    except ValueError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+    normalize = "normalize" in options
+    if normalize and metric != "angular":
+        print(f"Error: --normalize only preserves neighbors for angular datasets (metric: {metric})")
+        sys.exit(1)
+
     print(f"Loading HDF5 file: {input_path}")
+    print(f"Metric: {metric}{' (vectors normalized to unit length, served as euclidean)' if normalize else ''}")
+    print(f"Encoder: {'orjson' if orjson is not None else 'json'}, "
+          f"{workers} worker(s), {chunk_rows} rows per chunk, "
+          f"precision: {precision if precision is not None else 'float32 round-trip'}")
     f = h5py.File(input_path, "r")
 
     # Ensure target dirs exist
@@ -56,43 +292,78 @@ def main():
     ensure_dir(TESTS_DIR)
     ensure_dir(NEIGHBORS_DIR)
 
+    totals = []
+    written = {}  # output path -> sha256 of the files converted in this run
+    outputs = {}  # manifest file group -> [(path, rows)]
+
     # TRAIN vectors
-    if "train" in f:
+    if "train" in groups and "train" in f:
         train = f["train"]
-        train_output = os.path.join(DATASETS_DIR, f"{dataset_name}_train.jsonl")
-        if os.path.exists(train_output):
-            print(f"Train dataset already exists: {train_output} (skipping)")
+        if num_shards > 1:
+            shard_outputs = [os.path.join(DATASETS_DIR, shard_file_name(dataset_name, i, num_shards))
+                             for i in range(num_shards)]
+            if all(os.path.exists(p) for p in shard_outputs):
+                print(f"Train shards already exist: {shard_outputs[0]} ... (skipping)")
+            else:
+                print(f"Converting train dataset → {num_shards} shards...")
+                totals.append(write_shards(shard_outputs, train, workers=workers, chunk_rows=chunk_rows,
+                                           precision=precision, detect_ints=detect_ints, normalize=normalize))
+                written.update(zip(shard_outputs, totals[-1][4]))
+            total = train.shape[0]
+            outputs["train"] = [(p, total * (i + 1) // num_shards - total * i // num_shards)
+                                for i, p in enumerate(shard_outputs)]
         else:
-            print(f"Converting train dataset → {train_output}...")
-            write_jsonl(train_output, train)
-    else:
+            train_output = os.path.join(DATASETS_DIR, f"{dataset_name}_train.jsonl")
+            if os.path.exists(train_output):
+                print(f"Train dataset already exists: {train_output} (skipping)")
+            else:
+                print(f"Converting train dataset → {train_output}...")
+                totals.append(write_jsonl(train_output, train, workers=workers, chunk_rows=chunk_rows,
+                                          precision=precision, detect_ints=detect_ints, normalize=normalize))
+                written[train_output] = totals[-1][4]
+            outputs["train"] = [(train_output, train.shape[0])]
+    elif "train" in groups:
         print("No 'train' dataset found inside HDF5.")
 
     # TEST vectors
-    if "test" in f:
+    if "test" in groups and "test" in f:
         test = f["test"]
         test_output = os.path.join(TESTS_DIR, f"{dataset_name}_test.jsonl")
         if os.path.exists(test_output):
             print(f"Test vectors already exist: {test_output} (skipping)")
         else:
             print(f"Converting test vectors → {test_output}...")
-            write_jsonl(test_output, test)
-    else:
+            totals.append(write_jsonl(test_output, test, workers=workers, chunk_rows=chunk_rows,
+                                      precision=precision, detect_ints=detect_ints, normalize=normalize))
+            written[test_output] = totals[-1][4]
+        outputs["test"] = [(test_output, test.shape[0])]
+    elif "test" in groups:
         print("No 'test' dataset found inside HDF5.")
 
     # NEIGHBORS ground truth
-    if "neighbors" in f:
+    if "neighbors" in groups and "neighbors" in f:
         neighbors = f["neighbors"]
         neighbors_output = os.path.join(NEIGHBORS_DIR, f"{dataset_name}_neighbors.jsonl")
         if os.path.exists(neighbors_output):
             print(f"Neighbors already exist: {neighbors_output} (skipping)")
         else:
             print(f"Converting neighbors → {neighbors_output}...")
-            write_neighbors(neighbors_output, neighbors)
-    else:
+            totals.append(write_neighbors(neighbors_output, neighbors, workers=workers, chunk_rows=chunk_rows))
+            written[neighbors_output] = totals[-1][4]
+        outputs["neighbors"] = [(neighbors_output, neighbors.shape[0])]
+    elif "neighbors" in groups:
         print("No 'neighbors' ground-truth found inside HDF5.")
 
+    if written or load_manifest(dataset_name) is None:
+        write_manifest(dataset_name, input_path, f, metric, normalize, outputs, written)
+
     f.close()
+
+    if totals:
+        print("\nTotal conversion throughput:")
+        report_throughput(sum(t[0] for t in totals), sum(t[1] for t in totals), sum(t[2] for t in totals))
+        report_savings(sum(t[1] for t in totals), sum(t[3] for t in totals))
+
     print("\nAll done!")
 
 if __name__ == "__main__":
@@ -0,0 +1,109 @@
+import math
+from array import array
+
+import numpy as np
+
+PERCENTILES = (50, 90, 99, 99.9)
+HISTOGRAM_DIGITS = 1  # significant digits per histogram bucket (HDR-style relative precision)
+HISTOGRAM_WIDTH = 40  # characters for the largest bar
+
+
+class LatencySeries:
+    """Latencies (in seconds) of one kind, kept in a compact double array."""
+
+    def __init__(self, name):
+        self.name = name
+        self.values = array("d")
+
+    def add(self, seconds):
+        self.values.append(seconds)
+
+    def __len__(self):
+        return len(self.values)
+
+    def summary(self, percentiles=PERCENTILES):
+        """count/mean/min/max plus the requested percentiles (seconds)."""
+        if not self.values:
+            return None
+        values = np.frombuffer(self.values, dtype=np.float64)
+        result = {
+            "count": int(values.size),
+            "mean": float(values.mean()),
+            "min": float(values.min()),
+            "max": float(values.max()),
+        }
+        for p, v in zip(percentiles, np.percentile(values, percentiles)):
+            result[percentile_label(p)] = float(v)
+        return result
+
+
+def percentile_label(p):
+    """50 -> "p50", 99.9 -> "p999" """
+    return "p" + f"{p:g}".replace(".", "")
+
+
+def bucket_floor(seconds, digits=HISTOGRAM_DIGITS):
+    """
+    Lower bound of the log-linear bucket holding `seconds`: the value
+    truncated to `digits` significant digits (in microseconds), so every
+    bucket has the same relative width, as in an HDR histogram.
+    """
+    us = seconds * 1e6
+    if us < 1:
+        return 0.0
+    step = 10 ** (math.floor(math.log10(us)) - (digits - 1))
+    return math.floor(us / step) * step / 1e6
+
+
+def histogram(series, digits=HISTOGRAM_DIGITS):
+    """Non-empty buckets as [(lower_bound_seconds, count)], ascending."""
+    counts = {}
+    for v in series.values:
+        b = bucket_floor(v, digits)
+        counts[b] = counts.get(b, 0) + 1
+    return sorted(counts.items())
+
+
+def format_seconds(seconds):
+    if seconds >= 1:
+        return f"{seconds:.3f}s"
+    if seconds >= 1e-3:
+        return f"{seconds * 1e3:.3f}ms"
+    return f"{seconds * 1e6:.1f}us"
+
+
+def format_count(value):
+    return f"{value:,.1f}"
+
+
+def format_summary_table(series_list, percentiles=PERCENTILES, formatter=format_seconds):
+    """
+    Lines of a percentile table with one row per series. Series of counts
+    (e.g. processedObjects) are printed with formatter=format_count.
+    """
+    labels = [percentile_label(p) for p in percentiles]
+    lines = [f"{'':<24} {'count':>7} {'mean':>11} " + " ".join(f"{l:>11}" for l in labels) + f" {'max':>11}"]
+    for series in series_list:
+        s = series.summary(percentiles)
+        if s is None:
+            continue
+        lines.append(f"{series.name:<24} {s['count']:>7} {formatter(s['mean']):>11} "
+                     + " ".join(f"{formatter(s[l]):>11}" for l in labels)
+                     + f" {formatter(s['max']):>11}")
+    return lines
+
+
+def format_histogram(series, digits=HISTOGRAM_DIGITS, width=HISTOGRAM_WIDTH):
+    """Lines of a text histogram: bucket, count, cumulative percent, bar."""
+    buckets = histogram(series, digits)
+    if not buckets:
+        return []
+    total = len(series)
+    peak = max(count for _, count in buckets)
+    lines = [f"{series.name} ({total} samples)"]
+    cumulative = 0
+    for lower, count in buckets:
+        cumulative += count
+        bar = "#" * max(1, round(width * count / peak))
+        lines.append(f"  >= {format_seconds(lower):>10} {count:>7} {100.0 * cumulative / total:>7.2f}%  {bar}")
+    return lines
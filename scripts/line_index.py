@@ -0,0 +1,178 @@
+import json
+import os
+import sys
+
+import numpy as np
+
+try:
+    import orjson
+except ImportError:  # optional: faster decoder when installed
+    orjson = None
+
+SCAN_BLOCK_SIZE = 16 << 20  # bytes scanned for newlines at a time
+COPY_BUFFER_SIZE = 1 << 20  # bytes copied at a time
+
+
+def index_path(path):
+    """
+    Sidecar line-offset index of a JSONL file, e.g.
+        datasets/glove-100-angular_train.jsonl.offsets.npy
+    """
+    return path + ".offsets.npy"
+
+
+def newline_ends(data, base=0):
+    """Offsets just past every newline in a bytes block that starts at `base`."""
+    return np.flatnonzero(np.frombuffer(data, dtype=np.uint8) == 10).astype(np.uint64) + (base + 1)
+
+
+def build_line_offsets(path):
+    """
+    Byte offset of every line start plus the file size as a final entry
+    (uint64, num_lines + 1 entries): line i is bytes offsets[i]:offsets[i+1].
+    """
+    ends = []
+    pos = 0
+    with open(path, "rb") as f:
+        while True:
+            block = f.read(SCAN_BLOCK_SIZE)
+            if not block:
+                break
+            ends.append(newline_ends(block, pos))
+            pos += len(block)
+    return offsets_from_ends(ends, pos)
+
+
+def offsets_from_ends(ends, size):
+    """Assemble the offset index from newline_ends() blocks and the file size."""
+    offsets = np.concatenate([np.zeros(1, dtype=np.uint64)] + ends)
+    if offsets[-1] != size:  # last line without a trailing newline
+        offsets = np.append(offsets, np.uint64(size))
+    return offsets
+
+
+def save_line_offsets(path, offsets):
+    """Write the sidecar index of path atomically (temp file + rename)."""
+    idx = index_path(path)
+    try:
+        with open(idx + ".tmp", "wb") as f:
+            np.save(f, offsets)
+        os.replace(idx + ".tmp", idx)
+    except OSError as e:  # read-only directory: use the index for this run only
+        print(f"[lineindex] Could not save {idx}: {e}")
+
+
+def index_is_fresh(path, offsets):
+    """The index matches the file: same size, and not older than it."""
+    idx = index_path(path)
+    return (int(offsets[-1]) == os.path.getsize(path)
+            and os.path.getmtime(idx) >= os.path.getmtime(path))
+
+
+def line_offsets(path, save=True):
+    """
+    Offsets of the lines of a JSONL file (see build_line_offsets). Loads the
+    sidecar index when it is fresh, otherwise builds it and (with save)
+    writes it next to the file for later runs.
+    """
+    idx = index_path(path)
+    if os.path.exists(idx):
+        offsets = np.load(idx)
+        if index_is_fresh(path, offsets):
+            return offsets
+
+    offsets = build_line_offsets(path)
+    if save:
+        save_line_offsets(path, offsets)
+    return offsets
+
+
+def line_count(path):
+    """Number of lines, from the index."""
+    return len(line_offsets(path)) - 1
+
+
+def line_runs(positions):
+    """Sorted line positions -> [(first, last + 1)] runs of consecutive lines."""
+    positions = np.asarray(positions, dtype=np.int64)
+    if positions.size == 0:
+        return []
+    breaks = np.flatnonzero(np.diff(positions) != 1) + 1
+    starts = positions[np.concatenate([[0], breaks])]
+    ends = positions[np.concatenate([breaks - 1, [positions.size - 1]])] + 1
+    return list(zip(starts.tolist(), ends.tolist()))
+
+
+def copy_lines(path, positions, outfile, digest=None, offsets=None):
+    """
+    Copy the given (sorted) lines of path to an open binary file as byte
+    ranges, one seek per run of consecutive lines. Returns bytes copied.
+    """
+    offsets = line_offsets(path) if offsets is None else offsets
+    copied = 0
+    with open(path, "rb") as f:
+        for first, last in line_runs(positions):
+            start, end = int(offsets[first]), int(offsets[last])
+            f.seek(start)
+            while start < end:
+                data = f.read(min(COPY_BUFFER_SIZE, end - start))
+                if not data:
+                    break
+                outfile.write(data)
+                if digest is not None:
+                    digest.update(data)
+                start += len(data)
+                copied += len(data)
+    return copied
+
+
+def read_lines(path, positions, offsets=None):
+    """Raw lines (bytes, newline included) at the given sorted positions."""
+    offsets = line_offsets(path) if offsets is None else offsets
+    lines = []
+    with open(path, "rb") as f:
+        for first, last in line_runs(positions):
+            f.seek(int(offsets[first]))
+            data = f.read(int(offsets[last]) - int(offsets[first]))
+            base = int(offsets[first])
+            lines.extend(data[int(offsets[i]) - base:int(offsets[i + 1]) - base] for i in range(first, last))
+    return lines
+
+
+def parse_lines(data):
+    """Parse a block of JSONL bytes with one decoder call instead of one per line."""
+    body = b"[" + data.rstrip(b"\n").replace(b"\n", b",") + b"]"
+    return orjson.loads(body) if orjson is not None else json.loads(body)
+
+
+def read_records(path, start=0, stop=None, offsets=None):
+    """
+    Records (parsed JSON objects) of lines start..stop-1, read as one byte
+    range. stop defaults to the end of the file and is clamped to it.
+    """
+    offsets = line_offsets(path) if offsets is None else offsets
+    num_lines = len(offsets) - 1
+    stop = num_lines if stop is None else min(stop, num_lines)
+    if start >= stop:
+        return []
+    with open(path, "rb") as f:
+        f.seek(int(offsets[start]))
+        return parse_lines(f.read(int(offsets[stop]) - int(offsets[start])))
+
+
+def main():
+    if len(sys.argv) < 2:
+        print("Usage: python line_index.py <file.jsonl> [<file.jsonl> ...]")
+        print("Example: python line_index.py datasets/glove-100-angular_train.jsonl")
+        sys.exit(1)
+
+    for path in sys.argv[1:]:
+        if not os.path.exists(path):
+            print(f"Error: file not found: {path}")
+            sys.exit(1)
+        offsets = line_offsets(path)
+        print(f"[lineindex] {index_path(path)}: {len(offsets) - 1} lines")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,48 +1,77 @@
-import os
 import sys
 import requests
+from itertools import cycle
 
-ASTERIX_URL = "http://localhost:19002/query/service"
-HEADERS = {"Content-Type": "application/x-www-form-urlencoded"}
+from asterix_client import get_client
+from cli_options import parse_options
+from dataset_files import train_jsonl_paths
+from dataset_manifest import subset_entry, train_count
+from line_index import line_count
 
+APPEND_BATCH_SIZE = 1000  # records per UPSERT statement in append mode
 
-def main():
-    if len(sys.argv) < 2 or len(sys.argv) > 3:
-        print("Usage: python load_dataset.py <dataset_name> [num_records]")
-        print("Example: python load_dataset.py fashion-mnist-784-euclidean")
-        print("Example: python load_dataset.py fashion-mnist-784-euclidean 20000")
-        sys.exit(1)
 
-    dataset_name = sys.argv[1]                    # original name (with hyphens)
-    num_records = sys.argv[2] if len(sys.argv) == 3 else None
-    
-    # Adjust dataset name for subdataset
-    if num_records:
-        dataset_file_name = f"{dataset_name}_train_{num_records}.jsonl"
-        ds_name_astx = f"{dataset_name}_{num_records}".replace("-", "_")
-    else:
-        dataset_file_name = f"{dataset_name}_train.jsonl"
-        ds_name_astx = dataset_name.replace("-", "_") # Asterix-friendly dataset name
+def localfs_path(json_paths, hosts):
+    """
+    Build the localfs "path" value for one or more JSONL files.
+    localfs expects: Host://AbsolutePath, comma-separated for several files
+    (e.g. "127.0.0.1:///Users/hongyu/Projects/..."). Files are assigned to
+    hosts round-robin so each node controller reads its own shards.
+    """
+    entries = []
+    for json_path, host in zip(json_paths, cycle(hosts)):
+        # Normalize to forward slashes
+        json_path_fs = json_path.replace("\\", "/")
+        entries.append(f"{host}://{json_path_fs}")
+    return ",".join(entries)
 
-    # Project paths
-    base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-    datasets_dir = os.path.join(base_dir, "datasets")
 
-    # JSONL file on disk
-    json_path = os.path.join(datasets_dir, dataset_file_name)
-    if not os.path.exists(json_path):
-        print(f"Error: dataset file not found: {json_path}")
+def post_statement(statement, client_context_id, pretty="true", idempotent=False):
+    """
+    Send a statement to AsterixDB and return (response json, response text,
+    client wall time). Exits on HTTP errors after printing the response.
+    """
+    try:
+        response = get_client().execute(statement, client_context_id, pretty=(pretty == "true"),
+                                        idempotent=idempotent)
+    except requests.HTTPError as e:
+        print("HTTP error from AsterixDB:", e)
+        print("Response text:")
+        print(e.response.text)
         sys.exit(1)
 
-    # Normalize to forward slashes
-    json_path_fs = json_path.replace("\\", "/")
+    return response.json, response.text, response.client_time
 
-    # localfs expects: Host://AbsolutePath
-    # e.g. "127.0.0.1:///Users/hongyu/Projects/..."
-    host = "localhost"
-    json_path_for_asterix = f"{host}://{json_path_fs}"
 
-    statement = f"""
+def create_if_missing_statement(ds_name_astx):
+    """DDL that creates the dataverse, type and dataset only if they are missing."""
+    return f"""
+    CREATE DATAVERSE VectorTest IF NOT EXISTS;
+    USE VectorTest;
+
+    CREATE TYPE OpenType IF NOT EXISTS AS {{
+      idx: int
+    }};
+
+    CREATE DATASET {ds_name_astx} (OpenType) IF NOT EXISTS
+    PRIMARY KEY idx WITH {{
+      "storage-format": {{"format":"column"}}
+    }};
+    """
+
+
+def dataset_count(ds_name_astx, dataset_name):
+    """Number of records currently stored in VectorTest.<ds_name_astx>."""
+    js, _, _ = post_statement(f"USE VectorTest; SELECT VALUE COUNT(*) FROM {ds_name_astx};",
+                              f"count_{dataset_name}", pretty="false", idempotent=True)
+    results = js.get("results", [0])
+    return int(results[0]) if results else 0
+
+
+def load_statement(ds_name_astx, json_path_for_asterix, replace):
+    """LOAD DATASET statement; with replace, the VectorTest dataverse is recreated first."""
+    if replace:
+        ddl = f"""
     DROP DATAVERSE VectorTest IF EXISTS;
     CREATE DATAVERSE VectorTest;
     USE VectorTest;
@@ -55,7 +84,11 @@ def main():
     PRIMARY KEY idx WITH {{
       "storage-format": {{"format":"column"}}
     }};
+    """
+    else:
+        ddl = ""
 
+    return f"""{ddl}
     USE VectorTest;
 
     LOAD DATASET {ds_name_astx} USING localfs (
@@ -64,30 +97,156 @@ def main():
     );
     """
 
-    data = {
-        "statement": statement,
-        "pretty": "true",
-        "client_context_id": f"load_{dataset_name}"
-    }
 
-    print(f"Loading dataset '{dataset_name}' as Asterix dataset '{ds_name_astx}'")
-    print(f"Path for localfs: {json_path_for_asterix}\n")
+def append_records(ds_name_astx, dataset_name, source_paths, skip, limit, batch_size):
+    """
+    UPSERT records [skip, limit) of the source JSONL file(s) into the dataset
+    in batches of batch_size, so index maintenance cost can be measured.
+    Returns (records_appended, total_client_time, per-batch client times).
+    """
+    batch = []
+    batch_times = []
+    appended = 0
+    line_no = 0
+
+    def flush():
+        nonlocal appended
+        statement = f"USE VectorTest; UPSERT INTO {ds_name_astx} ([{','.join(batch)}]);"
+        _, _, wall_time = post_statement(statement, f"append_{dataset_name}_{line_no}", pretty="false")
+        batch_times.append(wall_time)
+        appended += len(batch)
+        print(f"[append] {appended} records upserted "
+              f"(batch {len(batch_times)}: {len(batch)} records in {wall_time:.3f}s)")
+        batch.clear()
+
+    for path in source_paths:
+        with open(path, "r") as f:
+            for line in f:
+                if limit is not None and line_no >= limit:
+                    break
+                if line_no >= skip:
+                    batch.append(line.strip())
+                    if len(batch) >= batch_size:
+                        flush()
+                line_no += 1
+    if batch:
+        flush()
+
+    return appended, sum(batch_times), batch_times
+
+
+def main(argv=None):
+    args, options = parse_options(sys.argv[1:] if argv is None else argv)
+    if len(args) < 1 or len(args) > 2:
+        print("Usage: python load_dataset.py <dataset_name> [num_records] [--hosts=host1,host2,...]")
+        print("         [--mode=replace|incremental|append] [--grow-to=N] [--batch-size=N]")
+        print("Example: python load_dataset.py fashion-mnist-784-euclidean")
+        print("Example: python load_dataset.py fashion-mnist-784-euclidean 20000")
+        print("Example: python load_dataset.py deep-image-96-angular --hosts=10.0.0.1,10.0.0.2")
+        print("Example: python load_dataset.py fashion-mnist-784-euclidean 20000 --mode=incremental")
+        print("Example: python load_dataset.py fashion-mnist-784-euclidean 20000 --mode=append --grow-to=40000")
+        sys.exit(1)
 
-    resp = requests.post(ASTERIX_URL, headers=HEADERS, data=data)
+    dataset_name = args[0]                        # original name (with hyphens)
+    num_records = args[1] if len(args) == 2 else None
+    hosts = [h for h in options.get("hosts", "localhost").split(",") if h]
+    mode = options.get("mode", "replace")
+    if mode not in ("replace", "incremental", "append"):
+        print(f"Error: --mode must be replace, incremental or append, got '{mode}'")
+        sys.exit(1)
+    
+    # Adjust dataset name for subdataset
+    if num_records:
+        ds_name_astx = f"{dataset_name}_{num_records}".replace("-", "_")
+    else:
+        ds_name_astx = dataset_name.replace("-", "_") # Asterix-friendly dataset name
 
-    try:
-        resp.raise_for_status()
-    except requests.HTTPError as e:
-        print("HTTP error from AsterixDB:", e)
-        print("Response text:")
-        print(resp.text)
+    if mode == "append":
+        run_append(dataset_name, ds_name_astx, num_records, options)
+        return
+
+    # JSONL file(s) on disk: one file, or the shards written by hdf5_to_jsonl.py --shards=N
+    json_paths = train_jsonl_paths(dataset_name, num_records)
+    if not json_paths:
+        suffix = f"_{num_records}" if num_records else ""
+        print(f"Error: dataset file not found: {dataset_name}_train{suffix}.jsonl (or train shards)")
         sys.exit(1)
 
+    json_path_for_asterix = localfs_path(json_paths, hosts)
+
+    if mode == "incremental":
+        # Keep the dataverse and any other datasets/indexes; only create what is missing
+        post_statement(create_if_missing_statement(ds_name_astx), f"create_{dataset_name}")
+        expected = train_count(dataset_name, num_records)
+        if expected is None:
+            expected = sum(line_count(path) for path in json_paths)
+        existing = dataset_count(ds_name_astx, dataset_name)
+        if existing == expected:
+            print(f"Dataset '{ds_name_astx}' already holds {existing} records (skipping load)")
+            return
+        if existing != 0:
+            print(f"Error: dataset '{ds_name_astx}' holds {existing} records, expected {expected}.")
+            print("Use --mode=replace to reload it or --mode=append to add records.")
+            sys.exit(1)
+
+    statement = load_statement(ds_name_astx, json_path_for_asterix, replace=(mode == "replace"))
+
+    print(f"Loading dataset '{dataset_name}' as Asterix dataset '{ds_name_astx}' ({mode})")
+    print(f"Files: {len(json_paths)} across {min(len(hosts), len(json_paths))} host(s)")
+    print(f"Path for localfs: {json_path_for_asterix}\n")
+
+    js, text, wall_time = post_statement(statement, f"load_{dataset_name}")
+
     print("AsterixDB response:")
-    print(resp.text)
+    print(text)
 
+    metrics = js.get("metrics", {})
+    print(f"Ingestion time (client wall): {wall_time:.3f}s")
+    print(f"Ingestion time (server elapsedTime): {metrics.get('elapsedTime', 'n/a')}")
 
-if __name__ == "__main__":
-    main()
 
+def run_append(dataset_name, ds_name_astx, num_records, options):
+    """
+    Grow an existing dataset (e.g. a 1M subset to 2M) by upserting the next
+    records of the full train file, keeping its vector indexes in place.
+    """
+    if "grow-to" not in options:
+        print("Error: --mode=append requires --grow-to=<total_records>")
+        sys.exit(1)
+
+    # Only a head subset is a prefix of the train file; a sampled one may
+    # already hold some of the next records, and would mix two selections
+    sample = (subset_entry(dataset_name, num_records) or {}).get("sample", {}) if num_records else {}
+    if sample.get("mode", "head") != "head":
+        print(f"Error: subset {num_records} was drawn with --sample={sample['mode']}; "
+              f"--mode=append only grows head subsets")
+        print("Create the larger subset with create_subdataset.py (same --sample and --seed) and load that instead.")
+        sys.exit(1)
+    grow_to = int(options["grow-to"])
+    batch_size = int(options.get("batch-size", APPEND_BATCH_SIZE))
 
+    source_paths = train_jsonl_paths(dataset_name)
+    if not source_paths:
+        print(f"Error: dataset file not found: {dataset_name}_train.jsonl (or train shards)")
+        sys.exit(1)
+
+    existing = dataset_count(ds_name_astx, dataset_name)
+    if existing >= grow_to:
+        print(f"Dataset '{ds_name_astx}' already holds {existing} records (>= {grow_to}), nothing to append")
+        return
+
+    # Head subsets are prefixes of the train file, so the next records start at `existing`
+    print(f"Appending records [{existing}, {grow_to}) to '{ds_name_astx}' "
+          f"in batches of {batch_size}")
+    appended, total_time, batch_times = append_records(ds_name_astx, dataset_name, source_paths,
+                                                       existing, grow_to, batch_size)
+
+    if appended:
+        print(f"\nAppended {appended} records in {total_time:.3f}s "
+              f"({appended / max(total_time, 1e-9):,.0f} records/s, "
+              f"avg {total_time / len(batch_times):.3f}s per batch)")
+    print(f"Dataset '{ds_name_astx}' now holds {dataset_count(ds_name_astx, dataset_name)} records")
+
+
+if __name__ == "__main__":
+    main()
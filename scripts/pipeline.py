@@ -1,50 +1,252 @@
+import hashlib
+import json
 import os
 import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
 import requests
-import subprocess
 
+import create_index
+import create_subdataset
+import hdf5_to_jsonl
+import load_dataset
+import run_query_compare
+from asterix_client import ASTERIX_HOST, ASTERIX_PORT, get_client
+from cli_options import parse_force, parse_options
+from dataset_files import BASE_DIR, DATASETS_DIR, train_jsonl_paths
+from dataset_manifest import load_manifest, train_count
+from downloader import BASE_URL, WORKERS as DOWNLOAD_WORKERS, DownloadError, download_hdf5
 
-BASE_URL = "https://ann-benchmarks.com"
+# Options passed through to create_subdataset.py
+SUBDATASET_OPTIONS = ("sample", "seed", "clusters")
 
+# Steps whose fingerprints are tracked (see --force)
+STEPS = ("convert-train", "convert-test", "subdataset", "load", "index")
 
-def run_subprocess(cmd, cwd=None):
-    """Run a shell command and stream its output live."""
-    print(f"[run] {' '.join(cmd)}")
-    result = subprocess.run(cmd, cwd=cwd)
-    if result.returncode != 0:
-        print(f"[run] FAILED (exit code {result.returncode})")
-        sys.exit(result.returncode)
+INDEX_NAME = "ix1"  # index built by create_index.py
 
 
-def download_hdf5(dataset_name, raw_dir):
-    """Download HDF5 file if it does not exist."""
-    os.makedirs(raw_dir, exist_ok=True)
-    hdf5_path = os.path.join(raw_dir, f"{dataset_name}.hdf5")
+class StageFailed(Exception):
+    """A pipeline stage exited with a non-zero status."""
 
-    if os.path.exists(hdf5_path):
-        print(f"[download] Already exists: {hdf5_path}")
-        return hdf5_path
 
-    url = f"{BASE_URL}/{dataset_name}.hdf5"
-    print(f"[download] Downloading: {url}")
-    print(f"[download] -> {hdf5_path}")
+def run_stage(title, stage_main, argv):
+    """
+    Run a stage script's main() in this process (modules are imported once
+    instead of once per subprocess). sys.exit() calls inside the stage
+    become StageFailed when the status is non-zero. Returns what main() returns.
+    """
+    print("\n==============================================")
+    print(f"[step] {title}")
+    print("==============================================")
+    print(f"[run] {stage_main.__module__}.py {' '.join(argv)}")
+    try:
+        return stage_main(argv)
+    except SystemExit as e:
+        if e.code not in (None, 0):
+            raise StageFailed(f"{stage_main.__module__}.py {' '.join(argv)} exited with status {e.code}")
+        return None
+
+
+def fingerprint(params, input_paths=()):
+    """sha256 over a step's parameters and the path, size and mtime of its input files."""
+    inputs = []
+    for path in input_paths:
+        st = os.stat(path)
+        inputs.append([os.path.relpath(path, BASE_DIR), st.st_size, st.st_mtime_ns])
+    blob = json.dumps({"params": params, "inputs": inputs}, sort_keys=True)
+    return hashlib.sha256(blob.encode()).hexdigest()
+
+
+class StepState:
+    """
+    Fingerprints of completed steps, kept in datasets/<dataset>_pipeline.json.
+    A step is skipped when its fingerprint (inputs + parameters) matches the
+    recorded one and its outputs are still in place.
+    """
+
+    def __init__(self, dataset_name, force=()):
+        self.path = os.path.join(DATASETS_DIR, f"{dataset_name}_pipeline.json")
+        self.force = set(force)
+        self.lock = threading.Lock()
+        self.ran = set()  # keys of the steps run by this process
+        self.steps = {}
+        if os.path.exists(self.path):
+            with open(self.path, "r") as f:
+                self.steps = json.load(f).get("steps", {})
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path + ".tmp", "w") as f:
+            json.dump({"steps": self.steps}, f, indent=2)
+        os.replace(self.path + ".tmp", self.path)
+
+    def run(self, step, key, step_fingerprint, func, is_current=None):
+        """
+        Run func() unless step `key` is recorded with the same fingerprint and
+        is_current() (a check that its outputs still exist) agrees. A dict
+        returned by func() is kept with the step as its "details".
+        Returns True if the step ran.
+        """
+        with self.lock:
+            entry = self.steps.get(key)
+        forced = step in self.force or "all" in self.force
+        if not forced and entry and entry.get("fingerprint") == step_fingerprint and \
+                (is_current is None or is_current()):
+            print(f"[step] {key}: up to date since {entry.get('finished')} (skipping)")
+            return False
+
+        start = time.perf_counter()
+        details = func()
+        with self.lock:
+            self.steps[key] = {
+                "fingerprint": step_fingerprint,
+                "finished": datetime.now().isoformat(timespec="seconds"),
+                "seconds": round(time.perf_counter() - start, 3),
+            }
+            if isinstance(details, dict):
+                self.steps[key]["details"] = details
+            self.ran.add(key)
+            self.save()
+        return True
+
+
+def manifest_has_files(dataset_name, groups):
+    """The manifest lists files for every group and they are on disk with the recorded size."""
+    manifest = load_manifest(dataset_name)
+    if manifest is None:
+        return False
+    for group in groups:
+        entries = manifest.get("files", {}).get(group)
+        if not entries:
+            return False
+        for entry in entries:
+            path = os.path.join(BASE_DIR, entry["path"])
+            if not os.path.exists(path) or os.path.getsize(path) != entry["bytes"]:
+                return False
+    return True
+
+
+def server_value(statement, client_context_id):
+    """First result of a small query, or None if it fails (e.g. the dataset does not exist)."""
+    try:
+        results = get_client().execute(statement, client_context_id, idempotent=True).results
+    except requests.RequestException:
+        return None
+    return results[0] if results else None
+
+
+def server_count(ds_name_astx):
+    """Records in VectorTest.<ds_name_astx>, or None."""
+    return server_value(f"USE VectorTest; SELECT VALUE COUNT(*) FROM {ds_name_astx};",
+                        f"pipeline_count_{ds_name_astx}")
+
+
+def server_loaded(ds_name_astx, expected):
+    """The dataset holds `expected` records (any number > 0 when the manifest does not say)."""
+    count = server_count(ds_name_astx)
+    if count is None:
+        return False
+    return count == expected if expected is not None else count > 0
+
+
+def drop_server_dataset(ds_name_astx):
+    """Drop VectorTest.<ds_name_astx> and its indexes, leaving every other loaded dataset in place."""
+    get_client().execute(f"""
+    CREATE DATAVERSE VectorTest IF NOT EXISTS;
+    DROP DATASET VectorTest.{ds_name_astx} IF EXISTS;
+    """, f"pipeline_drop_{ds_name_astx}")
+
+
+def server_has_index(ds_name_astx, index_name=INDEX_NAME):
+    count = server_value(f"""
+    SELECT VALUE COUNT(*) FROM Metadata.`Index` i
+    WHERE i.DataverseName = "VectorTest" AND i.DatasetName = "{ds_name_astx}" AND i.IndexName = "{index_name}";
+    """, f"pipeline_index_{ds_name_astx}")
+    return bool(count)
+
+
+def prepare_train(dataset_name, state, options):
+    """Download the HDF5 file and convert its train vectors. Returns the HDF5 path."""
+    # Step 1: Download HDF5 (skipped by the downloader when the file exists)
+    hdf5_path = download_hdf5(dataset_name, os.path.join(BASE_DIR, "raw"),
+                              base_url=options.get("base-url", BASE_URL),
+                              workers=int(options.get("download-workers", DOWNLOAD_WORKERS)))
+
+    # Step 2: Convert the train vectors (everything after depends on them)
+    state.run("convert-train", "convert-train", fingerprint({"groups": "train"}, [hdf5_path]),
+              lambda: run_stage("Converting HDF5 train vectors to JSONL", hdf5_to_jsonl.main,
+                                [dataset_name, "--groups=train"]),
+              is_current=lambda: manifest_has_files(dataset_name, ["train"]))
+    return hdf5_path
 
-    with requests.get(url, stream=True) as r:
-        r.raise_for_status()
-        with open(hdf5_path, "wb") as f:
-            for chunk in r.iter_content(chunk_size=8192):
-                if chunk:
-                    f.write(chunk)
 
-    print("[download] Done.")
-    return hdf5_path
+def convert_test(dataset_name, hdf5_path, state):
+    """Convert the test vectors and neighbors of a downloaded dataset."""
+    # One encoder process: the test and neighbors tables are small, and
+    # forking worker processes next to the loader thread is avoided
+    state.run("convert-test", "convert-test", fingerprint({"groups": "test,neighbors"}, [hdf5_path]),
+              lambda: run_stage("Converting HDF5 test vectors and neighbors to JSONL", hdf5_to_jsonl.main,
+                                [dataset_name, "--groups=test,neighbors", "--workers=1"]),
+              is_current=lambda: manifest_has_files(dataset_name, ["test"]))
+
+
+def prepare_server(dataset_name, num_k, num_records, state, options):
+    """
+    Create the subdataset (if num_records), load it into AsterixDB and build
+    the vector index with num_k clusters, skipping whatever is up to date.
+    Returns the Asterix dataset name.
+    """
+    suffix = f"_{num_records}" if num_records else ""
+    ds_name_astx = f"{dataset_name}{suffix}".replace("-", "_")
+    sub_args = [str(num_records)] if num_records else []
+
+    # Step 2.5: Create subdataset if num_records is specified
+    if num_records:
+        sample_args = [f"--{key}={options[key]}" for key in SUBDATASET_OPTIONS if key in options]
+        state.run("subdataset", f"subdataset{suffix}",
+                  fingerprint({"sample": sample_args}, train_jsonl_paths(dataset_name)),
+                  lambda: run_stage("Creating subdataset", create_subdataset.main,
+                                    [dataset_name] + sub_args + sample_args),
+                  is_current=lambda: bool(train_jsonl_paths(dataset_name, num_records)))
+
+    # Step 3: Load dataset. When the step runs, this dataset is stale or missing
+    # on the server: it alone is dropped and loaded again, in incremental mode
+    # so other datasets and sizes stay loaded (replace mode drops the dataverse)
+    def load():
+        drop_server_dataset(ds_name_astx)
+        run_stage("Loading dataset to AsterixDB", load_dataset.main,
+                  [dataset_name] + sub_args + ["--mode=incremental"])
+
+    load_paths = train_jsonl_paths(dataset_name, num_records)
+    load_fingerprint = fingerprint({"server": f"{ASTERIX_HOST}:{ASTERIX_PORT}"}, load_paths)
+    state.run("load", f"load{suffix}", load_fingerprint, load,
+              is_current=lambda: server_loaded(ds_name_astx, train_count(dataset_name, num_records)))
+
+    # Step 4: Create index, keeping its num_clusters and server build times
+    def build_index():
+        row = run_stage("Creating vector index", create_index.main, [dataset_name, str(num_k)] + sub_args)
+        if row:
+            return {field: row[field] for field in ("num_clusters", "server_elapsed_s", "server_execution_s")}
+        return None
+
+    state.run("index", f"index{suffix}", fingerprint({"num_k": str(num_k), "load": load_fingerprint}), build_index,
+              is_current=lambda: server_has_index(ds_name_astx))
+    return ds_name_astx
 
 
 def clean_dataset(dataset_name, base_dir):
     """Remove all generated files for a dataset, including subdatasets."""
     files = [
         os.path.join(base_dir, "raw", f"{dataset_name}.hdf5"),
+        os.path.join(base_dir, "raw", f"{dataset_name}.hdf5.part"),
+        os.path.join(base_dir, "raw", f"{dataset_name}.hdf5.part.json"),
         os.path.join(base_dir, "datasets", f"{dataset_name}_train.jsonl"),
+        os.path.join(base_dir, "datasets", f"{dataset_name}_manifest.json"),
+        os.path.join(base_dir, "datasets", f"{dataset_name}_pipeline.json"),
         os.path.join(base_dir, "tests", f"{dataset_name}_test.jsonl"),
         os.path.join(base_dir, "neighbors", f"{dataset_name}_neighbors.jsonl"),
     ]
@@ -70,6 +272,28 @@ def clean_dataset(dataset_name, base_dir):
                 os.remove(filepath)
                 removed = True
 
+    # Line offset indexes (pattern: <file>.jsonl.offsets.npy, see line_index.py)
+    for dirname in ("datasets", "tests"):
+        dirpath = os.path.join(base_dir, dirname)
+        if os.path.exists(dirpath):
+            for filename in os.listdir(dirpath):
+                if filename.startswith(f"{dataset_name}_") and filename.endswith(".offsets.npy"):
+                    filepath = os.path.join(dirpath, filename)
+                    print(f"[CLEAN] Removing line index: {filepath}")
+                    os.remove(filepath)
+                    removed = True
+
+    # Cached ground truth and neighbors line index
+    # (pattern: <dataset>_<size>_<metric>_k<K>.npy + .meta.json, <dataset>_neighbors.jsonl.offsets.npy)
+    neighbors_dir = os.path.join(base_dir, "neighbors")
+    if os.path.exists(neighbors_dir):
+        for filename in os.listdir(neighbors_dir):
+            if filename.startswith(f"{dataset_name}_") and filename.endswith((".npy", ".meta.json")):
+                filepath = os.path.join(neighbors_dir, filename)
+                print(f"[CLEAN] Removing ground-truth cache: {filepath}")
+                os.remove(filepath)
+                removed = True
+
     if not removed:
         print("[CLEAN] No files found for this dataset.")
 
@@ -80,36 +304,45 @@ def main():
     # ------------------------------------------------------
     # Arguments
     # ------------------------------------------------------
-    if len(sys.argv) < 3:
+    args, options = parse_options(sys.argv[1:])
+    if len(args) < 2:
         print("Usage:")
-        print("  python pipeline.py <dataset_name> <num_k> <num_queries> [num_records]")
+        print("  python pipeline.py <dataset_name> <num_k> <num_queries> [num_records] "
+              "[--sample=head|uniform|reservoir|kmeans] [--seed=N] [--clusters=N] "
+              "[--base-url=URL] [--download-workers=N] [--force[=step,...]]")
         print("  python pipeline.py <dataset_name> clean")
         print("")
         print("Examples:")
         print("  python pipeline.py fashion-mnist-784-euclidean 256 1000")
         print("  python pipeline.py fashion-mnist-784-euclidean 256 1000 20000")
+        print("  python pipeline.py fashion-mnist-784-euclidean 256 1000 20000 --sample=uniform --seed=7")
+        print("  python pipeline.py fashion-mnist-784-euclidean 256 1000 --force=load,index")
         sys.exit(1)
 
-    dataset_name = sys.argv[1]
+    dataset_name = args[0]
 
     # Determine paths
     scripts_dir = os.path.dirname(os.path.abspath(__file__))
     base_dir = os.path.dirname(scripts_dir)
-    raw_dir = os.path.join(base_dir, "raw")
 
     # ------------------------------------------------------
     # CLEAN MODE
     # ------------------------------------------------------
-    if sys.argv[2] == "clean":
+    if args[1] == "clean":
         clean_dataset(dataset_name, base_dir)
         sys.exit(0)
 
     # ------------------------------------------------------
     # PIPELINE MODE
     # ------------------------------------------------------
-    num_k = sys.argv[2]
-    num_queries = sys.argv[3]
-    num_records = sys.argv[4] if len(sys.argv) > 4 else None
+    num_k = args[1]
+    num_queries = args[2]
+    num_records = args[3] if len(args) > 3 else None
+    try:
+        force = parse_force(options, STEPS)
+    except ValueError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
 
     print("==============================================")
     print("ANN PIPELINE START")
@@ -117,74 +350,30 @@ def main():
     print(f"num_k:        {num_k}")
     print(f"num_queries:  {num_queries}")
     if num_records:
-        print(f"num_records:  {num_records} (subdataset)")
+        print(f"num_records:  {num_records} (subdataset, {options.get('sample', 'head')} sampling)")
     print("==============================================\n")
 
-    # Step 1: Download HDF5
-    download_hdf5(dataset_name, raw_dir)
-
-    # Step 2: Convert HDF5 → JSON
-    print("\n==============================================")
-    print("[step] Converting HDF5 to JSON")
-    print("==============================================")
-    run_subprocess([
-        sys.executable,
-        os.path.join(scripts_dir, "hdf5_to_jsonl.py"),
-        dataset_name
-    ], cwd=base_dir)
-
-    # Step 2.5: Create subdataset if num_records is specified
-    if num_records:
-        print("\n==============================================")
-        print("[step] Creating subdataset")
-        print("==============================================")
-        run_subprocess([
-            sys.executable,
-            os.path.join(scripts_dir, "create_subdataset.py"),
-            dataset_name,
-            num_records
-        ], cwd=base_dir)
-
-    # Step 3: Load dataset
-    print("\n==============================================")
-    print("[step] Loading dataset to AsterixDB")
-    print("==============================================")
-    load_cmd = [
-        sys.executable,
-        os.path.join(scripts_dir, "load_dataset.py"),
-        dataset_name
-    ]
-    if num_records:
-        load_cmd.append(num_records)
-    run_subprocess(load_cmd, cwd=base_dir)
-
-    # Step 4: Create index
-    print("\n==============================================")
-    print("[step] Creating vector index")
-    print("==============================================")
-    index_cmd = [
-        sys.executable,
-        os.path.join(scripts_dir, "create_index.py"),
-        dataset_name,
-        num_k
-    ]
-    if num_records:
-        index_cmd.append(num_records)
-    run_subprocess(index_cmd, cwd=base_dir)
-
-    # Step 5: Run recall evaluation (comparing ANN vs exact)
-    print("\n==============================================")
-    print("[step] Running recall evaluation (ANN vs Exact)")
-    print("==============================================")
-    query_cmd = [
-        sys.executable,
-        os.path.join(scripts_dir, "run_query_compare.py"),
-        dataset_name,
-        num_queries
-    ]
-    if num_records:
-        query_cmd.append(num_records)
-    run_subprocess(query_cmd, cwd=base_dir)
+    state = StepState(dataset_name, force)
+    sub_args = [num_records] if num_records else []
+
+    try:
+        hdf5_path = prepare_train(dataset_name, state, options)
+
+        # Steps 2.5-4 talk to AsterixDB and mostly wait on it, so they overlap
+        # with converting the test vectors and neighbors locally
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            futures = [pool.submit(prepare_server, dataset_name, num_k, num_records, state, options),
+                       pool.submit(convert_test, dataset_name, hdf5_path, state)]
+            for fut in futures:
+                fut.result()
+
+        # Step 5: Run recall evaluation (comparing ANN vs exact); always runs,
+        # it is the measurement
+        run_stage("Running recall evaluation (ANN vs Exact)", run_query_compare.main,
+                  [dataset_name, num_queries] + sub_args)
+    except (StageFailed, DownloadError, requests.RequestException) as e:
+        print(f"[run] FAILED: {e}")
+        sys.exit(1)
 
     print("\n==============================================")
     print("ANN PIPELINE DONE")
@@ -0,0 +1,121 @@
+import csv
+import json
+import os
+import platform
+import socket
+import subprocess
+from datetime import datetime
+
+import requests
+
+from asterix_client import get_client
+from dataset_files import BASE_DIR
+
+RECORD_FORMATS = ("jsonl", "csv", "none")
+
+# Columns of a per-query record; modes leave the ones they do not measure empty
+QUERY_FIELDS = ["qid", "pass", "concurrency", "k", "probes", "recall"] + [
+    f"{prefix}_{field}" for prefix in ("ann", "exact")
+    for field in ("execution_s", "elapsed_s", "compile_s", "queue_wait_s", "client_s", "result_count",
+                  "result_size", "processed_objects")
+]
+
+
+def query_fields(prefix, ids, timings):
+    """Record fields of one ANN or exact query: server/client times and the server's counts."""
+    result_count = timings.get("result_count")
+    return {
+        f"{prefix}_execution_s": timings["execution"],
+        f"{prefix}_elapsed_s": timings["elapsed"],
+        f"{prefix}_compile_s": timings["compile"],
+        f"{prefix}_queue_wait_s": timings.get("queue_wait"),
+        f"{prefix}_client_s": timings["client"],
+        f"{prefix}_result_count": result_count if result_count is not None else len(ids),
+        f"{prefix}_result_size": timings.get("result_size"),
+        f"{prefix}_processed_objects": timings.get("processed_objects"),
+    }
+
+
+class QueryRecords:
+    """
+    Per-query records of a run, streamed to <base>_queries.jsonl (one JSON
+    object per line) or <base>_queries.csv as they are measured.
+    """
+
+    def __init__(self, base_path, fmt="jsonl"):
+        if fmt not in RECORD_FORMATS:
+            raise ValueError(f"Unknown record format: {fmt}")
+        self.path = None if fmt == "none" else f"{base_path}_queries.{fmt}"
+        self.fmt = fmt
+        self.count = 0
+        self.file = None
+        self.writer = None
+
+    def add(self, record):
+        if self.path is None:
+            return
+        if self.file is None:
+            self.file = open(self.path, "w", newline="")
+            if self.fmt == "csv":
+                self.writer = csv.DictWriter(self.file, fieldnames=QUERY_FIELDS, extrasaction="ignore")
+                self.writer.writeheader()
+        if self.writer is not None:
+            self.writer.writerow(record)
+        else:
+            self.file.write(json.dumps(record) + "\n")
+        self.count += 1
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+def git_commit(repo_dir=BASE_DIR):
+    """(commit id, whether the work tree has uncommitted changes) of this checkout, or (None, None)."""
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=repo_dir, capture_output=True, text=True,
+                                check=True).stdout.strip()
+        status = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=repo_dir,
+                                capture_output=True, text=True, check=True).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+    return commit, bool(status.strip())
+
+
+def index_metadata(ds_name_astx, index_name="ix1"):
+    """The Metadata.`Index` record of the vector index (its build parameters), or None."""
+    statement = f"""
+    SELECT VALUE i FROM Metadata.`Index` i
+    WHERE i.DataverseName = "VectorTest" AND i.DatasetName = "{ds_name_astx}" AND i.IndexName = "{index_name}";
+    """
+    try:
+        results = get_client().execute(statement, f"index_metadata_{ds_name_astx}",
+                                        idempotent=True).results
+    except requests.RequestException:
+        return None
+    return results[0] if results and isinstance(results[0], dict) else None
+
+
+def run_metadata(ds_name_astx, argv, index_name="ix1"):
+    """Where and against what a run was measured: host, code version, server build and index parameters."""
+    commit, dirty = git_commit()
+    client = get_client()
+    return {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "host": socket.gethostname(),
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "argv": list(argv),
+        "git_commit": commit,
+        "git_dirty": dirty,
+        "server": {"url": client.base_url, "version": client.server_version()},
+        "index": index_metadata(ds_name_astx, index_name),
+    }
+
+
+def write_summary(path, summary):
+    """Write the run summary JSON atomically (temp file + rename)."""
+    with open(path + ".tmp", "w") as f:
+        json.dump(summary, f, indent=2, default=str)
+    os.replace(path + ".tmp", path)
@@ -0,0 +1,129 @@
+import json
+import os
+import socket
+import sqlite3
+import sys
+from datetime import datetime
+
+from dataset_files import BASE_DIR
+
+RESULTS_DB = os.path.join(BASE_DIR, "output", "results.db")
+
+# Columns of one matrix measurement (one K x concurrency point on one index)
+MEASUREMENT_FIELDS = [
+    "dataset", "num_records", "sample", "num_clusters", "k", "concurrency", "num_queries",
+    "recall", "qps", "wall_s",
+    "mean_server_s", "p50_server_s", "p99_server_s",
+    "mean_client_s", "p50_client_s", "p99_client_s",
+    "index_build_s",
+]
+
+SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS runs (
+    run_id TEXT PRIMARY KEY,
+    started TEXT NOT NULL,
+    name TEXT,
+    config TEXT,
+    host TEXT,
+    server TEXT
+);
+CREATE TABLE IF NOT EXISTS measurements (
+    run_id TEXT NOT NULL REFERENCES runs(run_id),
+    measured TEXT NOT NULL,
+    {", ".join(MEASUREMENT_FIELDS)}
+);
+CREATE INDEX IF NOT EXISTS measurements_run ON measurements(run_id);
+CREATE TABLE IF NOT EXISTS queries (
+    measurement INTEGER NOT NULL,
+    qid INTEGER NOT NULL,
+    recall REAL,
+    server_s REAL,
+    client_s REAL
+);
+CREATE INDEX IF NOT EXISTS queries_measurement ON queries(measurement);
+"""
+
+
+def connect(path=RESULTS_DB):
+    """Open (creating if needed) the results database."""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    conn = sqlite3.connect(path)
+    conn.row_factory = sqlite3.Row
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def start_run(conn, name, config, server):
+    """Record a new run and return its id (<timestamp>_<host>, suffixed if taken)."""
+    started = datetime.now()
+    host = socket.gethostname()
+    base_id = f"{started.strftime('%Y%m%d_%H%M%S')}_{host}"
+    run_id = base_id
+    n = 1
+    while conn.execute("SELECT 1 FROM runs WHERE run_id = ?", (run_id,)).fetchone():
+        n += 1
+        run_id = f"{base_id}_{n}"
+    conn.execute("INSERT INTO runs (run_id, started, name, config, host, server) VALUES (?, ?, ?, ?, ?, ?)",
+                 (run_id, started.isoformat(timespec="seconds"), name, json.dumps(config, sort_keys=True),
+                  host, server))
+    conn.commit()
+    return run_id
+
+
+def add_measurement(conn, run_id, row, queries=()):
+    """
+    Append one measurement and its per-query (qid, recall, server_s,
+    client_s) samples; committed right away so an aborted run keeps what it
+    measured.
+    """
+    cur = conn.execute(f"INSERT INTO measurements (run_id, measured, {', '.join(MEASUREMENT_FIELDS)}) "
+                       f"VALUES (?, ?, {', '.join('?' for _ in MEASUREMENT_FIELDS)})",
+                       [run_id, datetime.now().isoformat(timespec="seconds")]
+                       + [row.get(f) for f in MEASUREMENT_FIELDS])
+    conn.executemany("INSERT INTO queries (measurement, qid, recall, server_s, client_s) VALUES (?, ?, ?, ?, ?)",
+                     [(cur.lastrowid,) + tuple(q) for q in queries])
+    conn.commit()
+
+
+def list_runs(conn):
+    """Runs with their number of measurements, oldest first."""
+    return conn.execute("""
+        SELECT r.run_id, r.started, r.name, r.server, COUNT(m.run_id) AS measurements
+        FROM runs r LEFT JOIN measurements m ON m.run_id = r.run_id
+        GROUP BY r.run_id ORDER BY r.started
+    """).fetchall()
+
+
+def load_measurements(conn, run_id):
+    """
+    Measurements of one run as dicts, in the order they were taken. Each has
+    its per-query samples under "queries" as [(qid, recall, server_s, client_s)].
+    """
+    rows = conn.execute(f"SELECT rowid, {', '.join(MEASUREMENT_FIELDS)} FROM measurements "
+                        f"WHERE run_id = ? ORDER BY rowid", (run_id,)).fetchall()
+    measurements = []
+    for row in rows:
+        m = dict(row)
+        m["queries"] = [tuple(q) for q in conn.execute(
+            "SELECT qid, recall, server_s, client_s FROM queries WHERE measurement = ? ORDER BY qid",
+            (m.pop("rowid"),))]
+        measurements.append(m)
+    return measurements
+
+
+def main():
+    path = sys.argv[1] if len(sys.argv) > 1 else RESULTS_DB
+    if not os.path.exists(path):
+        print(f"Error: results database not found: {path}")
+        print("Usage: python results_store.py [results.db]")
+        sys.exit(1)
+
+    conn = connect(path)
+    print(f"{'run_id':<32} {'started':<20} {'name':<20} {'server':<22} {'rows':>6}")
+    for run in list_runs(conn):
+        print(f"{run['run_id']:<32} {run['started']:<20} {run['name'] or '':<20} {run['server'] or '':<22} "
+              f"{run['measurements']:>6}")
+
+
+if __name__ == "__main__":
+    main()
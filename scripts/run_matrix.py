@@ -0,0 +1,253 @@
+import json
+import os
+import sys
+
+import requests
+
+from asterix_client import ASTERIX_HOST, ASTERIX_PORT
+from cli_options import parse_force, parse_options
+from dataset_files import BASE_DIR
+from downloader import DownloadError
+from ground_truth import get_ground_truth, strip_padding
+from latency_stats import LatencySeries
+from pipeline import STEPS, StageFailed, StepState, convert_test, prepare_server, prepare_train
+from results_store import RESULTS_DB, add_measurement, connect, start_run
+from run_query_compare import (TOP_K, calculate_recall, compute_exact_results, load_test_vectors, run_closed_loop,
+                               run_warmup)
+from vector_metric import serving_metric, similarity_name
+
+try:
+    import yaml
+except ImportError:  # optional: only needed for .yaml/.yml configs
+    yaml = None
+
+# Matrix axes, outermost first: a dataset is prepared once, a subset loaded
+# once per size and an index built once per (size, num_clusters); K and
+# concurrency only change the queries
+AXES = ("datasets", "sizes", "num_clusters", "k", "concurrency")
+
+DEFAULTS = {
+    "name": None,
+    "num_queries": 1000,
+    "sizes": [None],         # None / 0 / "full": the whole train set
+    "num_clusters": [256],
+    "k": [TOP_K],
+    "concurrency": [1],
+    "ground_truth": "server",
+    "warmup": 0,             # warm-up queries after each index build
+    "statement": "literal",
+    "submit": "sync",
+    "results": RESULTS_DB,
+}
+
+# Config keys passed to the pipeline steps as their --options
+PIPELINE_OPTIONS = {"sample": "sample", "seed": "seed", "sample_clusters": "clusters",
+                    "base_url": "base-url", "download_workers": "download-workers"}
+
+
+def as_list(value):
+    return value if isinstance(value, list) else [value]
+
+
+def load_config(path):
+    """
+    Read a matrix config (JSON, or YAML when PyYAML is installed), fill in
+    defaults and check it. Raises ValueError on invalid configs.
+    """
+    with open(path, "r") as f:
+        if path.endswith((".yaml", ".yml")):
+            if yaml is None:
+                raise ValueError("YAML configs need PyYAML (pip install pyyaml); use JSON instead")
+            config = yaml.safe_load(f)
+        else:
+            config = json.load(f)
+    if not isinstance(config, dict):
+        raise ValueError("config must be a mapping")
+
+    unknown = set(config) - set(DEFAULTS) - set(AXES) - set(PIPELINE_OPTIONS)
+    if unknown:
+        raise ValueError(f"unknown config keys: {', '.join(sorted(unknown))}")
+    if not config.get("datasets"):
+        raise ValueError("config must list at least one dataset")
+
+    config = {**DEFAULTS, **config}
+    for axis in AXES:
+        config[axis] = as_list(config[axis])
+    config["sizes"] = [None if size in (None, 0, "full") else int(size) for size in config["sizes"]]
+    for axis in ("num_clusters", "k", "concurrency"):
+        values = [int(v) for v in config[axis]]
+        if not values or any(v < 1 for v in values):
+            raise ValueError(f"{axis} must be a list of positive integers")
+        config[axis] = values
+    if config["ground_truth"] not in ("server", "local"):
+        raise ValueError(f"ground_truth must be 'server' or 'local', got '{config['ground_truth']}'")
+    if config["statement"] not in ("literal", "param"):
+        raise ValueError(f"statement must be 'literal' or 'param', got '{config['statement']}'")
+    if config["submit"] not in ("sync", "async"):
+        raise ValueError(f"submit must be 'sync' or 'async', got '{config['submit']}'")
+    return config
+
+
+def matrix_points(config):
+    """
+    Every (dataset, size, num_clusters, k, concurrency) combination, in config
+    order (run_matrix may start a size with the num_clusters already built).
+    """
+    return [(dataset, size, num_k, k, concurrency)
+            for dataset in config["datasets"]
+            for size in config["sizes"]
+            for num_k in config["num_clusters"]
+            for k in config["k"]
+            for concurrency in config["concurrency"]]
+
+
+def measure(test_vecs, ds_name_astx, exact_results, k, concurrency, parameterized=False, submit_async=False,
+            similarity="Euclidean"):
+    """
+    Run the query set at one (K, concurrency) point. Returns (recall, QPS and
+    latency percentiles, per-query [(qid, recall, server_s, client_s)]).
+    """
+    results, wall_time = run_closed_loop(test_vecs, ds_name_astx, concurrency, top_k=k,
+                                         parameterized=parameterized, submit_async=submit_async,
+                                         similarity=similarity)
+    server = LatencySeries("server")
+    client = LatencySeries("client")
+    for r in results:
+        server.add(r[1])
+        client.add(r[2])
+    server_stats = server.summary()
+    client_stats = client.summary()
+    queries = [(qid, calculate_recall(r[0], exact[:k]), r[1], r[2])
+               for qid, (r, exact) in enumerate(zip(results, exact_results))]
+    num = len(results)
+    return {
+        "k": k,
+        "concurrency": concurrency,
+        "num_queries": num,
+        "recall": sum(q[1] for q in queries) / num,
+        "qps": num / wall_time if wall_time > 0 else 0.0,
+        "wall_s": wall_time,
+        "mean_server_s": server_stats["mean"],
+        "p50_server_s": server_stats["p50"],
+        "p99_server_s": server_stats["p99"],
+        "mean_client_s": client_stats["mean"],
+        "p50_client_s": client_stats["p50"],
+        "p99_client_s": client_stats["p99"],
+    }, queries
+
+
+def exact_neighbors(config, dataset_name, num_records, test_vecs, ds_name_astx, similarity):
+    """Ground truth for max(k) neighbors: local NumPy (cached) or exact queries on the server."""
+    max_k = max(config["k"])
+    if config["ground_truth"] == "local":
+        return [strip_padding(row) for row in get_ground_truth(dataset_name, len(test_vecs), num_records, k=max_k)]
+    return compute_exact_results(test_vecs, ds_name_astx, print, dataset_name, num_records, k=max_k,
+                                 parameterized=config["statement"] == "param",
+                                 submit_async=config["submit"] == "async", similarity=similarity)
+
+
+def run_matrix(config, conn, run_id, force=()):
+    """Execute the matrix, appending one row per (K, concurrency) point to the results store."""
+    options = {flag: str(config[key]) for key, flag in PIPELINE_OPTIONS.items() if key in config}
+    parameterized = config["statement"] == "param"
+    submit_async = config["submit"] == "async"
+    done = 0
+    total = len(matrix_points(config))
+
+    for dataset_name in config["datasets"]:
+        state = StepState(dataset_name, force)
+        hdf5_path = prepare_train(dataset_name, state, options)
+        convert_test(dataset_name, hdf5_path, state)
+
+        similarity = similarity_name(serving_metric(dataset_name))
+        test_vecs = load_test_vectors(os.path.join(BASE_DIR, "tests", f"{dataset_name}_test.jsonl"),
+                                      limit=config["num_queries"])
+
+        for num_records in config["sizes"]:
+            index_key = f"index_{num_records}" if num_records else "index"
+            exact_results = None
+            # A size has a single index (ix1): start with the num_clusters it
+            # was last built with, so a rerun reuses it instead of rebuilding
+            built_k = state.steps.get(index_key, {}).get("details", {}).get("num_clusters")
+            for num_k in sorted(config["num_clusters"], key=lambda value: value != built_k):
+                ds_name_astx = prepare_server(dataset_name, num_k, num_records, state, options)
+                # Server build time, only when this run built the index
+                build_s = state.steps[index_key].get("details", {}).get("server_elapsed_s") \
+                    if index_key in state.ran else None
+                run_warmup(test_vecs, ds_name_astx, config["warmup"], print, parameterized, similarity)
+                if exact_results is None:
+                    exact_results = exact_neighbors(config, dataset_name, num_records, test_vecs, ds_name_astx,
+                                                    similarity)
+
+                for k in config["k"]:
+                    for concurrency in config["concurrency"]:
+                        row, queries = measure(test_vecs, ds_name_astx, exact_results, k, concurrency, parameterized,
+                                               submit_async, similarity)
+                        row.update({
+                            "dataset": dataset_name,
+                            "num_records": num_records,
+                            "sample": config.get("sample", "head") if num_records else None,
+                            "num_clusters": num_k,
+                            "index_build_s": build_s,
+                        })
+                        add_measurement(conn, run_id, row, queries)
+                        done += 1
+                        print(f"[matrix] {done}/{total} {ds_name_astx} clusters={num_k} K={k} "
+                              f"clients={concurrency}: Recall@{k} = {row['recall']:.4f} | "
+                              f"QPS = {row['qps']:.2f} | p99 client = {row['p99_client_s']:.6f}s")
+    return done
+
+
+def main(argv=None):
+    args, options = parse_options(sys.argv[1:] if argv is None else argv)
+    if len(args) != 1:
+        print("Usage: python run_matrix.py <config.json|config.yaml> [--results=PATH] [--dry-run] "
+              "[--force[=step,...]]")
+        print("Example: python run_matrix.py matrix.json")
+        print("Example: python run_matrix.py matrix.yaml --results=output/nightly.db")
+        sys.exit(1)
+
+    try:
+        config = load_config(args[0])
+    except (OSError, ValueError) as e:
+        print(f"Error: invalid config {args[0]}: {e}")
+        sys.exit(1)
+    if "results" in options:
+        config["results"] = options["results"]
+    try:
+        force = parse_force(options, STEPS)
+    except ValueError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+
+    points = matrix_points(config)
+    print("==============================================")
+    print(f"BENCHMARK MATRIX {config['name'] or args[0]}")
+    for axis in AXES:
+        print(f"{axis + ':':<14}{', '.join('full' if v is None else str(v) for v in config[axis])}")
+    print(f"Measurements: {len(points)} x {config['num_queries']} queries")
+    print(f"Results:      {config['results']}")
+    print("==============================================\n")
+    if "dry-run" in options:
+        for point in points:
+            print("[matrix] dataset={} size={} clusters={} K={} clients={}".format(
+                point[0], point[1] or "full", *point[2:]))
+        return
+
+    conn = connect(config["results"])
+    run_id = start_run(conn, config["name"], config, f"{ASTERIX_HOST}:{ASTERIX_PORT}")
+    print(f"[matrix] Run id: {run_id}")
+    try:
+        done = run_matrix(config, conn, run_id, force)
+    except (StageFailed, DownloadError, FileNotFoundError, ValueError, requests.RequestException) as e:
+        print(f"[matrix] FAILED: {e}")
+        print(f"[matrix] Measurements taken so far are kept under run id {run_id}")
+        sys.exit(1)
+    finally:
+        conn.close()
+
+    print(f"\n[matrix] {done} measurements appended to {config['results']} (run id {run_id})")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,45 +1,28 @@
-import json
-import requests
 import os
 import sys
 
+from asterix_client import get_client, result_ids
+from ground_truth import get_ground_truth, strip_padding
+from line_index import read_records
+from vector_metric import serving_metric, similarity_name
+
 # --------------------
 # Config
 # --------------------
-ASTERIX_URL = "http://localhost:19002/query/service"
-HEADERS = {"Content-Type": "application/x-www-form-urlencoded"}
-
 TOP_K = 100  # number of neighbors to retrieve per query
 
 
 def load_test_vectors(path, limit=None):
-    """Load query vectors from test.jsonl."""
-    vectors = []
-    with open(path, "r") as f:
-        for line in f:
-            obj = json.loads(line)
-            vectors.append(obj["embedding"])
-            if limit is not None and len(vectors) >= limit:
-                break
-    return vectors
+    """Load query vectors from test.jsonl (first `limit` lines, read as one block)."""
+    return [obj["embedding"] for obj in read_records(path, stop=limit)]
 
 
 def load_ground_truth(path, limit=None, k_limit=None):
     """Load ground-truth neighbor ids from neighbors.jsonl."""
-    gts = []
-    with open(path, "r") as f:
-        for line in f:
-            obj = json.loads(line)
-            neigh = obj["neighbors"]
-            if k_limit is not None and len(neigh) > k_limit:
-                neigh = neigh[:k_limit]
-            gts.append(neigh)
-            if limit is not None and len(gts) >= limit:
-                break
-    return gts
-
-
-def build_statement(target_vec, top_k, asterix_dataset_name):
+    return [obj["neighbors"][:k_limit] for obj in read_records(path, stop=limit)]
+
+
+def build_statement(target_vec, top_k, asterix_dataset_name, similarity="Euclidean"):
     """Convert target vector into SQL++ literal and build the ANN query."""
     target_literal = ", ".join(str(x) for x in target_vec)
 
@@ -47,7 +30,7 @@ def build_statement(target_vec, top_k, asterix_dataset_name):
     USE VectorTest;
     LET target=[{target_literal}]
     FROM {asterix_dataset_name} row
-    LET dist = ann_distance(row.embedding, target, "Euclidean")
+    LET dist = ann_distance(row.embedding, target, "{similarity}")
     SELECT row.idx
     ORDER BY dist
     LIMIT {top_k};
@@ -55,40 +38,29 @@ def build_statement(target_vec, top_k, asterix_dataset_name):
     return statement
 
 
-def get_ann_results(target_vec, top_k, asterix_dataset_name):
+def get_ann_results(target_vec, top_k, asterix_dataset_name, similarity="Euclidean"):
     """Send a query to AsterixDB and return ANN results."""
-    statement = build_statement(target_vec, top_k, asterix_dataset_name)
-    data = {
-        "statement": statement,
-        "pretty": "false",
-        "client_context_id": "ann_eval"
-    }
-    resp = requests.post(ASTERIX_URL, headers=HEADERS, data=data)
-    resp.raise_for_status()
-    js = resp.json()
-    rows = js.get("results", [])
-
-    ids = []
-    for row in rows:
-        if "idx" in row:
-            ids.append(row["idx"])
-        elif "row.idx" in row:
-            ids.append(row["row.idx"])
-        else:
-            raise ValueError(f"Unexpected row format: {row}")
-    return ids
+    statement = build_statement(target_vec, top_k, asterix_dataset_name, similarity)
+    response = get_client().execute(statement, client_context_id="ann_eval", idempotent=True)
+    return result_ids(response.results)
 
 
 def main():
-    if len(sys.argv) != 3:
-        print("Usage: python run_recall_dynamic.py <dataset_name> <num_queries>")
-        print("Example: python run_recall_dynamic.py fashion-mnist-784-euclidean 1000")
+    if len(sys.argv) < 3 or len(sys.argv) > 4:
+        print("Usage: python run_query.py <dataset_name> <num_queries> [num_records]")
+        print("Example: python run_query.py fashion-mnist-784-euclidean 1000")
+        print("Example: python run_query.py fashion-mnist-784-euclidean 1000 20000")
         sys.exit(1)
 
     dataset_name = sys.argv[1]                     # e.g. "fashion-mnist-784-euclidean"
     num_queries = int(sys.argv[2])                 # dynamic number of queries
+    num_records = sys.argv[3] if len(sys.argv) == 4 else None
 
-    ds_name_astx = dataset_name.replace("-", "_")  # Asterix-friendly dataset name
+    # Adjust dataset name for subdataset
+    if num_records:
+        ds_name_astx = f"{dataset_name}_{num_records}".replace("-", "_")
+    else:
+        ds_name_astx = dataset_name.replace("-", "_")  # Asterix-friendly dataset name
 
     base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
     tests_path = os.path.join(base_dir, "tests", f"{dataset_name}_test.jsonl")
@@ -97,25 +69,41 @@ def main():
     if not os.path.exists(tests_path):
         print(f"Error: test file not found: {tests_path}")
         sys.exit(1)
-    if not os.path.exists(neighbors_path):
-        print(f"Error: neighbors file not found: {neighbors_path}")
+
+    # Subdatasets (or full datasets without the neighbors JSONL) use the
+    # cached ground truth from ground_truth.py
+    use_cache = bool(num_records) or not os.path.exists(neighbors_path)
+
+    try:
+        similarity = similarity_name(serving_metric(dataset_name))
+    except ValueError as e:
+        print(f"Error: {e}")
         sys.exit(1)
 
     print(f"Dataset:            {dataset_name}")
     print(f"Asterix dataset:    {ds_name_astx}")
+    print(f"Similarity:         {similarity}")
     print(f"Queries to evaluate:{num_queries}")
     print()
 
     print("Loading query vectors and ground-truth neighbors...")
     test_vecs = load_test_vectors(tests_path, limit=num_queries)
-    gt_lists = load_ground_truth(neighbors_path, limit=num_queries, k_limit=TOP_K)
+    if use_cache:
+        try:
+            gt_ids = get_ground_truth(dataset_name, len(test_vecs), num_records, k=TOP_K)
+        except FileNotFoundError as e:
+            print(f"Error: {e}")
+            sys.exit(1)
+        gt_lists = [strip_padding(row) for row in gt_ids]
+    else:
+        gt_lists = load_ground_truth(neighbors_path, limit=num_queries, k_limit=TOP_K)
 
     assert len(test_vecs) == len(gt_lists), "Mismatch between test and neighbor lengths"
 
     total_recall = 0.0
 
     for qid, (vec, gt) in enumerate(zip(test_vecs, gt_lists)):
-        ann_ids = get_ann_results(vec, TOP_K, ds_name_astx)
+        ann_ids = get_ann_results(vec, TOP_K, ds_name_astx, similarity)
         gt_set = set(gt)
 
         hit = sum(1 for id_ in ann_ids if id_ in gt_set)
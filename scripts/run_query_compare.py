@@ -1,39 +1,105 @@
+import csv
 import json
-import requests
 import os
 import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
+import requests
+
+from asterix_client import get_client, result_ids
+from cli_options import parse_options
+from latency_stats import LatencySeries, format_count, format_histogram, format_seconds, format_summary_table
+from ground_truth import (get_ground_truth, pad_neighbor_lists, save_ground_truth, strip_padding, train_rows,
+                          train_source)
+from line_index import read_records
+from result_files import QueryRecords, RECORD_FORMATS, query_fields, run_metadata, write_summary
+from vector_metric import dataset_metric, serving_metric, similarity_name
+
 # --------------------
 # Config
 # --------------------
-ASTERIX_URL = "http://localhost:19002/query/service"
-HEADERS = {"Content-Type": "application/x-www-form-urlencoded"}
-
 TOP_K = 100  # number of neighbors to retrieve per query
+SIMILARITY = "Euclidean"  # default metric argument of ann_distance/vector_distance
+
+# Client counts used by --concurrency=sweep
+SWEEP_CONCURRENCY = [1, 2, 4, 8, 16, 32, 64]
+
+# Query-time setting that controls how many clusters the vector index probes.
+# Sent as `SET <name> "<value>";` ahead of the query; override with --probe-setting.
+PROBE_SETTING = "compiler.vector.probes"
+
+PARETO_FIELDS = ["k", "probes", "concurrency", "recall", "qps", "mean_server_s", "mean_client_s", "pareto"]
+
+# Summary rows of the concurrency and batch sweeps, as written to the summary JSON
+CONCURRENCY_FIELDS = ["concurrency", "qps", "recall", "mean_server_s", "mean_client_s", "p50_client_s",
+                      "p99_client_s", "wall_s"]
+BATCH_FIELDS = ["batch_size", "requests", "qps", "recall", "mean_request_elapsed_s", "per_query_s", "wall_s"]
+
+# Per-query timings kept as latency series (timings() key -> series name) ...
+TIMING_SERIES = {"execution": "executionTime", "elapsed": "elapsedTime", "compile": "compileTime",
+                 "queue_wait": "queueWaitTime", "client": "client round-trip"}
+# ... and server counts summarized the same way
+COUNT_SERIES = {"processed_objects": "processedObjects", "result_size": "resultSize",
+                "result_count": "resultCount"}
+
+# --cache: which passes over the query set (--passes) count in the summary
+# statistics. cold: only the first; warm: all but the first (when there are
+# several). Without --cache every pass counts.
+CACHE_MODES = ("cold", "warm")
+
+# Query profiles requested with --profile (query service "profile" parameter)
+PROFILE_MODES = ("counts", "timings")
+PROFILE_SAMPLE = 10  # queries profiled, spread evenly over the query set
+
+# Query vectors per request when exact results are computed in batches
+EXACT_BATCH_SIZE = 100
+
+
+def parse_concurrency(value):
+    """
+    Parse the --concurrency option.
+    Examples:
+        "8"       -> [8]
+        "1,4,16"  -> [1, 4, 16]
+        "sweep"   -> [1, 2, 4, 8, 16, 32, 64]
+    """
+    if value == "sweep":
+        return list(SWEEP_CONCURRENCY)
+    levels = [int(v) for v in value.split(",") if v.strip()]
+    if not levels or any(c < 1 for c in levels):
+        raise ValueError(f"Invalid concurrency levels: {value}")
+    return levels
 
 
 def load_test_vectors(path, limit=None):
-    """Load query vectors from test.jsonl."""
-    vectors = []
-    with open(path, "r") as f:
-        for line in f:
-            obj = json.loads(line)
-            vectors.append(obj["embedding"])
-            if limit is not None and len(vectors) >= limit:
-                break
-    return vectors
-
-
-def build_ann_statement(target_vec, top_k, asterix_dataset_name):
-    """Build ANN query using ann_distance."""
+    """Load query vectors from test.jsonl (first `limit` lines, read as one block)."""
+    return [obj["embedding"] for obj in read_records(path, stop=limit)]
+
+
+def parse_int_list(value):
+    """ "1,10,100" -> [1, 10, 100] """
+    return [int(v) for v in value.split(",") if v.strip()]
+
+
+def settings_prefix(settings):
+    """Render {name: value} query settings as SQL++ SET statements."""
+    if not settings:
+        return ""
+    return "".join(f'SET `{name}` "{value}";\n    ' for name, value in settings.items())
+
+
+def build_ann_statement(target_vec, top_k, asterix_dataset_name, settings=None, similarity=SIMILARITY):
+    """Build ANN query using ann_distance, optionally preceded by SET statements."""
     target_literal = ", ".join(str(x) for x in target_vec)
 
     statement = f"""
     USE VectorTest;
-    LET target=[{target_literal}]
+    {settings_prefix(settings)}LET target=[{target_literal}]
     FROM {asterix_dataset_name} row
-    LET dist = ann_distance(row.embedding, target, "Euclidean")
+    LET dist = ann_distance(row.embedding, target, "{similarity}")
     SELECT row.idx
     ORDER BY dist
     LIMIT {top_k};
@@ -41,7 +107,7 @@ def build_ann_statement(target_vec, top_k, asterix_dataset_name):
     return statement
 
 
-def build_exact_statement(target_vec, top_k, asterix_dataset_name):
+def build_exact_statement(target_vec, top_k, asterix_dataset_name, similarity=SIMILARITY):
     """Build exact query using vector_distance."""
     target_literal = ", ".join(str(x) for x in target_vec)
 
@@ -49,7 +115,7 @@ def build_exact_statement(target_vec, top_k, asterix_dataset_name):
     USE VectorTest;
     LET target=[{target_literal}]
     FROM {asterix_dataset_name} row
-    LET dist = vector_distance(row.embedding, target, "Euclidean")
+    LET dist = vector_distance(row.embedding, target, "{similarity}")
     SELECT row.idx
     ORDER BY dist
     LIMIT {top_k};
@@ -57,66 +123,97 @@ def build_exact_statement(target_vec, top_k, asterix_dataset_name):
     return statement
 
 
-def execute_query(statement):
-    """Send a query to AsterixDB and return results and execution time."""
-    data = {
-        "statement": statement,
-        "pretty": "false",
-        "client_context_id": "ann_eval"
-    }
-    resp = requests.post(ASTERIX_URL, headers=HEADERS, data=data)
-    resp.raise_for_status()
-    js = resp.json()
-    rows = js.get("results", [])
-
-    ids = []
-    for row in rows:
-        if "idx" in row:
-            ids.append(row["idx"])
-        elif "row.idx" in row:
-            ids.append(row["row.idx"])
-        else:
-            raise ValueError(f"Unexpected row format: {row}")
-    
-    # Extract execution time from metrics
-    metrics = js.get("metrics", {})
-    execution_time_str = metrics.get("executionTime", "0s")
-    
-    # Parse execution time (formats: "2.871s", "115.961ms", "1.5m", "500ns")
-    execution_time = parse_time_to_seconds(execution_time_str)
-    
-    return ids, execution_time
+def build_param_statement(distance_function, asterix_dataset_name, settings=None, similarity=SIMILARITY):
+    """
+    Fixed query text for parameterized mode: the query vector and K are bound
+    from the $target and $k statement parameters, so the text is the same for
+    every query.
+    """
+    return f"""
+    USE VectorTest;
+    {settings_prefix(settings)}FROM {asterix_dataset_name} row
+    LET dist = {distance_function}(row.embedding, $target, "{similarity}")
+    SELECT row.idx
+    ORDER BY dist
+    LIMIT $k;
+    """
 
 
-def parse_time_to_seconds(time_str):
+def build_ann_query(target_vec, top_k, asterix_dataset_name, settings=None, parameterized=False,
+                    similarity=SIMILARITY):
     """
-    Parse time string from AsterixDB metrics to seconds.
-    Supports formats: "2.871s", "115.961ms", "1.5m", "500ns", "500µs"
+    (statement, args) for the ANN query. With parameterized, the vector is
+    sent as a JSON statement parameter instead of a SQL++ literal.
     """
-    time_str = time_str.strip()
-    
-    if time_str.endswith('ns'):
-        # nanoseconds
-        return float(time_str.rstrip('ns')) / 1_000_000_000
-    elif time_str.endswith('µs') or time_str.endswith('us'):
-        # microseconds
-        value = time_str.rstrip('µs').rstrip('us')
-        return float(value) / 1_000_000
-    elif time_str.endswith('ms'):
-        # milliseconds
-        return float(time_str.rstrip('ms')) / 1_000
-    elif time_str.endswith('s'):
-        # seconds
-        return float(time_str.rstrip('s'))
-    elif time_str.endswith('m'):
-        # minutes
-        return float(time_str.rstrip('m')) * 60
-    elif time_str.endswith('h'):
-        # hours
-        return float(time_str.rstrip('h')) * 3600
+    if parameterized:
+        return build_param_statement("ann_distance", asterix_dataset_name, settings, similarity), \
+            {"target": target_vec, "k": top_k}
+    return build_ann_statement(target_vec, top_k, asterix_dataset_name, settings, similarity), None
+
+
+def build_exact_query(target_vec, top_k, asterix_dataset_name, parameterized=False, similarity=SIMILARITY):
+    """(statement, args) for the exact query; see build_ann_query."""
+    if parameterized:
+        return build_param_statement("vector_distance", asterix_dataset_name, similarity=similarity), \
+            {"target": target_vec, "k": top_k}
+    return build_exact_statement(target_vec, top_k, asterix_dataset_name, similarity), None
+
+
+def build_batch_query(target_vecs, top_k, asterix_dataset_name, distance_function="ann_distance",
+                      settings=None, parameterized=False, similarity=SIMILARITY):
+    """
+    (statement, args) for one request that answers several queries: the
+    statement iterates over the array of targets and returns the top-K ids
+    of each, as {"qid": <position in target_vecs>, "ids": [...]}.
+    """
+    if parameterized:
+        targets, limit, args = "$targets", "$k", {"targets": target_vecs, "k": top_k}
     else:
-        # default to seconds if no unit
-        return float(time_str)
+        targets = "[" + ", ".join("[" + ", ".join(str(x) for x in vec) + "]" for vec in target_vecs) + "]"
+        limit, args = top_k, None
+
+    statement = f"""
+    USE VectorTest;
+    {settings_prefix(settings)}FROM {targets} AS target AT pos
+    LET ids = (
+        FROM {asterix_dataset_name} row
+        LET dist = {distance_function}(row.embedding, target, "{similarity}")
+        SELECT VALUE row.idx
+        ORDER BY dist
+        LIMIT {limit}
+    )
+    SELECT pos - 1 AS qid, ids;
+    """
+    return statement, args
+
+
+def execute_batch(statement, num_targets, client_context_id="ann_batch", args=None):
+    """
+    Run a statement built by build_batch_query and return (ids per target,
+    timings); timings are those of the whole request.
+    """
+    response = get_client().execute(statement, client_context_id, args=args, idempotent=True)
+    ids = [[] for _ in range(num_targets)]
+    for row in response.results:
+        ids[row["qid"]] = row["ids"]
+    return ids, response.timings()
+
+
+def execute_query(statement, client_context_id="ann_eval", args=None, submit_async=False):
+    """Send a query to AsterixDB and return results and execution time."""
+    ids, timings = execute_query_with_timings(statement, client_context_id, args, submit_async)
+    return ids, timings["execution"]
+
+
+def execute_query_with_timings(statement, client_context_id="ann_eval", args=None, submit_async=False):
+    """
+    Send a query to AsterixDB and return (ids, timings) where timings holds
+    the server-reported "execution", "elapsed" and "compile" times and the
+    client round-trip time "client", all in seconds. args binds named
+    statement parameters ($target, $k); submit_async submits the query with
+    mode=async and polls for its result.
+    """
+    return get_client().query_ids(statement, client_context_id, args, submit_async)
 
 
 def calculate_recall(ann_results, exact_results):
@@ -127,16 +224,566 @@ def calculate_recall(ann_results, exact_results):
     return recall
 
 
-def main():
-    if len(sys.argv) < 3 or len(sys.argv) > 4:
-        print("Usage: python run_query_compare.py <dataset_name> <num_queries> [num_records]")
+def closed_loop_record(qid, result, exact_ids, k, concurrency, probes=None):
+    """Per-query record of one run_closed_loop result."""
+    record = {"qid": qid, "concurrency": concurrency, "k": k, "probes": probes,
+              "recall": calculate_recall(result[0], exact_ids[:k])}
+    record.update(query_fields("ann", result[0], result[4]))
+    return record
+
+
+def run_closed_loop(test_vecs, asterix_dataset_name, concurrency, top_k=TOP_K, settings=None,
+                    parameterized=False, submit_async=False, similarity=SIMILARITY):
+    """
+    Run the ANN query for every vector using `concurrency` client threads.
+
+    Each client issues its next query as soon as the previous one returns
+    (closed loop), so the server always has `concurrency` queries in flight.
+    With submit_async, the queries are async jobs driven from this thread
+    instead (see run_async_loop).
+    Returns (per-query [(ids, server_time, client_time, server_elapsed, timings)], wall_time).
+    """
+    if submit_async:
+        return run_async_loop(test_vecs, asterix_dataset_name, concurrency, top_k, settings, parameterized,
+                              similarity)
+
+    results = [None] * len(test_vecs)
+    next_qid = [0]
+    lock = threading.Lock()
+
+    def client():
+        while True:
+            with lock:
+                qid = next_qid[0]
+                next_qid[0] += 1
+            if qid >= len(test_vecs):
+                return
+            statement, query_args = build_ann_query(test_vecs[qid], top_k, asterix_dataset_name, settings,
+                                                    parameterized, similarity)
+            ids, timings = execute_query_with_timings(statement, f"ann_eval_c{concurrency}_q{qid}", query_args)
+            results[qid] = (ids, timings["execution"], timings["client"], timings["elapsed"], timings)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        futures = [pool.submit(client) for _ in range(concurrency)]
+        for fut in futures:
+            fut.result()
+    wall_time = time.perf_counter() - start
+
+    return results, wall_time
+
+
+def run_async_loop(test_vecs, asterix_dataset_name, max_outstanding, top_k=TOP_K, settings=None,
+                   parameterized=False, similarity=SIMILARITY):
+    """
+    Submit the ANN query for every vector as an async job, keeping at most
+    max_outstanding jobs running and polling them from the calling thread.
+    Same return value as run_closed_loop.
+    """
+    def jobs():
+        for qid, vec in enumerate(test_vecs):
+            statement, query_args = build_ann_query(vec, top_k, asterix_dataset_name, settings, parameterized,
+                                                    similarity)
+            yield qid, statement, f"ann_async_c{max_outstanding}_q{qid}", query_args
+
+    results = [None] * len(test_vecs)
+    start = time.perf_counter()
+    for qid, response in get_client().run_async(jobs(), max_outstanding):
+        timings = response.timings()
+        ids = result_ids(response.results)
+        results[qid] = (ids, timings["execution"], timings["client"], timings["elapsed"], timings)
+    wall_time = time.perf_counter() - start
+
+    return results, wall_time
+
+
+def run_batched_loop(test_vecs, asterix_dataset_name, batch_size, concurrency, top_k=TOP_K, settings=None,
+                     parameterized=False, similarity=SIMILARITY):
+    """
+    Like run_closed_loop, but each request carries batch_size query vectors.
+    Returns (per-query ids, per-request [(num_queries, server_time,
+    client_time, server_elapsed)], wall_time).
+    """
+    batches = [(first, test_vecs[first:first + batch_size]) for first in range(0, len(test_vecs), batch_size)]
+    ids = [None] * len(test_vecs)
+    requests_ = [None] * len(batches)
+    next_batch = [0]
+    lock = threading.Lock()
+
+    def client():
+        while True:
+            with lock:
+                b = next_batch[0]
+                next_batch[0] += 1
+            if b >= len(batches):
+                return
+            first, vecs = batches[b]
+            statement, query_args = build_batch_query(vecs, top_k, asterix_dataset_name, settings=settings,
+                                                      parameterized=parameterized, similarity=similarity)
+            batch_ids, timings = execute_batch(statement, len(vecs), f"ann_batch{batch_size}_c{concurrency}_b{b}",
+                                               query_args)
+            ids[first:first + len(vecs)] = batch_ids
+            requests_[b] = (len(vecs), timings["execution"], timings["client"], timings["elapsed"])
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        futures = [pool.submit(client) for _ in range(concurrency)]
+        for fut in futures:
+            fut.result()
+    wall_time = time.perf_counter() - start
+
+    return ids, requests_, wall_time
+
+
+def fit_request_cost(requests_):
+    """
+    Least-squares fit of server elapsed time per request = overhead +
+    per_query * queries_in_request over requests of different sizes.
+    Returns (overhead, per_query) in seconds, or None if all requests
+    carry the same number of queries.
+    """
+    sizes = [r[0] for r in requests_]
+    times = [r[3] for r in requests_]
+    n = len(sizes)
+    mean_size = sum(sizes) / n
+    mean_time = sum(times) / n
+    var = sum((x - mean_size) ** 2 for x in sizes)
+    if var == 0:
+        return None
+    per_query = sum((x - mean_size) * (y - mean_time) for x, y in zip(sizes, times)) / var
+    return mean_time - per_query * mean_size, per_query
+
+
+def run_batch_sweep(test_vecs, asterix_dataset_name, batch_sizes, concurrency, tee_print, exact_results,
+                    parameterized=False, similarity=SIMILARITY, top_k=TOP_K):
+    """
+    Measure ANN throughput and Recall@top_k with batch_size query vectors per
+    request for each batch size, and split server time into a per-request
+    (job scheduling) part and a per-query (index search) part.
+    """
+    summary = []
+    all_requests = []
+    for batch_size in batch_sizes:
+        ids, requests_, wall_time = run_batched_loop(test_vecs, asterix_dataset_name, batch_size, concurrency,
+                                                     top_k=top_k, parameterized=parameterized, similarity=similarity)
+        all_requests.extend(requests_)
+        num = len(ids)
+        mean_recall = sum(calculate_recall(r, exact[:top_k]) for r, exact in zip(ids, exact_results)) / num
+        qps = num / wall_time if wall_time > 0 else 0.0
+        mean_elapsed = sum(r[3] for r in requests_) / len(requests_)
+        per_query = sum(r[3] for r in requests_) / num
+        summary.append((batch_size, len(requests_), qps, mean_recall, mean_elapsed, per_query, wall_time))
+        tee_print(f"Batch {batch_size:4d}: QPS = {qps:.2f} | Mean Recall@{top_k} = {mean_recall:.4f} | "
+                  f"Avg server time per request: {mean_elapsed:.6f}s | per query: {per_query:.6f}s")
+
+    tee_print("\n==============================================")
+    tee_print(f"BATCHED REQUESTS SUMMARY ({concurrency} client(s))")
+    tee_print("==============================================")
+    tee_print(f"{'Batch':>6} {'Requests':>9} {'QPS':>10} {'Recall@' + str(top_k):>11} "
+              f"{'Req elapsed(s)':>15} {'Per query(s)':>13} {'Wall(s)':>9}")
+    for batch_size, num_requests, qps, mean_recall, mean_elapsed, per_query, wall_time in summary:
+        tee_print(f"{batch_size:>6} {num_requests:>9} {qps:>10.2f} {mean_recall:>11.4f} "
+                  f"{mean_elapsed:>15.6f} {per_query:>13.6f} {wall_time:>9.3f}")
+    fit = fit_request_cost(all_requests)
+    if fit is not None:
+        overhead, search = fit
+        tee_print(f"\nServer elapsed per request ~= {overhead:.6f}s overhead + {search:.6f}s per query")
+    tee_print("==============================================\n")
+    return [dict(zip(BATCH_FIELDS, row)) for row in summary]
+
+
+def cache_server_ground_truth(exact_results, dataset_name, num_records, asterix_dataset_name, k=TOP_K):
+    """
+    Store exact results returned by AsterixDB in the ground-truth cache so
+    later --ground-truth=local runs can reuse them. Skipped when the server
+    dataset does not hold exactly the local train source, e.g. a subset grown
+    with load_dataset.py --mode=append, which keeps its name.
+    """
+    try:
+        _, source, _ = train_source(dataset_name, num_records)
+        rows = train_rows(dataset_name, num_records)
+    except FileNotFoundError:
+        print("[groundtruth] Train source not found locally, not caching server results")
+        return
+    try:
+        loaded = get_client().execute(f"USE VectorTest; SELECT VALUE COUNT(*) FROM {asterix_dataset_name};",
+                                      f"gt_count_{asterix_dataset_name}", idempotent=True).results[0]
+    except (requests.RequestException, IndexError):
+        loaded = None
+    if loaded != rows:
+        print(f"[groundtruth] {asterix_dataset_name} holds {loaded} records on the server but its train source "
+              f"has {rows}, not caching server results")
+        return
+    save_ground_truth(pad_neighbor_lists(exact_results, k), dataset_name, num_records,
+                      metric=dataset_metric(dataset_name), k=k, source_paths=source, producer="server")
+
+
+def compute_exact_results(test_vecs, asterix_dataset_name, tee_print, dataset_name=None, num_records=None,
+                          k=TOP_K, parameterized=False, batch_size=None, submit_async=False,
+                          similarity=SIMILARITY):
+    """
+    Run the exact vector_distance query for every vector with a single client
+    and cache the results as ground truth. With batch_size, that many vectors
+    are sent per request.
+    """
+    tee_print("Computing exact results (single client)...")
+    exact_results = []
+    if batch_size:
+        for first in range(0, len(test_vecs), batch_size):
+            vecs = test_vecs[first:first + batch_size]
+            statement, query_args = build_batch_query(vecs, k, asterix_dataset_name, "vector_distance",
+                                                      parameterized=parameterized, similarity=similarity)
+            batch_ids, _ = execute_batch(statement, len(vecs), f"exact_batch_{first}", query_args)
+            exact_results.extend(batch_ids)
+            tee_print(f"Exact results: {len(exact_results)}/{len(test_vecs)}")
+    else:
+        for qid, vec in enumerate(test_vecs):
+            statement, query_args = build_exact_query(vec, k, asterix_dataset_name, parameterized, similarity)
+            exact_ids, _ = execute_query(statement, args=query_args, submit_async=submit_async)
+            exact_results.append(exact_ids)
+            if (qid + 1) % 50 == 0:
+                tee_print(f"Exact results: {qid + 1}/{len(test_vecs)}")
+    tee_print(f"Computed exact results for {len(exact_results)} queries\n")
+    if dataset_name:
+        cache_server_ground_truth(exact_results, dataset_name, num_records, asterix_dataset_name, k)
+    return exact_results
+
+
+def run_concurrency_sweep(test_vecs, asterix_dataset_name, levels, tee_print, exact_results=None,
+                          dataset_name=None, num_records=None, parameterized=False, exact_batch_size=None,
+                          submit_async=False, similarity=SIMILARITY, records=None):
+    """
+    Measure ANN throughput (QPS) and recall for each concurrency level.
+    Unless local ground truth is given, exact results are computed once up
+    front with a single client so the exact scans do not compete with the
+    ANN queries being measured. Per-query results go to records (a
+    QueryRecords); returns the summary rows as dicts (CONCURRENCY_FIELDS).
+    """
+    if exact_results is None:
+        exact_results = compute_exact_results(test_vecs, asterix_dataset_name, tee_print,
+                                              dataset_name, num_records, parameterized=parameterized,
+                                              batch_size=exact_batch_size, submit_async=submit_async,
+                                              similarity=similarity)
+
+    summary = []
+    for concurrency in levels:
+        results, wall_time = run_closed_loop(test_vecs, asterix_dataset_name, concurrency,
+                                             parameterized=parameterized, submit_async=submit_async,
+                                             similarity=similarity)
+
+        num = len(results)
+        mean_recall = sum(calculate_recall(r[0], exact) for r, exact in zip(results, exact_results)) / num
+        if records is not None:
+            for qid, (r, exact) in enumerate(zip(results, exact_results)):
+                records.add(closed_loop_record(qid, r, exact, TOP_K, concurrency))
+        mean_server = sum(r[1] for r in results) / num
+        mean_client = sum(r[2] for r in results) / num
+        qps = num / wall_time if wall_time > 0 else 0.0
+        client_series = LatencySeries(f"Clients {concurrency}")
+        for r in results:
+            client_series.add(r[2])
+        stats = client_series.summary()
+        summary.append((concurrency, qps, mean_recall, mean_server, mean_client, stats["p50"], stats["p99"], wall_time))
+
+        tee_print(f"Clients {concurrency:3d}: QPS = {qps:.2f} | "
+                  f"Mean Recall@{TOP_K} = {mean_recall:.4f} | "
+                  f"Avg ANN server time: {mean_server:.6f}s | "
+                  f"Avg client latency: {mean_client:.6f}s | "
+                  f"p99 client latency: {stats['p99']:.6f}s")
+
+    tee_print("\n==============================================")
+    tee_print(f"CONCURRENCY SWEEP SUMMARY")
+    tee_print("==============================================")
+    tee_print(f"{'Clients':>8} {'QPS':>10} {'Recall@' + str(TOP_K):>11} {'Server(s)':>11} {'Client(s)':>11} "
+              f"{'p50(s)':>10} {'p99(s)':>10} {'Wall(s)':>9}")
+    for concurrency, qps, mean_recall, mean_server, mean_client, p50, p99, wall_time in summary:
+        tee_print(f"{concurrency:>8} {qps:>10.2f} {mean_recall:>11.4f} "
+                  f"{mean_server:>11.6f} {mean_client:>11.6f} {p50:>10.6f} {p99:>10.6f} {wall_time:>9.3f}")
+    best = max(summary, key=lambda row: row[1])
+    tee_print(f"\nPeak QPS: {best[1]:.2f} at {best[0]} clients")
+    tee_print("==============================================\n")
+    return [dict(zip(CONCURRENCY_FIELDS, row)) for row in summary]
+
+
+def server_time_breakdown(label, series):
+    """
+    Line relating the mean compileTime, queueWaitTime and executionTime of a
+    TIMING_SERIES list to the mean elapsedTime.
+    """
+    means = {key: s.summary()["mean"] for key, s in zip(TIMING_SERIES, series) if len(s)}
+    elapsed = means.get("elapsed", 0.0)
+    if elapsed <= 0:
+        return []
+    return [f"{label} mean elapsedTime {format_seconds(elapsed)}: "
+            f"compileTime {100.0 * means['compile'] / elapsed:.1f}% | "
+            f"queueWaitTime {100.0 * means['queue_wait'] / elapsed:.1f}% | "
+            f"executionTime {100.0 * means['execution'] / elapsed:.1f}%"]
+
+
+def pass_included(pass_no, num_passes, cache_mode=None):
+    """Whether pass pass_no (1-based) of num_passes counts in the summary statistics (see CACHE_MODES)."""
+    if cache_mode == "cold":
+        return pass_no == 1
+    if cache_mode == "warm" and num_passes > 1:
+        return pass_no > 1
+    return True
+
+
+def profile_sample(num_queries, sample_size=PROFILE_SAMPLE):
+    """qids of sample_size queries spread evenly over the query set."""
+    step = max(1, num_queries // max(1, sample_size))
+    return list(range(0, num_queries, step))[:sample_size]
+
+
+def run_profiles(test_vecs, asterix_dataset_name, mode, sample_size, path, tee_print, parameterized=False,
+                 similarity=SIMILARITY):
+    """
+    Re-run the ANN and exact query of a sample of the query vectors with
+    profile=<mode> and the optimized logical plan. This runs after the
+    measurement, so profiling overhead never reaches the statistics. Each
+    response's metrics, profile and plans are written to path as one JSON
+    line per query.
+    """
+    qids = profile_sample(len(test_vecs), sample_size)
+    tee_print(f"Profiling {len(qids)} queries (profile={mode})...")
+    objects = {"ann": LatencySeries("ANN processedObjects"), "exact": LatencySeries("Exact processedObjects")}
+    profiled = 0
+    with open(path, "w") as f:
+        for qid in qids:
+            queries = (("ann", build_ann_query(test_vecs[qid], TOP_K, asterix_dataset_name,
+                                               parameterized=parameterized, similarity=similarity)),
+                       ("exact", build_exact_query(test_vecs[qid], TOP_K, asterix_dataset_name, parameterized,
+                                                   similarity)))
+            for kind, (statement, query_args) in queries:
+                response = get_client().execute(statement, f"{kind}_profile_q{qid}", args=query_args,
+                                                idempotent=True, profile=mode,
+                                                **{"optimized-logical-plan": "true", "plan-format": "json"})
+                metrics = response.metric_values()
+                if "processedObjects" in metrics:
+                    objects[kind].add(metrics["processedObjects"])
+                profiled += "profile" in response.json
+                f.write(json.dumps({"qid": qid, "query": kind, "metrics": metrics,
+                                    "profile": response.json.get("profile"),
+                                    "plans": response.json.get("plans")}) + "\n")
+    for series in objects.values():
+        if len(series):
+            tee_print(f"{series.name}: mean {format_count(series.summary()['mean'])}")
+    if profiled < 2 * len(qids):
+        tee_print(f"Note: {2 * len(qids) - profiled} of {2 * len(qids)} responses carried no profile")
+    tee_print(f"Profiles saved to: {path}\n")
+
+
+def run_warmup(test_vecs, asterix_dataset_name, num_warmup, tee_print, parameterized=False,
+               similarity=SIMILARITY):
+    """
+    Issue num_warmup ANN queries (cycling through the query set) whose
+    results and timings are discarded, so measured queries do not pay for
+    cold caches.
+    """
+    if num_warmup <= 0 or not test_vecs:
+        return
+    tee_print(f"Running {num_warmup} warm-up queries (excluded from statistics)...")
+    for i in range(num_warmup):
+        statement, query_args = build_ann_query(test_vecs[i % len(test_vecs)], TOP_K, asterix_dataset_name,
+                                                parameterized=parameterized, similarity=similarity)
+        execute_query(statement, client_context_id=f"ann_warmup_{i}", args=query_args)
+    tee_print("")
+
+
+def pareto_frontier(points):
+    """
+    Points not dominated in (recall, QPS): no other point has both higher-or-
+    equal recall and higher QPS. Returned in decreasing recall order.
+    """
+    frontier = []
+    best_qps = -1.0
+    for point in sorted(points, key=lambda p: (-p["recall"], -p["qps"])):
+        if point["qps"] > best_qps:
+            frontier.append(point)
+            best_qps = point["qps"]
+    return frontier
+
+
+def run_probe_sweep(test_vecs, asterix_dataset_name, probe_values, k_values, concurrency, tee_print,
+                    exact_results, csv_path, probe_setting=PROBE_SETTING, parameterized=False,
+                    submit_async=False, similarity=SIMILARITY, records=None):
+    """
+    Measure recall@K and QPS for every (K, probes) combination over the same
+    query set, and mark the recall/QPS Pareto frontier for each K (as in
+    ann-benchmarks plots). exact_results must hold at least max(k_values)
+    ids per query. Points are written to csv_path, per-query results to
+    records (a QueryRecords).
+    """
+    points = []
+    for k in k_values:
+        for probes in probe_values:
+            settings = {probe_setting: probes} if probes is not None else None
+            results, wall_time = run_closed_loop(test_vecs, asterix_dataset_name, concurrency,
+                                                 top_k=k, settings=settings, parameterized=parameterized,
+                                                 submit_async=submit_async, similarity=similarity)
+            num = len(results)
+            if records is not None:
+                for qid, (r, exact) in enumerate(zip(results, exact_results)):
+                    records.add(closed_loop_record(qid, r, exact, k, concurrency, probes))
+            point = {
+                "k": k,
+                "probes": probes if probes is not None else "default",
+                "concurrency": concurrency,
+                "recall": sum(calculate_recall(r[0], exact[:k]) for r, exact in zip(results, exact_results)) / num,
+                "qps": num / wall_time if wall_time > 0 else 0.0,
+                "mean_server_s": sum(r[1] for r in results) / num,
+                "mean_client_s": sum(r[2] for r in results) / num,
+                "pareto": False,
+            }
+            points.append(point)
+            tee_print(f"K={k:<4} probes={point['probes']!s:<8}: Recall@{k} = {point['recall']:.4f} | "
+                      f"QPS = {point['qps']:.2f}")
+
+    for k in k_values:
+        for point in pareto_frontier([p for p in points if p["k"] == k]):
+            point["pareto"] = True
+
+    tee_print("\n==============================================")
+    tee_print(f"RECALL vs QPS (* = Pareto frontier)")
+    tee_print("==============================================")
+    tee_print(f"{'K':>5} {'Probes':>8} {'Recall':>8} {'QPS':>10} {'Server(s)':>11} {'Client(s)':>11}")
+    for p in points:
+        mark = "*" if p["pareto"] else " "
+        tee_print(f"{p['k']:>5} {p['probes']!s:>8} {p['recall']:>8.4f} {p['qps']:>10.2f} "
+                  f"{p['mean_server_s']:>11.6f} {p['mean_client_s']:>11.6f} {mark}")
+    tee_print("==============================================\n")
+
+    with open(csv_path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=PARETO_FIELDS)
+        writer.writeheader()
+        writer.writerows(points)
+    tee_print(f"Recall/QPS points saved to: {csv_path}")
+    return points
+
+
+def run_statement_comparison(test_vecs, asterix_dataset_name, tee_print, similarity=SIMILARITY):
+    """
+    Run the ANN query set once with literal statements and once with the
+    parameterized statement, and report compileTime, server and client
+    latencies side by side together with the client-side statement build time.
+    """
+    modes = (("literal", False), ("param", True))
+    series = {}
+    for label, parameterized in modes:
+        build = LatencySeries(f"{label} statement build")
+        compile_ = LatencySeries(f"{label} compileTime")
+        execution = LatencySeries(f"{label} executionTime")
+        elapsed = LatencySeries(f"{label} elapsedTime")
+        client = LatencySeries(f"{label} client round-trip")
+        for qid, vec in enumerate(test_vecs):
+            start = time.perf_counter()
+            statement, query_args = build_ann_query(vec, TOP_K, asterix_dataset_name, parameterized=parameterized,
+                                                    similarity=similarity)
+            build.add(time.perf_counter() - start)
+            _, timings = execute_query_with_timings(statement, f"ann_{label}_q{qid}", query_args)
+            compile_.add(timings["compile"])
+            execution.add(timings["execution"])
+            elapsed.add(timings["elapsed"])
+            client.add(timings["client"])
+        series[label] = [build, compile_, execution, elapsed, client]
+        tee_print(f"Ran {len(test_vecs)} queries with {label} statements")
+
+    tee_print("\n==============================================")
+    tee_print("LITERAL vs PARAMETERIZED STATEMENTS")
+    tee_print("==============================================")
+    for line in format_summary_table(series["literal"] + series["param"]):
+        tee_print(line)
+    tee_print("")
+    for literal, param in zip(series["literal"], series["param"]):
+        name = literal.name[len("literal "):]
+        before = literal.summary()["mean"]
+        after = param.summary()["mean"]
+        saved = 100.0 * (before - after) / before if before > 0 else 0.0
+        tee_print(f"Mean {name + ':':<22} {format_seconds(before):>11} -> {format_seconds(after):>11} "
+                  f"({saved:+.1f}% saved)")
+    tee_print("==============================================\n")
+    return {s.name: s.summary() for label, _ in modes for s in series[label]}
+
+
+def main(argv=None):
+    args, options = parse_options(sys.argv[1:] if argv is None else argv)
+
+    if len(args) < 2 or len(args) > 3:
+        print("Usage: python run_query_compare.py <dataset_name> <num_queries> [num_records] "
+              "[--concurrency=N[,N...]|sweep] [--ground-truth=server|local]")
+        print("         [--probes=P1,P2,...] [--k-values=K1,K2,...] [--probe-setting=name]")
+        print("         [--warmup=N] [--histogram] [--statement=literal|param|compare]")
+        print("         [--batch-size=B[,B...]] [--exact-batch-size=B] [--submit=sync|async]")
+        print("         [--records=jsonl|csv|none] [--profile=counts|timings] [--profile-sample=N]")
+        print("         [--passes=N] [--cache=cold|warm]")
         print("Example: python run_query_compare.py fashion-mnist-784-euclidean 1000")
         print("Example: python run_query_compare.py fashion-mnist-784-euclidean 1000 20000")
+        print("Example: python run_query_compare.py fashion-mnist-784-euclidean 1000 20000 --concurrency=sweep")
+        print("Example: python run_query_compare.py fashion-mnist-784-euclidean 1000 20000 --ground-truth=local")
+        print("Example: python run_query_compare.py fashion-mnist-784-euclidean 1000 20000 "
+              "--probes=1,2,4,8,16 --k-values=1,10,100")
+        print("Example: python run_query_compare.py fashion-mnist-784-euclidean 1000 20000 --statement=compare")
+        print("Example: python run_query_compare.py fashion-mnist-784-euclidean 10000 --batch-size=1,10,100")
+        print("Example: python run_query_compare.py fashion-mnist-784-euclidean 1000 --submit=async --concurrency=32")
         sys.exit(1)
 
-    dataset_name = sys.argv[1]
-    num_queries = int(sys.argv[2])
-    num_records = sys.argv[3] if len(sys.argv) == 4 else None
+    dataset_name = args[0]
+    num_queries = int(args[1])
+    num_records = args[2] if len(args) == 3 else None
+    concurrency_levels = parse_concurrency(options["concurrency"]) if "concurrency" in options else None
+    ground_truth_mode = options.get("ground-truth", "server")
+    if ground_truth_mode not in ("server", "local"):
+        print(f"Error: --ground-truth must be 'server' or 'local', got '{ground_truth_mode}'")
+        sys.exit(1)
+    use_local_gt = ground_truth_mode == "local"
+    probe_sweep = "probes" in options or "k-values" in options
+    probe_values = parse_int_list(options["probes"]) if options.get("probes") else [None]
+    k_values = parse_int_list(options["k-values"]) if options.get("k-values") else [TOP_K]
+    probe_setting = options.get("probe-setting", PROBE_SETTING)
+    num_warmup = int(options.get("warmup", 0))
+    show_histogram = "histogram" in options
+    statement_mode = options.get("statement", "literal")
+    if statement_mode not in ("literal", "param", "compare"):
+        print(f"Error: --statement must be literal, param or compare, got '{statement_mode}'")
+        sys.exit(1)
+    parameterized = statement_mode == "param"
+    batch_sizes = parse_int_list(options["batch-size"]) if options.get("batch-size") else None
+    if "exact-batch-size" in options:
+        exact_batch_size = int(options["exact-batch-size"])
+    else:
+        exact_batch_size = EXACT_BATCH_SIZE if batch_sizes else None
+    if batch_sizes and len(k_values) > 1:
+        print("Error: --batch-size measures a single K; give one --k-values value")
+        sys.exit(1)
+    submit_mode = options.get("submit", "sync")
+    if submit_mode not in ("sync", "async"):
+        print(f"Error: --submit must be 'sync' or 'async', got '{submit_mode}'")
+        sys.exit(1)
+    submit_async = submit_mode == "async"
+    record_format = options.get("records", "jsonl")
+    if record_format not in RECORD_FORMATS:
+        print(f"Error: --records must be one of {', '.join(RECORD_FORMATS)}, got '{record_format}'")
+        sys.exit(1)
+    profile_mode = options.get("profile")
+    if profile_mode is not None and profile_mode not in PROFILE_MODES:
+        print(f"Error: --profile must be one of {', '.join(PROFILE_MODES)}, got '{profile_mode}'")
+        sys.exit(1)
+    profile_sample_size = int(options.get("profile-sample", PROFILE_SAMPLE))
+    num_passes = int(options.get("passes", 1))
+    cache_mode = options.get("cache")
+    if num_passes < 1:
+        print(f"Error: --passes must be at least 1, got {num_passes}")
+        sys.exit(1)
+    if cache_mode is not None and cache_mode not in CACHE_MODES:
+        print(f"Error: --cache must be one of {', '.join(CACHE_MODES)}, got '{cache_mode}'")
+        sys.exit(1)
+    if cache_mode == "cold" and num_warmup:
+        print("Error: --cache=cold measures the first pass over the query set; it cannot be combined with --warmup")
+        sys.exit(1)
+    if cache_mode == "cold" and not use_local_gt:
+        print("Error: --cache=cold needs --ground-truth=local; the exact queries scan the dataset before the "
+              "first pass")
+        sys.exit(1)
 
     # Adjust dataset name for subdataset
     if num_records:
@@ -146,6 +793,12 @@ def main():
         ds_name_astx = dataset_name.replace("-", "_")
         display_name = dataset_name
 
+    try:
+        similarity = similarity_name(serving_metric(dataset_name))
+    except ValueError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+
     base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
     tests_path = os.path.join(base_dir, "tests", f"{dataset_name}_test.jsonl")
 
@@ -174,68 +827,289 @@ def main():
         output_file.write(msg + "\n")
         output_file.flush()
 
+    # Machine-readable results next to the text file: per-query records and a summary JSON
+    records = QueryRecords(output_path[:-len(".txt")], record_format)
+    summary_path = output_path[:-len(".txt")] + "_summary.json"
+    run_info = {
+        "dataset": dataset_name,
+        "num_records": int(num_records) if num_records else None,
+        "asterix_dataset": ds_name_astx,
+        "num_queries": num_queries,
+        "similarity": similarity,
+        "top_k": TOP_K,
+        "ground_truth": ground_truth_mode,
+        "statement": statement_mode,
+        "submit": submit_mode,
+        "warmup": num_warmup,
+    }
+    metadata = run_metadata(ds_name_astx, sys.argv[1:] if argv is None else argv)
+
+    def finish(mode, results):
+        """Profile a sample of queries if asked, then write the summary JSON and close the output files."""
+        records.close()
+        files = {"text": output_path, "queries": records.path if records.count else None}
+        if profile_mode:
+            files["profiles"] = output_path[:-len(".txt")] + "_profiles.jsonl"
+            run_profiles(test_vecs, ds_name_astx, profile_mode, profile_sample_size, files["profiles"], tee_print,
+                         parameterized, similarity)
+        write_summary(summary_path, {"mode": mode, "run": run_info, "metadata": metadata, "results": results,
+                                     "files": files})
+        output_file.close()
+        print(f"Results saved to: {output_path}")
+        if records.count:
+            print(f"Per-query records saved to: {records.path}")
+        print(f"Summary saved to: {summary_path}")
+
     tee_print("==============================================")
     tee_print(f"Dataset:            {display_name}")
     tee_print(f"Asterix dataset:    {ds_name_astx}")
     tee_print(f"Queries to evaluate:{num_queries}")
-    tee_print(f"Comparing ANN (ann_distance) vs Exact (vector_distance)")
+    tee_print(f"Similarity:         {similarity}")
+    if use_local_gt:
+        tee_print(f"Comparing ANN (ann_distance) vs Exact (local NumPy ground truth)")
+    else:
+        tee_print(f"Comparing ANN (ann_distance) vs Exact (vector_distance)")
+    if parameterized:
+        tee_print("Statements:         parameterized ($target, $k)")
+    if submit_async:
+        tee_print("Submission:         async (mode=async, polled)")
     tee_print("==============================================\n")
 
+    if num_passes > 1 or cache_mode:
+        tee_print(f"Query set passes:   {num_passes}" + (f" ({cache_mode} statistics)" if cache_mode else ""))
     tee_print("Loading query vectors...")
     test_vecs = load_test_vectors(tests_path, limit=num_queries)
     tee_print(f"Loaded {len(test_vecs)} query vectors\n")
 
+    local_gt = None
+    if use_local_gt:
+        try:
+            gt_ids = get_ground_truth(dataset_name, len(test_vecs), num_records,
+                                      k=max(k_values) if probe_sweep else TOP_K)
+        except FileNotFoundError as e:
+            print(f"Error: {e}")
+            sys.exit(1)
+        local_gt = [strip_padding(row) for row in gt_ids]
+        tee_print(f"Loaded local ground truth for {len(local_gt)} queries\n")
+
+    run_warmup(test_vecs, ds_name_astx, num_warmup, tee_print, parameterized, similarity)
+
+    if statement_mode == "compare":
+        finish("statement-compare", run_statement_comparison(test_vecs, ds_name_astx, tee_print, similarity))
+        return
+
+    if batch_sizes:
+        exact_results = local_gt
+        if exact_results is None:
+            exact_results = compute_exact_results(test_vecs, ds_name_astx, tee_print, dataset_name, num_records,
+                                                  k=k_values[0], parameterized=parameterized,
+                                                  batch_size=exact_batch_size, similarity=similarity)
+        finish("batch-sweep", run_batch_sweep(test_vecs, ds_name_astx, batch_sizes,
+                                              concurrency_levels[0] if concurrency_levels else 1,
+                                              tee_print, exact_results, parameterized, similarity, k_values[0]))
+        return
+
+    if probe_sweep:
+        exact_results = local_gt
+        if exact_results is None:
+            exact_results = compute_exact_results(test_vecs, ds_name_astx, tee_print, dataset_name, num_records,
+                                                  k=max(k_values), parameterized=parameterized,
+                                                  batch_size=exact_batch_size, submit_async=submit_async,
+                                                  similarity=similarity)
+        points = run_probe_sweep(test_vecs, ds_name_astx, probe_values, k_values,
+                                 concurrency_levels[0] if concurrency_levels else 1, tee_print,
+                                 exact_results, output_path[:-len(".txt")] + "_pareto.csv", probe_setting,
+                                 parameterized, submit_async, similarity, records)
+        finish("probe-sweep", points)
+        return
+
+    if concurrency_levels:
+        levels = run_concurrency_sweep(test_vecs, ds_name_astx, concurrency_levels, tee_print,
+                                       exact_results=local_gt, dataset_name=dataset_name, num_records=num_records,
+                                       parameterized=parameterized, exact_batch_size=exact_batch_size,
+                                       submit_async=submit_async, similarity=similarity, records=records)
+        finish("concurrency-sweep", levels)
+        return
+
     total_recall = 0.0
     total_ann_time = 0.0
     total_exact_time = 0.0
 
-    for qid, vec in enumerate(test_vecs):
-        # Run ANN query
-        ann_ids, ann_time = execute_query(build_ann_statement(vec, TOP_K, ds_name_astx))
-        total_ann_time += ann_time
-        
-        # Run exact query
-        exact_ids, exact_time = execute_query(build_exact_statement(vec, TOP_K, ds_name_astx))
-        total_exact_time += exact_time
-        
-        # Calculate recall
-        recall = calculate_recall(ann_ids, exact_ids)
-        total_recall += recall
-
-        tee_print(f"Query {qid}: Recall@{TOP_K} = {recall:.4f} | "
-                  f"ANN: {ann_time:.6f}s | Exact: {exact_time:.6f}s")
-
-        if (qid + 1) % 50 == 0:
-            mean_recall = total_recall / (qid + 1)
-            mean_ann_time = total_ann_time / (qid + 1)
-            mean_exact_time = total_exact_time / (qid + 1)
-            tee_print(f"Processed {qid + 1}/{num_queries} queries. "
-                      f"Mean Recall@{TOP_K} = {mean_recall:.4f} | "
-                      f"Avg ANN time: {mean_ann_time:.6f}s | "
-                      f"Avg Exact time: {mean_exact_time:.6f}s")
-
-    mean_recall = total_recall / num_queries
-    mean_ann_time = total_ann_time / num_queries
-    mean_exact_time = total_exact_time / num_queries
+    # Per-query latencies and server counts, summarized as percentiles after the loop
+    ann_series = [LatencySeries(f"ANN {name}") for name in TIMING_SERIES.values()]
+    exact_series = [LatencySeries(f"Exact {name}") for name in TIMING_SERIES.values()]
+    ann_counts = [LatencySeries(f"ANN {name}") for name in COUNT_SERIES.values()]
+    exact_counts = [LatencySeries(f"Exact {name}") for name in COUNT_SERIES.values()]
+
+    def record(series, counts, timings):
+        for s, key in zip(series, TIMING_SERIES):
+            s.add(timings[key])
+        for s, key in zip(counts, COUNT_SERIES):
+            if timings.get(key) is not None:
+                s.add(timings[key])
+
+    # Exact queries run once, before the passes, so every pass times only ANN
+    # queries (skipped when ground truth was computed locally)
+    exact_ids_by_qid = local_gt
+    exact_timings_by_qid = [None] * len(test_vecs)
+    if local_gt is None:
+        tee_print("Computing exact results (single client)...")
+        exact_ids_by_qid = []
+        for qid, vec in enumerate(test_vecs):
+            statement, query_args = build_exact_query(vec, TOP_K, ds_name_astx, parameterized, similarity)
+            exact_ids, exact_timings = execute_query_with_timings(statement, args=query_args,
+                                                                  submit_async=submit_async)
+            total_exact_time += exact_timings["execution"]
+            record(exact_series, exact_counts, exact_timings)
+            exact_ids_by_qid.append(exact_ids)
+            exact_timings_by_qid[qid] = exact_timings
+            if (qid + 1) % 50 == 0:
+                tee_print(f"Exact results: {qid + 1}/{len(test_vecs)} | "
+                          f"Avg Exact time: {total_exact_time / (qid + 1):.6f}s")
+        tee_print(f"Computed exact results for {len(exact_ids_by_qid)} queries\n")
+        cache_server_ground_truth(exact_ids_by_qid, dataset_name, num_records, ds_name_astx)
+
+    # Per-pass statistics (all passes, whether or not they count in the summary)
+    pass_stats = []
+    measured = 0  # ANN queries in the summary statistics
+
+    for pass_no in range(1, num_passes + 1):
+        included = pass_included(pass_no, num_passes, cache_mode)
+        pass_recall = 0.0
+        pass_series = [LatencySeries(f"Pass {pass_no} ANN executionTime"),
+                       LatencySeries(f"Pass {pass_no} ANN client round-trip")]
+        if num_passes > 1:
+            tee_print(f"--- Pass {pass_no}/{num_passes}" + ("" if included else " (excluded from summary)"))
+
+        for qid, vec in enumerate(test_vecs):
+            # Run ANN query
+            statement, query_args = build_ann_query(vec, TOP_K, ds_name_astx, parameterized=parameterized,
+                                                    similarity=similarity)
+            ann_ids, ann_timings = execute_query_with_timings(statement, args=query_args,
+                                                              submit_async=submit_async)
+            ann_time = ann_timings["execution"]
+            pass_series[0].add(ann_time)
+            pass_series[1].add(ann_timings["client"])
+            if included:
+                total_ann_time += ann_time
+                record(ann_series, ann_counts, ann_timings)
+
+            # Exact results from before the passes; their timings go with the first pass's records
+            exact_ids = exact_ids_by_qid[qid]
+            exact_timings = exact_timings_by_qid[qid] if pass_no == 1 else None
+
+            # Calculate recall
+            recall = calculate_recall(ann_ids, exact_ids)
+            pass_recall += recall
+            if included:
+                total_recall += recall
+                measured += 1
+
+            query_record = {"qid": qid, "pass": pass_no, "concurrency": 1, "k": TOP_K, "recall": recall}
+            query_record.update(query_fields("ann", ann_ids, ann_timings))
+            if exact_timings is not None:
+                query_record.update(query_fields("exact", exact_ids, exact_timings))
+            records.add(query_record)
+
+            prefix = f"Pass {pass_no} " if num_passes > 1 else ""
+            if exact_timings is None:
+                tee_print(f"{prefix}Query {qid}: Recall@{TOP_K} = {recall:.4f} | ANN: {ann_time:.6f}s")
+            else:
+                tee_print(f"{prefix}Query {qid}: Recall@{TOP_K} = {recall:.4f} | "
+                          f"ANN: {ann_time:.6f}s | Exact: {exact_timings['execution']:.6f}s")
+
+            if (qid + 1) % 50 == 0:
+                tee_print(f"Processed {qid + 1}/{len(test_vecs)} queries. "
+                          f"Mean Recall@{TOP_K} = {pass_recall / (qid + 1):.4f} | "
+                          f"Avg ANN time: {pass_series[0].summary()['mean']:.6f}s")
+
+        pass_stats.append({
+            "pass": pass_no,
+            "included": included,
+            "recall": pass_recall / len(test_vecs),
+            "execution": pass_series[0].summary(),
+            "client": pass_series[1].summary(),
+        })
+
+    mean_recall = total_recall / measured
+    mean_ann_time = total_ann_time / measured
+    mean_exact_time = total_exact_time / len(test_vecs)
     speedup = mean_exact_time / mean_ann_time if mean_ann_time > 0 else 0
     
     tee_print("\n==============================================")
     tee_print(f"RESULTS SUMMARY")
     tee_print("==============================================")
-    tee_print(f"Queries evaluated:        {num_queries}")
+    tee_print(f"Queries evaluated:        {measured}" + (f" ({cache_mode} passes of {num_passes})"
+                                                            if num_passes > 1 and cache_mode else ""))
     tee_print(f"Mean Recall@{TOP_K}:        {mean_recall:.4f}")
     tee_print(f"")
     tee_print(f"Avg ANN query time:       {mean_ann_time:.6f}s")
-    tee_print(f"Avg Exact query time:     {mean_exact_time:.6f}s")
-    tee_print(f"Speedup (Exact/ANN):      {speedup:.2f}x")
+    if local_gt is None:
+        tee_print(f"Avg Exact query time:     {mean_exact_time:.6f}s")
+        tee_print(f"Speedup (Exact/ANN):      {speedup:.2f}x")
     tee_print(f"")
     tee_print(f"Total ANN time:           {total_ann_time:.3f}s")
-    tee_print(f"Total Exact time:         {total_exact_time:.3f}s")
+    if local_gt is None:
+        tee_print(f"Total Exact time:         {total_exact_time:.3f}s")
     tee_print("==============================================\n")
-    
-    # Close output file
-    output_file.close()
-    print(f"Results saved to: {output_path}")
+
+    all_series = ann_series + (exact_series if local_gt is None else [])
+    tee_print("LATENCY DISTRIBUTION")
+    tee_print("==============================================")
+    for line in format_summary_table(all_series):
+        tee_print(line)
+    tee_print("==============================================\n")
+    if show_histogram:
+        for series in all_series:
+            for line in format_histogram(series):
+                tee_print(line)
+            tee_print("")
+
+    all_counts = ann_counts + (exact_counts if local_gt is None else [])
+    tee_print("SERVER METRICS")
+    tee_print("==============================================")
+    if any(len(series) for series in all_counts):
+        for line in format_summary_table(all_counts, formatter=format_count):
+            tee_print(line)
+        tee_print("")
+    for line in server_time_breakdown("ANN", ann_series) + \
+            (server_time_breakdown("Exact", exact_series) if local_gt is None else []):
+        tee_print(line)
+    if local_gt is None and len(ann_counts[0]) and len(exact_counts[0]):
+        ann_objects = ann_counts[0].summary()["mean"]
+        exact_objects = exact_counts[0].summary()["mean"]
+        if exact_objects > 0:
+            tee_print(f"ANN processedObjects: {100.0 * ann_objects / exact_objects:.2f}% of the exact scan")
+    tee_print("==============================================\n")
+
+    if num_passes > 1:
+        tee_print("PER-PASS STATISTICS")
+        tee_print("==============================================")
+        tee_print(f"{'Pass':>5} {'Recall@' + str(TOP_K):>11} {'Exec mean':>11} {'Exec p99':>11} "
+                  f"{'Client mean':>12} {'Client p50':>11} {'Client p99':>11}  Summary")
+        for p in pass_stats:
+            tee_print(f"{p['pass']:>5} {p['recall']:>11.4f} {format_seconds(p['execution']['mean']):>11} "
+                      f"{format_seconds(p['execution']['p99']):>11} {format_seconds(p['client']['mean']):>12} "
+                      f"{format_seconds(p['client']['p50']):>11} {format_seconds(p['client']['p99']):>11}  "
+                      f"{'yes' if p['included'] else 'no'}")
+        first, rest = pass_stats[0]["client"]["mean"], [p["client"]["mean"] for p in pass_stats[1:]]
+        warm = sum(rest) / len(rest)
+        if warm > 0:
+            later = f"passes 2-{num_passes}" if num_passes > 2 else "pass 2"
+            tee_print(f"\nCold/warm client latency: pass 1 mean is {first / warm:.2f}x the mean of {later}")
+        tee_print("==============================================\n")
+
+    finish("per-query", {
+        "queries": measured,
+        "cache": cache_mode,
+        "passes": pass_stats,
+        "mean_recall": mean_recall,
+        "mean_ann_s": mean_ann_time,
+        "mean_exact_s": mean_exact_time if local_gt is None else None,
+        "speedup": speedup if local_gt is None else None,
+        "latency": {series.name: series.summary() for series in all_series},
+        "server_counts": {series.name: series.summary() for series in all_counts if len(series)},
+    })
 
 
 if __name__ == "__main__":
@@ -0,0 +1,115 @@
+import os
+
+from dataset_manifest import load_manifest
+
+# Base project directory (scripts/vector_metric.py -> parent)
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+RAW_DIR = os.path.join(BASE_DIR, "raw")
+
+DEFAULT_METRIC = "euclidean"
+
+# ann-benchmarks metric -> AsterixDB name used for "similarity" in
+# CREATE VECTOR INDEX and as the metric argument of ann_distance/vector_distance
+SIMILARITY = {
+    "euclidean": "Euclidean",
+    "angular": "Cosine",
+    "dot": "Dot",
+}
+
+# Other spellings found in dataset names and HDF5 "distance" attributes
+ALIASES = {
+    "l2": "euclidean",
+    "cosine": "angular",
+    "ip": "dot",
+    "inner-product": "dot",
+    "mips": "dot",
+}
+
+
+# ann-benchmarks metrics AsterixDB cannot index or query with
+UNSUPPORTED = ("hamming", "jaccard")
+
+
+def canonical_metric(name):
+    """
+    "Cosine" -> "angular", "l2" -> "euclidean"; None if no name is given.
+    Raises ValueError for metrics AsterixDB does not support.
+    """
+    if not name:
+        return None
+    canonical = name.strip().lower().replace("_", "-")
+    canonical = ALIASES.get(canonical, canonical)
+    if canonical not in SIMILARITY:
+        raise ValueError(f"Unsupported metric: {name} (supported: {', '.join(SIMILARITY)})")
+    return canonical
+
+
+def metric_from_name(dataset_name):
+    """
+    Metric from the dataset name suffix, as ann-benchmarks names them.
+    Examples:
+        fashion-mnist-784-euclidean -> euclidean
+        glove-200-angular -> angular
+    Returns None if the suffix is not a metric name; raises ValueError if it
+    names an unsupported one (e.g. kosarak-jaccard).
+    """
+    suffix = dataset_name.rsplit("-", 1)[-1].lower()
+    if suffix not in SIMILARITY and suffix not in ALIASES and suffix not in UNSUPPORTED:
+        return None
+    return canonical_metric(suffix)
+
+
+def metric_from_hdf5(path):
+    """
+    The "distance" attribute of an ann-benchmarks HDF5 file, or None.
+    Raises ValueError if it names an unsupported metric.
+    """
+    if not os.path.exists(path):
+        return None
+
+    import h5py
+
+    with h5py.File(path, "r") as f:
+        distance = f.attrs.get("distance")
+    if isinstance(distance, bytes):
+        distance = distance.decode()
+    try:
+        return canonical_metric(distance)
+    except ValueError as e:
+        raise ValueError(f"{path}: {e}") from None
+
+
+def dataset_metric(dataset_name):
+    """
+    Distance metric that defines the true neighbors of a dataset: the
+    dataset manifest, then the raw HDF5 "distance" attribute, then the
+    name suffix. Euclidean only when none of them records a metric; raises
+    ValueError when the first one that does names an unsupported metric.
+    """
+    manifest = load_manifest(dataset_name)
+    if manifest and manifest.get("metric"):
+        return canonical_metric(manifest["metric"])
+    return (metric_from_hdf5(os.path.join(RAW_DIR, f"{dataset_name}.hdf5"))
+            or metric_from_name(dataset_name)
+            or DEFAULT_METRIC)
+
+
+def serving_metric(dataset_name):
+    """
+    Metric AsterixDB should index and query with. Angular data normalized
+    to unit length at conversion is served as Euclidean, which ranks unit
+    vectors the same way as cosine distance.
+    """
+    manifest = load_manifest(dataset_name)
+    if manifest and manifest.get("normalized"):
+        return "euclidean"
+    return dataset_metric(dataset_name)
+
+
+def similarity_name(metric):
+    """AsterixDB similarity name for a metric ("angular" -> "Cosine")."""
+    canonical = canonical_metric(metric)
+    if canonical is None:
+        raise ValueError(f"Unsupported metric: {metric} (supported: {', '.join(SIMILARITY)})")
+    return SIMILARITY[canonical]